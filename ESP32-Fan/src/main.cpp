@@ -4,12 +4,13 @@
  * MQTT Topics:
  * - Publish: device/new (đăng ký device)
  * - Publish: device/data/{deviceId} (gửi trạng thái)
- * - Subscribe: device/control/{deviceId} (nhận lệnh)
+ * - Subscribe: device/control/{deviceId} (nhận lệnh, QoS 1)
+ * - Publish: device/ack/{deviceId} (xác nhận lệnh có cmdId)
  * 
  * Commands (JSON):
- * - {"action": "ON"}
- * - {"action": "OFF"}
- * - {"action": "SET_SPEED", "speed": 0-3}
+ * - {"action": "ON", "cmdId": "..."}
+ * - {"action": "OFF", "cmdId": "..."}
+ * - {"action": "SET_SPEED", "speed": 0-3, "cmdId": "..."}
  */
 
 #include <Arduino.h>
@@ -44,6 +45,8 @@ PubSubClient mqtt(espClient);
 String deviceId;
 String controlTopic;
 String dataTopic;
+String ackTopic;
+String lastCmdId;  // Backend gửi lại cùng cmdId khi chưa nhận ack -> không thực hiện lại
 
 bool fanOn = false;
 int fanSpeed = 0;  // 0 = OFF, 1-3 = speed levels
@@ -92,6 +95,20 @@ void setFanSpeed(int speed) {
     publishState();
 }
 
+// Xác nhận lệnh kèm trạng thái hiện tại
+void publishAck(const char* cmdId, bool ok, const char* error) {
+    StaticJsonDocument<200> doc;
+    doc["cmdId"] = cmdId;
+    doc["status"] = ok ? "OK" : "ERROR";
+    if (error) doc["error"] = error;
+    doc["state"] = fanOn ? "ON" : "OFF";
+    doc["speed"] = fanSpeed;
+
+    char buffer[256];
+    serializeJson(doc, buffer);
+    mqtt.publish(ackTopic.c_str(), buffer);
+}
+
 void mqttCallback(char* topic, byte* payload, unsigned int length) {
     Serial.printf("MQTT [%s]\n", topic);
 
@@ -104,7 +121,16 @@ void mqttCallback(char* topic, byte* payload, unsigned int length) {
     }
 
     const char* action = doc["action"] | "";
+    const char* cmdId = doc["cmdId"] | "";
+    bool hasCmdId = strlen(cmdId) > 0;
+
+    if (hasCmdId && lastCmdId == cmdId) {
+        // Lệnh gửi lại (ack trước bị mất): chỉ ack lại
+        publishAck(cmdId, true, nullptr);
+        return;
+    }
 
+    bool ok = true;
     if (strcmp(action, "ON") == 0) {
         fanOn = true;
         if (fanSpeed == 0) fanSpeed = 1;
@@ -126,6 +152,12 @@ void mqttCallback(char* topic, byte* payload, unsigned int length) {
 
     } else {
         Serial.printf("Unknown action: %s\n", action);
+        ok = false;
+    }
+
+    if (hasCmdId) {
+        if (ok) lastCmdId = cmdId;
+        publishAck(cmdId, ok, ok ? nullptr : "Unknown action");
     }
 }
 
@@ -174,7 +206,7 @@ void reconnectMQTT() {
 
         if (mqtt.connect(clientId.c_str())) {
             Serial.println(" ok");
-            mqtt.subscribe(controlTopic.c_str());
+            mqtt.subscribe(controlTopic.c_str(), 1);
             registerDevice();
             return;
 
@@ -239,6 +271,7 @@ void setup() {
     // Setup MQTT topics
     controlTopic = "device/control/" + deviceId;
     dataTopic = "device/data/" + deviceId;
+    ackTopic = "device/ack/" + deviceId;
 
     Serial.println("ID: " + deviceId);
     Serial.println("Control: " + controlTopic);
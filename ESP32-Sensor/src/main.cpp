@@ -41,6 +41,9 @@ float humidity = 0;
 unsigned long lastPublish = 0;
 const unsigned long PUBLISH_INTERVAL = 1500;
 
+// 1 = gửi device/data dạng nhị phân bin1 (6 byte) thay cho JSON, khai báo khi đăng ký
+#define TELEMETRY_BINARY 0
+
 // WIFI setup
 void setupWiFi() {
     Serial.print("WiFi");
@@ -78,6 +81,9 @@ void registerDevice() {
     doc["bssid"] = WIFI_BSSID;
     doc["controllerMAC"] = deviceId;
     doc["state"] = "online";
+#if TELEMETRY_BINARY
+    doc["telemetryEncoding"] = "bin1";
+#endif
 
     char buffer[300];
     serializeJson(doc, buffer);
@@ -120,6 +126,15 @@ void readAndPublish() {
     delay(100);
     digitalWrite(STATUS_LED, HIGH);
 
+    String topic = "device/data/" + deviceId;
+#if TELEMETRY_BINARY
+    // 0xB1 | flags (temperature + humidity) | int16 temp x100 | uint16 hum x100, little-endian
+    int16_t t100 = (int16_t)lroundf(temperature * 100);
+    uint16_t h100 = (uint16_t)lroundf(humidity * 100);
+    uint8_t frame[6] = {0xB1, 0x03, (uint8_t)(t100 & 0xFF), (uint8_t)((uint16_t)t100 >> 8),
+                        (uint8_t)(h100 & 0xFF), (uint8_t)(h100 >> 8)};
+    mqtt.publish(topic.c_str(), frame, sizeof(frame));
+#else
     StaticJsonDocument<200> doc;
     doc["temperature"] = temperature;
     doc["humidity"] = humidity;
@@ -128,9 +143,8 @@ void readAndPublish() {
 
     char buffer[256];
     serializeJson(doc, buffer);
-
-    String topic = "device/data/" + deviceId;
     mqtt.publish(topic.c_str(), buffer);
+#endif
 
     Serial.printf("Temp: %.1f C | Hum: %.1f %%\r\n", temperature, humidity);
 }
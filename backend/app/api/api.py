@@ -3,6 +3,9 @@ from app.api.endpoints import auth
 from app.api.endpoints import home, room
 from app.api.endpoints import device
 from app.api.endpoints import activity_log
+from app.api.endpoints import automation
+from app.api.endpoints import profiler
+from app.api.endpoints import recording
 
 api_router = APIRouter()
 api_router.include_router(auth.router, tags=["auth"])
@@ -10,5 +13,8 @@ api_router.include_router(home.router, prefix="/homes", tags=["homes"])
 api_router.include_router(room.router, prefix="/rooms", tags=["rooms"])
 api_router.include_router(device.router, prefix="/devices", tags=["devices"])
 api_router.include_router(activity_log.router, prefix="/activity-logs", tags=["activity-logs"])
+api_router.include_router(automation.router, prefix="/automations", tags=["automations"])
+api_router.include_router(recording.router, prefix="/recordings", tags=["recordings"])
+api_router.include_router(profiler.router, prefix="/debug/profiler", tags=["debug"])
 
 
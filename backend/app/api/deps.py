@@ -33,6 +33,15 @@ async def get_current_user(token: str = Depends(reusable_oauth2)) -> User:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
+# Chỉ cho phép các username cấu hình trong ADMIN_USERNAMES
+async def get_current_admin_user(current_user: User = Depends(get_current_user)) -> User:
+    if current_user.username not in settings.ADMIN_USERNAMES:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin privileges required",
+        )
+    return current_user
+
 # Lấy user từ token query param (cho camera stream vì <img> không gửi header được)
 async def get_current_user_from_query(token: str = Query(...)) -> User:
     try:
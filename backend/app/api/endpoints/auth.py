@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response
+from fastapi import APIRouter, Depends, HTTPException, status, Response, Request
 from starlette.responses import JSONResponse # Sửa dòng này
 from app.schemas.auth import (
     UserRegister,
@@ -38,12 +38,14 @@ async def register(user_in: UserRegister):
 
 
 @router.post("/login", response_model=Token)
-async def login(user_in: UserLogin):
+async def login(user_in: UserLogin, request: Request):
     """
     Authenticate user and return tokens.
     """
     user = await AuthService.authenticate_user(
-        username=user_in.username, password=user_in.password
+        username=user_in.username,
+        password=user_in.password,
+        client_ip=request.client.host if request.client else None,
     )
     if not user:
         raise HTTPException(
@@ -107,6 +109,24 @@ async def logout(
     
     return {"message": "Logged out successfully"}
 
+# Đăng xuất khỏi mọi thiết bị: xóa toàn bộ session của user trong một lệnh
+@router.post("/logout-all", status_code=status.HTTP_200_OK)
+async def logout_all(current_user: User = Depends(deps.get_current_user)):
+    """
+    Revoke every refresh token (session) of the current user.
+    """
+    user_homes = await HomeService.get_user_homes(current_user)
+    for home in user_homes:
+        await ActivityLogService.create_log(
+            action="LOGOUT",
+            message=f"User {current_user.username} logged out from all devices",
+            userId=str(current_user.id),
+            homeId=str(home.id)
+        )
+
+    revoked = await AuthService.revoke_all_sessions(current_user.id)
+    return {"message": "Logged out from all devices", "revokedSessions": revoked}
+
 # Lấy access token từ header ==> giải mã ra current_user ==> trả về chính đối tượng này
 @router.get("/me", response_model=UserResponse)
 async def read_users_me(current_user: User = Depends(deps.get_current_user)):
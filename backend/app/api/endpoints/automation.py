@@ -0,0 +1,89 @@
+from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status
+from app.api import deps
+from app.api.utils import automation_rule_to_response
+from app.models.user import User
+from app.schemas.automation import AutomationRuleCreate, AutomationRuleUpdate, AutomationRuleResponse
+from app.services.automation import AutomationService
+from app.services.activity_log import ActivityLogService
+
+router = APIRouter()
+
+@router.post("/", response_model=AutomationRuleResponse, status_code=status.HTTP_201_CREATED)
+async def create_rule(
+    rule_in: AutomationRuleCreate,
+    current_user: User = Depends(deps.get_current_user)
+):
+    rule = await AutomationService.create_rule(rule_in, current_user)
+    if not rule:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Home or devices not found or you don't have permission"
+        )
+
+    await ActivityLogService.create_log(
+        action="CREATE_AUTOMATION",
+        message=f"Created automation: {rule.name}",
+        userId=str(current_user.id),
+        homeId=str(rule.homeId)
+    )
+    return automation_rule_to_response(rule)
+
+@router.get("/", response_model=List[AutomationRuleResponse])
+async def read_rules(
+    homeId: str,
+    current_user: User = Depends(deps.get_current_user)
+):
+    rules = await AutomationService.get_rules_by_home(homeId, current_user)
+    return [automation_rule_to_response(rule) for rule in rules]
+
+@router.get("/{rule_id}", response_model=AutomationRuleResponse)
+async def read_rule(
+    rule_id: str,
+    current_user: User = Depends(deps.get_current_user)
+):
+    rule = await AutomationService.get_rule_by_id(rule_id, current_user)
+    if not rule:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Automation not found or you don't have permission"
+        )
+    return automation_rule_to_response(rule)
+
+@router.put("/{rule_id}", response_model=AutomationRuleResponse)
+async def update_rule(
+    rule_id: str,
+    rule_in: AutomationRuleUpdate,
+    current_user: User = Depends(deps.get_current_user)
+):
+    rule = await AutomationService.update_rule(rule_id, rule_in, current_user)
+    if not rule:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Automation not found or you don't have permission"
+        )
+    return automation_rule_to_response(rule)
+
+@router.delete("/{rule_id}", status_code=status.HTTP_200_OK)
+async def delete_rule(
+    rule_id: str,
+    current_user: User = Depends(deps.get_current_user)
+):
+    rule = await AutomationService.get_rule_by_id(rule_id, current_user)
+    if not rule:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Automation not found or you don't have permission"
+        )
+
+    rule_name = rule.name
+    home_id = str(rule.homeId)
+    await AutomationService.delete_rule(rule_id, current_user)
+
+    await ActivityLogService.create_log(
+        action="DELETE_AUTOMATION",
+        message=f"Deleted automation: {rule_name}",
+        userId=str(current_user.id),
+        homeId=home_id
+    )
+    return {"message": "Automation deleted successfully"}
@@ -1,25 +1,53 @@
-from typing import List
+from typing import Dict, List, Optional
 from datetime import datetime
 import logging
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, Response, RedirectResponse
 from app.api import deps
 from app.models.user import User
 from app.models.device import Device
 from app.schemas.device import DeviceCreate, DeviceUpdate, DeviceResponse, DeviceCommand, NewDeviceInLAN
 from app.services.device import DeviceService
-from app.services.camera import CameraStream
+from app.core.config import settings
 from app.services.activity_log import ActivityLogService
 from app.api.utils import device_to_response
+from app.services import stream_routing
+from app.services.command_tracker import command_tracker
+from app.services import shadow
 import asyncio
-import cv2
+import time
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 DEVICE_OFFLINE_SECONDS = 7
+# Pipeline không có viewer lâu hơn ngưỡng này thì dừng (viewer ngắt trước khi body bắt đầu)
+STREAM_IDLE_STOP_SECONDS = 10
 
-# Global dict để lưu các camera stream đang chạy
+# Global dict để lưu các camera stream đang chạy (trong process này, xem stream_routing khi chạy nhiều instance)
 active_camera_streams = {}
+_stream_locks: Dict[str, asyncio.Lock] = {}
+# Viewer đã nhận response nhưng generate() chưa chạy (chưa subscribe): giữ pipeline không bị dừng
+_reserved_viewers: Dict[str, int] = {}
+
+
+def _unreserve_viewer(device_id: str):
+    count = _reserved_viewers.get(device_id, 0) - 1
+    if count > 0:
+        _reserved_viewers[device_id] = count
+    else:
+        _reserved_viewers.pop(device_id, None)
+
+
+def _stop_if_unwatched(device_id: str, stream):
+    """Dừng pipeline khi không còn ai xem (chạy trên event loop)"""
+    if stream.subscriber_count() > 0 or _reserved_viewers.get(device_id):
+        return
+    stream.stop()
+    # Xóa stream khỏi dict
+    if active_camera_streams.get(device_id) is stream:
+        del active_camera_streams[device_id]
+        asyncio.create_task(stream_routing.release(device_id))
+    logger.info(f"✅ Camera stream stopped and cleaned up for device: {device_id}")
 
 # GET specific endpoints BEFORE generic ones
 @router.get("/lan", response_model=List[DeviceResponse])
@@ -67,7 +95,9 @@ async def read_devices(
 # Camera stream - phải đặt TRƯỚC /{device_id} để tránh conflict
 @router.get("/camera-stream")
 async def camera_stream(
+    request: Request,
     device_id: str,
+    adaptive: bool = True,
     current_user: User = Depends(deps.get_current_user_from_query)
 ):
     device = await DeviceService.get_device_by_id(device_id, current_user)
@@ -77,70 +107,202 @@ async def camera_stream(
             detail="Device not found or no stream URL"
         )
 
-    # Khởi tạo CameraStream với deviceId
-    stream = CameraStream(
-        device.streamUrl, 
-        deviceId=device_id,
-        humanDetectionMode=device.humanDetectionEnabled or False
-    )
-    stream.start()
-    
-    # Lưu stream vào dict
-    active_camera_streams[device_id] = stream
-    
-    # Background task để cập nhật FPS vào database mỗi 2 giây
-    async def update_fps_task():
-        while device_id in active_camera_streams:
+    # Lock theo device: hai viewer đến cùng lúc không mở hai pipeline cho một camera
+    # (giữa lúc kiểm tra và lúc tạo stream có await tới coordinator)
+    async with _stream_locks.setdefault(device_id, asyncio.Lock()):
+        # Dùng chung pipeline nếu camera đã có người xem
+        stream = active_camera_streams.get(device_id)
+        if stream is None or not stream.running:
+            # Pipeline đang chạy ở instance khác -> chuyển viewer tới đó (token nằm trong query)
             try:
-                fps = stream.get_fps()
-                if fps > 0:
-                    # Cập nhật fps vào database
-                    from beanie import PydanticObjectId
-                    device_obj = await Device.get(PydanticObjectId(device_id))
-                    if device_obj:
-                        await device_obj.update({"$set": {"fps": fps}})
-                await asyncio.sleep(2)
+                owner_url = await stream_routing.remote_owner_url(device_id)
             except Exception as e:
-                logger.error(f"Error updating FPS: {e}")
-                break
-    
-    # Chạy background task
-    asyncio.create_task(update_fps_task())
+                # Coordinator (Redis) lỗi -> không biết chủ sở hữu, phục vụ tại chỗ
+                logger.warning(f"Stream owner lookup failed, serving locally: {e}")
+                owner_url = None
+            if owner_url:
+                return RedirectResponse(f"{owner_url.rstrip('/')}{request.url.path}?{request.url.query}", status_code=307)
+
+            # Import khi có camera đầu tiên: API không phải load OpenCV/numpy lúc khởi động
+            from app.services.camera_worker import create_camera_stream
+            # Khởi tạo CameraStream (trong process này hoặc worker process) với deviceId
+            stream = create_camera_stream(
+                device.streamUrl, 
+                deviceId=device_id,
+                humanDetectionMode=device.humanDetectionEnabled or False,
+                detectionRegions=device.detectionRegions
+            )
+            stream.start()
+        
+            # Lưu stream vào dict
+            active_camera_streams[device_id] = stream
+            try:
+                await stream_routing.claim(device_id)
+            except Exception as e:
+                # Stream vẫn chạy tại chỗ, chưa có chủ sở hữu; update_fps_task thử claim lại
+                logger.warning(f"Stream ownership claim failed: {e}")
+        
+            # Background task để cập nhật FPS vào database mỗi 2 giây (kèm gia hạn quyền sở hữu stream)
+            async def update_fps_task():
+                idle_since = None
+                while active_camera_streams.get(device_id) is stream:
+                    if stream.subscriber_count() == 0:
+                        idle_since = idle_since or time.monotonic()
+                        if time.monotonic() - idle_since > STREAM_IDLE_STOP_SECONDS:
+                            # Viewer ngắt trước khi generate() chạy: bỏ chỗ đã giữ
+                            _reserved_viewers.pop(device_id, None)
+                            _stop_if_unwatched(device_id, stream)
+                            break
+                    else:
+                        idle_since = None
+                    try:
+                        await stream_routing.claim(device_id)
+                        if stream_routing.is_owner(device_id):
+                            await stream_routing.publish_status(device_id, stream)
+                    except Exception as e:
+                        logger.warning(f"Stream ownership renew failed: {e}")
+                    try:
+                        fps = stream.get_fps()
+                        if fps > 0:
+                            # Cập nhật fps vào database
+                            from beanie import PydanticObjectId
+                            device_obj = await Device.get(PydanticObjectId(device_id))
+                            if device_obj:
+                                await device_obj.update({"$set": {"fps": fps}})
+                        await asyncio.sleep(2)
+                    except Exception as e:
+                        logger.error(f"Error updating FPS: {e}")
+                        break
+        
+            # Chạy background task
+            asyncio.create_task(update_fps_task())
+
+        _reserved_viewers[device_id] = _reserved_viewers.get(device_id, 0) + 1
 
     async def generate():
+        # Subscribe trong generator: finally bên dưới luôn chạy khi đã subscribe
+        _unreserve_viewer(device_id)
+        subscriber = stream.subscribe(asyncio.get_running_loop(), adaptive=adaptive)
         try:
-            while stream.running:
-                frame = stream.get_processed_frame()
-                if frame is not None:
-                    # JPEG quality 70 để giảm kích thước, tăng tốc độ encode
-                    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
-                    if ret:
-                        try:
-                            yield (b'--frame\r\n'
-                                   b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
-                        except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError) as e:
-                            # Client đã ngắt kết nối
-                            logger.info(f"Client disconnected from camera stream: {device_id} - {e}")
-                            break
-                        except Exception as e:
-                            logger.error(f"Stream error: {e}")
-                            break
-                
-                await asyncio.sleep(0.05)  
+            while stream.running and not subscriber.closed:
+                item = await subscriber.next_frame()
+                if item is None:
+                    continue
+                level = subscriber.controller.level
+                # Mức 0 dùng JPEG đã encode sẵn trong pipeline, mức thấp hơn encode lại (ngoài event loop)
+                jpeg = item.jpeg if level == 0 else await asyncio.to_thread(stream.encode_for, item, level)
+                if jpeg is None:
+                    continue
+                send_start = time.perf_counter()
+                try:
+                    # yield bị chặn khi buffer socket đầy -> đo được tốc độ đọc của client
+                    yield (b'--frame\r\n'
+                           b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+                except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError) as e:
+                    # Client đã ngắt kết nối
+                    logger.info(f"Client disconnected from camera stream: {device_id} - {e}")
+                    break
+                except Exception as e:
+                    logger.error(f"Stream error: {e}")
+                    break
+                subscriber.record_send(len(jpeg), time.perf_counter() - send_start)
+                # Từ lúc capture tới khi frame đã được ghi vào socket của client
+                stream.stats.observe("glassToClient", time.time() - item.ts)
         except asyncio.CancelledError:
             # Request bị cancel (client disconnect)
             logger.info(f"Stream cancelled for device: {device_id}")
         except Exception as e:
             logger.error(f"Unexpected error in stream: {e}")
         finally:
-            stream.stop()
-            # Xóa stream khỏi dict
-            if device_id in active_camera_streams:
-                del active_camera_streams[device_id]
-            logger.info(f"✅ Camera stream stopped and cleaned up for device: {device_id}")
+            stream.unsubscribe(subscriber)
+            # Chỉ dừng pipeline khi không còn ai xem
+            _stop_if_unwatched(device_id, stream)
 
     return StreamingResponse(generate(), media_type='multipart/x-mixed-replace; boundary=frame')
 
+@router.get("/{device_id}/camera-health")
+async def camera_health(
+    device_id: str,
+    current_user: User = Depends(deps.get_current_user)
+):
+    """Trạng thái capture (CONNECTING/STREAMING/RECONNECTING) của camera đang được xem"""
+    device = await DeviceService.get_device_by_id(device_id, current_user)
+    if not device:
+        raise HTTPException(
+            status_code=404,
+            detail="Device not found or you don't have permission"
+        )
+    stream = active_camera_streams.get(device_id)
+    if stream is None or not stream.running:
+        return await stream_routing.get_status(device_id, "health") or {"state": "IDLE"}
+    return stream.get_health()
+
+@router.get("/{device_id}/stream-stats")
+async def camera_stream_stats(
+    device_id: str,
+    current_user: User = Depends(deps.get_current_user)
+):
+    """Số liệu pipeline của camera đang chạy: FPS capture, decode/inference/encode p50/p95, drop, độ trễ tới client"""
+    device = await DeviceService.get_device_by_id(device_id, current_user)
+    if not device:
+        raise HTTPException(
+            status_code=404,
+            detail="Device not found or you don't have permission"
+        )
+    stream = active_camera_streams.get(device_id)
+    if stream is None or not stream.running:
+        return await stream_routing.get_status(device_id, "stats") or {"captureState": "IDLE", "subscriberCount": 0}
+    return stream.get_stats()
+
+@router.get("/{device_id}/occupancy")
+async def camera_occupancy(
+    device_id: str,
+    current_user: User = Depends(deps.get_current_user)
+):
+    """Số người đang trong khung hình (theo track) và tổng lượt vào/ra của camera đang chạy detection"""
+    device = await DeviceService.get_device_by_id(device_id, current_user)
+    if not device:
+        raise HTTPException(
+            status_code=404,
+            detail="Device not found or you don't have permission"
+        )
+    stream = active_camera_streams.get(device_id)
+    if stream is None or not stream.running:
+        return await stream_routing.get_status(device_id, "occupancy") or {"occupancy": 0, "entries": 0, "exits": 0, "tracks": []}
+    return stream.get_occupancy()
+
+@router.get("/{device_id}/snapshot")
+async def camera_snapshot(
+    device_id: str,
+    width: Optional[int] = Query(None, ge=32, le=1920),
+    current_user: User = Depends(deps.get_current_user_from_query)
+):
+    """Thumbnail JPEG của camera (cache theo TTL), dùng cho grid view nhiều camera"""
+    device = await DeviceService.get_device_by_id(device_id, current_user)
+    if not device or not device.streamUrl:
+        raise HTTPException(
+            status_code=404,
+            detail="Device not found or no stream URL"
+        )
+
+    from app.services.snapshot import SnapshotService
+    jpeg = await SnapshotService.get_snapshot(
+        device_id,
+        device.streamUrl,
+        width or settings.SNAPSHOT_DEFAULT_WIDTH,
+        stream=active_camera_streams.get(device_id)
+    )
+    if jpeg is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Camera is not reachable"
+        )
+    return Response(
+        content=jpeg,
+        media_type="image/jpeg",
+        headers={"Cache-Control": f"private, max-age={int(settings.SNAPSHOT_TTL_SECONDS)}"}
+    )
+
 @router.get("/{device_id}", response_model=DeviceResponse)
 async def read_device(
     device_id: str,
@@ -231,14 +393,69 @@ async def delete_device(
 async def send_command(
     device_id: str,
     command: DeviceCommand,
+    wait: bool = False,
     current_user: User = Depends(deps.get_current_user)
 ):
+    """
+    Gửi lệnh tới device. Trả về cmdId và trạng thái (PENDING/CONFIRMED/REJECTED/TIMEOUT);
+    wait=true chờ device xác nhận trước khi trả về.
+    """
     logger.info(f"📤 Device command: {device_id} - Action: {command.action}")
-    success = await DeviceService.send_command(device_id, command, current_user)
-    if not success:
+    result = await DeviceService.send_command(device_id, command, current_user, wait=wait)
+    if result is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Device not found or you don't have permission"
+        )
+    logger.info(f"✅ Command {result.get('cmdId')} for device {device_id}: {result['status']}")
+    return {"message": "Command sent successfully", "command": result}
+
+@router.get("/{device_id}/commands")
+async def list_commands(
+    device_id: str,
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(deps.get_current_user)
+):
+    """Các lệnh gần đây của device (trong RAM của instance đã gửi lệnh)"""
+    device = await DeviceService.get_device_by_id(device_id, current_user)
+    if not device:
+        raise HTTPException(
+            status_code=404,
+            detail="Device not found or you don't have permission"
+        )
+    return [command.to_dict() for command in command_tracker.recent(device_id, limit)]
+
+@router.get("/{device_id}/commands/{cmd_id}")
+async def get_command(
+    device_id: str,
+    cmd_id: str,
+    current_user: User = Depends(deps.get_current_user)
+):
+    """Trạng thái một lệnh theo cmdId"""
+    device = await DeviceService.get_device_by_id(device_id, current_user)
+    if not device:
+        raise HTTPException(
+            status_code=404,
+            detail="Device not found or you don't have permission"
+        )
+    command = command_tracker.get(cmd_id)
+    if command is None or command.deviceId != device_id:
+        raise HTTPException(
+            status_code=404,
+            detail="Command not found"
+        )
+    return command.to_dict()
+
+@router.get("/{device_id}/shadow")
+async def get_shadow(
+    device_id: str,
+    current_user: User = Depends(deps.get_current_user)
+):
+    """Desired / reported / delta của device"""
+    device = await DeviceService.get_device_by_id(device_id, current_user)
+    if not device:
         raise HTTPException(
             status_code=404,
             detail="Device not found or you don't have permission"
         )
-    logger.info(f"✅ Command executed successfully for device: {device_id}")
-    return {"message": "Command sent successfully"}
\ No newline at end of file
+    return shadow.to_dict(device.shadow)
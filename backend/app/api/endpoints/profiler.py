@@ -0,0 +1,69 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+from app.api import deps
+from app.core.config import settings
+from app.core.profiler import profiler, thread_cpu_times
+from app.models.user import User
+
+router = APIRouter()
+
+
+def _require_enabled():
+    if not settings.PROFILING_ENABLED:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profiling is disabled"
+        )
+
+
+@router.post("/start")
+async def start_profiler(
+    seconds: float = Query(10, gt=0, le=300),
+    intervalMs: float = Query(10, ge=1, le=1000),
+    current_user: User = Depends(deps.get_current_admin_user)
+):
+    """Bắt đầu lấy mẫu stack của tất cả thread trong `seconds` giây"""
+    _require_enabled()
+    if not profiler.start(seconds, intervalMs / 1000):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Profiler is already running"
+        )
+    return profiler.status()
+
+
+@router.post("/stop")
+async def stop_profiler(current_user: User = Depends(deps.get_current_admin_user)):
+    _require_enabled()
+    profiler.stop()
+    return profiler.status()
+
+
+@router.get("/status")
+async def profiler_status(current_user: User = Depends(deps.get_current_admin_user)):
+    _require_enabled()
+    return profiler.status()
+
+
+@router.get("/collapsed", response_class=PlainTextResponse)
+async def download_collapsed(current_user: User = Depends(deps.get_current_admin_user)):
+    """Tải file collapsed-stack (flamegraph.pl / speedscope)"""
+    _require_enabled()
+    return PlainTextResponse(
+        profiler.collapsed(),
+        headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'}
+    )
+
+
+@router.get("/threads")
+async def thread_stats(current_user: User = Depends(deps.get_current_admin_user)):
+    """CPU time theo thread của process và của từng CameraStream đang chạy"""
+    _require_enabled()
+    from app.api.endpoints.device import active_camera_streams
+    return {
+        "threads": thread_cpu_times(),
+        "cameraStreams": {
+            device_id: stream.get_thread_cpu_times()
+            for device_id, stream in list(active_camera_streams.items())
+        },
+    }
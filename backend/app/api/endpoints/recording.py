@@ -0,0 +1,158 @@
+import os
+import re
+import time
+import asyncio
+from datetime import datetime
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+from app.api import deps
+from app.core.config import settings
+from app.models.user import User
+from app.schemas.recording import RecordingResponse
+from app.services.device import DeviceService
+from app.services.recording import RecordingIndex
+
+router = APIRouter()
+
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+_CHUNK_SIZE = 64 * 1024
+
+
+async def _get_device_or_404(device_id: str, user: User):
+    device = await DeviceService.get_device_by_id(device_id, user)
+    if not device:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Device not found or you don't have permission"
+        )
+    return device
+
+
+async def _segment_or_404(device_id: str, segment_id: str) -> dict:
+    segment = await asyncio.to_thread(RecordingIndex.get_segment, device_id, segment_id)
+    if not segment:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Recording not found")
+    return segment
+
+
+def _to_response(segment: dict) -> RecordingResponse:
+    base = f"{settings.API_V1_STR}/recordings/{segment['deviceId']}/{segment['id']}"
+    return RecordingResponse(
+        id=segment["id"],
+        deviceId=segment["deviceId"],
+        startedAt=datetime.fromtimestamp(segment["startedAt"]),
+        endedAt=datetime.fromtimestamp(segment["endedAt"]),
+        durationSec=round(segment["endedAt"] - segment["startedAt"], 2),
+        frames=segment["frames"],
+        bytes=segment["bytes"],
+        playbackUrl=f"{base}/playback",
+        fileUrl=f"{base}/file",
+    )
+
+
+@router.get("/", response_model=List[RecordingResponse])
+async def list_recordings(
+    deviceId: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: User = Depends(deps.get_current_user)
+):
+    """Danh sách clip của camera, mới nhất trước, lọc theo khoảng thời gian"""
+    await _get_device_or_404(deviceId, current_user)
+    segments = await asyncio.to_thread(
+        RecordingIndex.list_segments,
+        deviceId,
+        start.timestamp() if start else None,
+        end.timestamp() if end else None,
+    )
+    return [_to_response(s) for s in segments]
+
+
+@router.get("/{device_id}/{segment_id}/file")
+async def download_recording(
+    device_id: str,
+    segment_id: str,
+    request: Request,
+    current_user: User = Depends(deps.get_current_user_from_query)
+):
+    """File MJPEG thô của segment, hỗ trợ Range request để tua"""
+    await _get_device_or_404(device_id, current_user)
+    await _segment_or_404(device_id, segment_id)
+    path = RecordingIndex.data_path(device_id, segment_id)
+    file_size = await asyncio.to_thread(os.path.getsize, path)
+
+    start, end = 0, file_size - 1
+    status_code = status.HTTP_200_OK
+    range_header = request.headers.get("range")
+    if range_header:
+        match = _RANGE_RE.match(range_header.strip())
+        if not match or (not match.group(1) and not match.group(2)):
+            raise HTTPException(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                detail="Invalid range",
+                headers={"Content-Range": f"bytes */{file_size}"},
+            )
+        if match.group(1):
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), file_size - 1)
+        else:
+            # bytes=-N: N byte cuối
+            start = max(0, file_size - int(match.group(2)))
+        if start > end or start >= file_size:
+            raise HTTPException(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                detail="Range not satisfiable",
+                headers={"Content-Range": f"bytes */{file_size}"},
+            )
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+
+    def iter_file():
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(end - start + 1),
+        "Content-Disposition": f'inline; filename="{segment_id}.mjpeg"',
+    }
+    if status_code == status.HTTP_206_PARTIAL_CONTENT:
+        headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+    return StreamingResponse(iter_file(), status_code=status_code, media_type="video/x-motion-jpeg", headers=headers)
+
+
+@router.get("/{device_id}/{segment_id}/playback")
+async def playback_recording(
+    device_id: str,
+    segment_id: str,
+    offsetSec: float = 0,
+    current_user: User = Depends(deps.get_current_user_from_query)
+):
+    """Phát lại segment dạng multipart MJPEG (dùng được trong thẻ <img>) theo nhịp gốc"""
+    await _get_device_or_404(device_id, current_user)
+    segment = await _segment_or_404(device_id, segment_id)
+    seek_to = segment["startedAt"] + max(0.0, offsetSec)
+
+    async def generate():
+        first_ts = None
+        wall_start = time.monotonic()
+        async for ts, jpeg in RecordingIndex.aiter_frames(device_id, segment_id):
+            if ts < seek_to:
+                continue
+            if first_ts is None:
+                first_ts = ts
+            delay = (ts - first_ts) - (time.monotonic() - wall_start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+
+    return StreamingResponse(generate(), media_type='multipart/x-mixed-replace; boundary=frame')
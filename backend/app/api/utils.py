@@ -1,14 +1,19 @@
 from datetime import datetime
+from app.core.coordination import get_coordinator
 from app.models.home import Home
 from app.models.room import Room
 from app.models.device import Device
+from app.models.automation_rule import AutomationRule
 from app.schemas.home import HomeResponse
 from app.schemas.room import RoomResponse
 from app.schemas.device import DeviceResponse
+from app.schemas.automation import AutomationRuleResponse, RuleTriggerIn, RuleActionIn
 
 DEVICE_OFFLINE_SECONDS = 7
 
-# Cache để track trạng thái trước đó (tránh log duplicate)
+# Cache để track trạng thái trước đó (tránh log duplicate). Chỉ là bộ lọc
+# trong process; trạng thái dùng để quyết định ghi log nằm ở coordinator
+# (dùng chung khi chạy nhiều worker/instance)
 _device_online_cache: dict[str, bool] = {}
 _device_state_cache: dict[str, str] = {}   # Track FAN state (ON/OFF)
 _device_speed_cache: dict[str, int] = {}   # Track FAN speed
@@ -36,6 +41,33 @@ def room_to_response(room: Room) -> RoomResponse:
         updatedAt=room.updatedAt
     )
 
+def automation_rule_to_response(rule: AutomationRule) -> AutomationRuleResponse:
+    return AutomationRuleResponse(
+        id=str(rule.id),
+        homeId=str(rule.homeId),
+        name=rule.name,
+        enabled=rule.enabled,
+        trigger=RuleTriggerIn(**{**rule.trigger.model_dump(), "deviceId": str(rule.trigger.deviceId)}),
+        action=RuleActionIn(**{**rule.action.model_dump(), "deviceId": str(rule.action.deviceId)}),
+        cooldownSeconds=rule.cooldownSeconds,
+        lastTriggeredAt=rule.lastTriggeredAt,
+        createdAt=rule.createdAt,
+        updatedAt=rule.updatedAt
+    )
+
+def _schedule(coro):
+    """device_to_response là hàm sync: chạy phần async trên event loop nếu có"""
+    import asyncio
+    try:
+        loop = asyncio.get_event_loop()
+        if loop.is_running():
+            loop.create_task(coro)
+            return
+    except RuntimeError:
+        pass
+    coro.close()  # Không có event loop (script) -> bỏ qua
+
+
 def device_to_response(device: Device) -> DeviceResponse:
     # Xác định trạng thái online dựa trên lastSeen
     is_online = None
@@ -49,52 +81,16 @@ def device_to_response(device: Device) -> DeviceResponse:
             delta = datetime.now() - device.lastSeen
             is_online = delta.total_seconds() <= DEVICE_OFFLINE_SECONDS
         
-        # Check và log thay đổi online/offline
-        was_online = _device_online_cache.get(device_id)
-        
-        # Chỉ log nếu có thay đổi VÀ device đã được assign vào room
-        if was_online is not None and was_online != is_online and device.roomId:
-            # Schedule async log (vì function này là sync)
-            import asyncio
-            try:
-                loop = asyncio.get_event_loop()
-                if loop.is_running():
-                    asyncio.create_task(_log_online_status_change(device, is_online))
-            except:
-                pass  # Ignore nếu không có event loop
-        
-        # Update cache
+        # Cache local chỉ để lọc: khi thấy thay đổi (hoặc lần đầu thấy device),
+        # đối chiếu với cache chung giữa các instance rồi mới quyết định ghi log
+        if _device_online_cache.get(device_id) != is_online:
+            _schedule(_sync_online_status(device, is_online))
         _device_online_cache[device_id] = is_online
     
     # === LOG FAN state/speed changes ===
     if device_type == "FAN" and device.roomId:
-        import asyncio
-        
-        old_state = _device_state_cache.get(device_id)
-        old_speed = _device_speed_cache.get(device_id)
-        
-        state_changed = old_state is not None and old_state != device.state
-        speed_changed = old_speed is not None and old_speed != device.speed
-        
-        # Log state change (ON/OFF)
-        if state_changed:
-            try:
-                loop = asyncio.get_event_loop()
-                if loop.is_running():
-                    asyncio.create_task(_log_fan_state_change(device, device.state))
-            except:
-                pass
-        
-        # Log speed change - CHỈ khi KHÔNG có state change (tránh log thừa khi turn on/off)
-        if speed_changed and not state_changed:
-            try:
-                loop = asyncio.get_event_loop()
-                if loop.is_running():
-                    asyncio.create_task(_log_fan_speed_change(device, device.speed))
-            except:
-                pass
-        
-        # Update cache
+        if _device_state_cache.get(device_id) != device.state or _device_speed_cache.get(device_id) != device.speed:
+            _schedule(_sync_fan_state(device))
         _device_state_cache[device_id] = device.state
         _device_speed_cache[device_id] = device.speed
 
@@ -102,21 +98,11 @@ def device_to_response(device: Device) -> DeviceResponse:
     temperature_alert = False
     
     if device_type == "SENSOR" and device.roomId and is_online:
-        import asyncio
-        
         # Check temperature threshold
         if device.temperatureThreshold is not None and device.temperature is not None:
-            if device.temperature > device.temperatureThreshold:
-                temperature_alert = True
-                # Chỉ log nếu chưa alert trước đó
-                was_temp_alert = _temp_alert_cache.get(device_id, False)
-                if not was_temp_alert:
-                    try:
-                        loop = asyncio.get_event_loop()
-                        if loop.is_running():
-                            asyncio.create_task(_log_temperature_alert(device))
-                    except:
-                        pass
+            temperature_alert = device.temperature > device.temperatureThreshold
+            if _temp_alert_cache.get(device_id) != temperature_alert:
+                _schedule(_sync_temperature_alert(device, temperature_alert))
             _temp_alert_cache[device_id] = temperature_alert
 
     return DeviceResponse(
@@ -130,6 +116,7 @@ def device_to_response(device: Device) -> DeviceResponse:
         state=device.state,
         speed=device.speed,
         humanDetectionEnabled=device.humanDetectionEnabled,
+        detectionRegions=device.detectionRegions,
         temperature=device.temperature,
         humidity=device.humidity,
         temperatureThreshold=device.temperatureThreshold,
@@ -143,6 +130,31 @@ def device_to_response(device: Device) -> DeviceResponse:
     )
 
 
+async def _sync_online_status(device: Device, is_online: bool):
+    """Ghi log online/offline nếu instance này là nơi đầu tiên thấy thay đổi"""
+    was_online = await get_coordinator().swap(f"device-online:{device.id}", is_online)
+    if was_online is not None and was_online != is_online and device.roomId:
+        await _log_online_status_change(device, is_online)
+
+
+async def _sync_fan_state(device: Device):
+    """Log FAN ON/OFF, hoặc đổi speed khi KHÔNG có state change (tránh log thừa khi turn on/off)"""
+    coordinator = get_coordinator()
+    old_state = await coordinator.swap(f"fan-state:{device.id}", device.state)
+    old_speed = await coordinator.swap(f"fan-speed:{device.id}", device.speed)
+    if old_state is not None and old_state != device.state:
+        await _log_fan_state_change(device, device.state)
+    elif old_speed is not None and old_speed != device.speed:
+        await _log_fan_speed_change(device, device.speed)
+
+
+async def _sync_temperature_alert(device: Device, temperature_alert: bool):
+    """Chỉ log lần đầu vượt ngưỡng (alert được reset khi nhiệt độ về dưới ngưỡng)"""
+    was_temp_alert = await get_coordinator().swap(f"temp-alert:{device.id}", temperature_alert)
+    if temperature_alert and not was_temp_alert:
+        await _log_temperature_alert(device)
+
+
 async def _log_online_status_change(device: Device, is_online: bool):
     """Helper async function để ghi log online/offline"""
     from app.services.activity_log import ActivityLogService
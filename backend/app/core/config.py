@@ -34,10 +34,97 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
+    SESSION_PURGE_INTERVAL_SECONDS: int = 3600  # Chu kỳ xóa session (refresh token) đã hết hạn
+
+    # Password hashing (bcrypt chạy trên thread pool riêng)
+    PASSWORD_HASH_WORKERS: int = 2  # Số bcrypt chạy song song (<= số core dành cho API)
+    PASSWORD_HASH_MAX_PENDING: int = 64  # Vượt quá -> 503, tránh hàng đợi dài vô hạn khi bị login storm
+
+    # Login rate limiting (trong RAM, theo cửa sổ thời gian)
+    LOGIN_RATE_LIMIT_WINDOW_SECONDS: int = 300
+    LOGIN_MAX_ATTEMPTS_PER_IP: int = 30
+    LOGIN_MAX_FAILURES_PER_USERNAME: int = 5  # Đăng nhập thành công sẽ reset
 
     # MQTT Configuration
     MQTT_BROKER: str
     MQTT_PORT: int
+    # Ingest device/new, device/data/#: "leader" = một instance (bầu qua coordination),
+    # "shared" = mọi instance, broker chia message qua shared subscription MQTT v5
+    MQTT_INGESTION_MODE: str = "leader"
+    MQTT_SHARED_GROUP: str = "smarthome-ingest"
+    MQTT_LEADER_LEASE_SECONDS: float = 10  # Leader MQTT consumer chết -> instance khác nhận sau tối đa khoảng này
+    # Lệnh gửi device (cmdId, QoS 1): chờ ack/trạng thái khớp, hết hạn thì gửi lại
+    COMMAND_ACK_TIMEOUT_SECONDS: float = 2
+    COMMAND_MAX_RETRIES: int = 2
+    COMMAND_HISTORY_SIZE: int = 500  # Số lệnh đã xong giữ lại trong RAM để tra cứu
+    # Journal trên đĩa cho message ingest: DB chậm/mất thì ghi đĩa, replay khi DB sống lại
+    INGEST_JOURNAL_ENABLED: bool = True
+    INGEST_JOURNAL_DIR: str = "data/ingest_journal"
+    INGEST_JOURNAL_SEGMENT_BYTES: int = 8 * 1024 * 1024
+    INGEST_JOURNAL_MAX_BYTES: int = 512 * 1024 * 1024  # Vượt quá thì bỏ segment cũ nhất
+    INGEST_JOURNAL_REPLAY_BATCH: int = 500
+    INGEST_JOURNAL_RETRY_SECONDS: float = 2  # Chu kỳ ping DB khi đang degraded
+    INGEST_DB_TIMEOUT_SECONDS: float = 5  # Xử lý một message lâu hơn -> coi như DB treo
+    # Ghi lại traffic MQTT nhận được (để phát lại bằng benchmarks/mqtt_replay.py); rỗng = tắt
+    MQTT_CAPTURE_DIR: str = ""
+    MQTT_CAPTURE_MAX_BYTES: int = 1024 * 1024 * 1024  # Đạt giới hạn thì dừng ghi (0 = không giới hạn)
+
+    # Coordination giữa nhiều worker/instance ("local" = 1 process, "redis" = Redis/Valkey/KeyDB trong LAN)
+    COORDINATION_BACKEND: str = "local"
+    COORDINATION_URL: str = "redis://localhost:6379/0"
+    COORDINATION_PREFIX: str = "smarthome:"
+    INSTANCE_ID: Optional[str] = None  # Mặc định hostname-pid
+    INSTANCE_URL: Optional[str] = None  # URL truy cập trực tiếp instance này (http://10.0.0.5:8001), để chuyển viewer tới nơi chạy camera
+    STREAM_OWNER_LEASE_SECONDS: float = 10
+
+    # Logging
+    LOG_LEVEL: str = "INFO"
+    LOG_JSON: bool = True
+    ACCESS_LOG_SAMPLE_RATE: float = 0.1  # Tỉ lệ request được ghi access log (0..1)
+    ACCESS_LOG_SLOW_MS: int = 500  # Request chậm hơn ngưỡng này luôn được ghi
+
+    # Camera capture
+    CAMERA_CAPTURE_BACKEND: str = "opencv"  # "opencv" hoặc "mjpeg" (parser HTTP MJPEG nhẹ)
+    CAMERA_BUFFER_SIZE: int = 1  # CAP_PROP_BUFFERSIZE, nhỏ = độ trễ thấp
+    CAMERA_READ_TIMEOUT_SECONDS: float = 5
+    # Giải mã phần cứng cho OpenCvSource (CAP_PROP_HW_ACCELERATION): "none", "any", "d3d11", "vaapi", "mfx"
+    CAMERA_HW_ACCELERATION: str = "none"
+    CAMERA_RECONNECT_INITIAL_SECONDS: float = 0.5
+    CAMERA_RECONNECT_MAX_SECONDS: float = 30
+    CAMERA_RELAY_ENABLED: bool = True  # Tắt detection -> chuyển thẳng JPEG từ camera (cần nguồn MJPEG HTTP)
+    # Chạy mỗi pipeline camera trong worker process riêng (frame qua shared memory)
+    CAMERA_WORKER_PROCESSES: bool = False
+    CAMERA_WORKER_RING_SLOTS: int = 4
+    CAMERA_WORKER_SLOT_BYTES: int = 1048576  # JPEG lớn hơn bị bỏ
+    CAMERA_WORKER_RESTART_MAX_SECONDS: float = 30
+
+    # Human detection ("torch" = ultralytics, "onnx" = ONNX Runtime CPU, "openvino")
+    DETECTOR_BACKEND: str = "torch"
+    DETECTOR_MODEL_PATH: str = ""  # Trống = yolo11s.pt / yolo11s.onnx / yolo11s_openvino_model theo backend
+    DETECTOR_INPUT_SIZE: int = 640  # Kích thước input khi export (onnx/openvino)
+    DETECTOR_CONF_THRESHOLD: float = 0.25
+    DETECTOR_THREADS: int = 0  # Số thread CPU cho mỗi lần inference, 0 = mặc định của runtime
+    DETECTOR_PRELOAD: bool = False  # Import thư viện detector ở nền sau khi khởi động (mặc định: khi bật detection lần đầu)
+    DETECTOR_INFERENCE_INTERVAL: int = 1  # Chạy inference mỗi N frame, các frame giữa do tracker nội suy
+    TRACKER_IOU_THRESHOLD: float = 0.3
+    TRACKER_MIN_HITS: int = 2  # Số lần detect liên tiếp trước khi tính là một người (sự kiện vào)
+    TRACKER_MAX_AGE_SECONDS: float = 2.0  # Mất dấu lâu hơn -> sự kiện ra
+
+    # Camera recording (ghi clip khi phát hiện người)
+    RECORDING_ENABLED: bool = False
+    RECORDING_DIR: str = "recordings"
+    RECORDING_PRE_SECONDS: float = 5
+    RECORDING_POST_SECONDS: float = 10
+    RECORDING_SEGMENT_SECONDS: float = 60
+
+    # Camera snapshot (thumbnail cho grid view)
+    SNAPSHOT_TTL_SECONDS: float = 5
+    SNAPSHOT_GRAB_TIMEOUT_SECONDS: float = 5
+    SNAPSHOT_DEFAULT_WIDTH: int = 320
+
+    # Profiling (opt-in, chỉ cho các username admin)
+    PROFILING_ENABLED: bool = False
+    ADMIN_USERNAMES: List[str] = []
 
     class Config:
         case_sensitive = True
@@ -0,0 +1,328 @@
+"""
+Trạng thái dùng chung và điều phối giữa nhiều process/node.
+
+Khi chạy uvicorn --workers N hoặc nhiều máy sau load balancer, mỗi process có
+RAM riêng: cache trong dict, camera stream đang chạy, MQTT subscription...
+Module này gom những gì cần thống nhất giữa các instance:
+
+- key/value có TTL và swap nguyên tử (cache phát hiện thay đổi trạng thái),
+- lease: giữ một key trong TTL, gia hạn định kỳ (bầu leader cho MQTT consumer,
+  chủ sở hữu camera stream),
+- broadcast qua pub/sub (lệnh điều khiển stream, reload automation rule).
+
+Backend:
+- "local": trong process (mặc định) - đúng cho 1 worker, hành vi như trước.
+- "redis": qua mạng LAN tới Redis hoặc server tương thích RESP (Valkey,
+  KeyDB...), chạy local bằng docker compose. Cần `pip install redis`.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+class Coordinator(ABC):
+    """Interface chung; giá trị là dữ liệu JSON được (dict, list, str, số, bool)"""
+
+    name = "base"
+
+    def __init__(self):
+        self.instance_id = settings.INSTANCE_ID or f"{socket.gethostname()}-{os.getpid()}"
+        # Giá trị của lease: so sánh nguyên chuỗi nên phải serialize cố định
+        self.identity = json.dumps({"instanceId": self.instance_id, "url": settings.INSTANCE_URL}, sort_keys=True)
+        self._handlers: Dict[str, List[Handler]] = {}
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def get(self, key: str) -> Any:
+        """Giá trị của key (None nếu không có/hết hạn)"""
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """Ghi value, ttl giây (None = không hết hạn)"""
+
+    @abstractmethod
+    async def swap(self, key: str, value: Any, ttl: Optional[float] = None) -> Any:
+        """Ghi value, trả về giá trị cũ (None nếu chưa có) - nguyên tử giữa các instance"""
+
+    @abstractmethod
+    async def delete(self, key: str):
+        """Xóa key"""
+
+    @abstractmethod
+    async def acquire_lease(self, key: str, ttl: float) -> bool:
+        """Lấy lease nếu trống, gia hạn nếu đang giữ; False nếu instance khác giữ"""
+
+    @abstractmethod
+    async def release_lease(self, key: str):
+        """Trả lease (chỉ khi đang giữ) để instance khác nhận ngay"""
+
+    @abstractmethod
+    async def lease_owner(self, key: str) -> Optional[dict]:
+        """{"instanceId", "url"} của instance đang giữ lease, None nếu trống"""
+
+    def is_self(self, owner: Optional[dict]) -> bool:
+        return owner is not None and owner.get("instanceId") == self.instance_id
+
+    def subscribe(self, channel: str, handler: Handler):
+        """Đăng ký handler (async) cho channel; nên gọi trước start()"""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    @abstractmethod
+    async def publish(self, channel: str, message: dict):
+        """Broadcast tới mọi instance (kể cả chính nó); message được gắn "origin" """
+
+    async def _dispatch(self, channel: str, message: dict):
+        for handler in self._handlers.get(channel, []):
+            try:
+                await handler(message)
+            except Exception as e:
+                logger.error("coordination handler failed", extra={"channel": channel, "error": str(e)})
+
+
+class LocalCoordinator(Coordinator):
+    """Trong process: dict có hạn + gọi handler trực tiếp"""
+
+    name = "local"
+
+    def __init__(self):
+        super().__init__()
+        self._values: Dict[str, Tuple[Any, Optional[float]]] = {}
+
+    def _read(self, key: str) -> Any:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del self._values[key]
+            return None
+        return value
+
+    def _write(self, key: str, value: Any, ttl: Optional[float]):
+        self._values[key] = (value, time.monotonic() + ttl if ttl else None)
+
+    async def get(self, key: str) -> Any:
+        return self._read(key)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._write(key, value, ttl)
+
+    async def swap(self, key: str, value: Any, ttl: Optional[float] = None) -> Any:
+        previous = self._read(key)
+        self._write(key, value, ttl)
+        return previous
+
+    async def delete(self, key: str):
+        self._values.pop(key, None)
+
+    async def acquire_lease(self, key: str, ttl: float) -> bool:
+        holder = self._read(key)
+        if holder is not None and holder != self.identity:
+            return False
+        self._write(key, self.identity, ttl)
+        return True
+
+    async def release_lease(self, key: str):
+        if self._read(key) == self.identity:
+            del self._values[key]
+
+    async def lease_owner(self, key: str) -> Optional[dict]:
+        holder = self._read(key)
+        return json.loads(holder) if holder else None
+
+    async def publish(self, channel: str, message: dict):
+        message = {**message, "origin": self.instance_id}
+        asyncio.create_task(self._dispatch(channel, message))
+
+
+# Lấy hoặc gia hạn lease trong một round-trip
+_ACQUIRE_LEASE = """
+local holder = redis.call('GET', KEYS[1])
+if not holder then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+if holder == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+_RELEASE_LEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisCoordinator(Coordinator):
+    """Qua Redis/Valkey/KeyDB trong LAN; key có tiền tố COORDINATION_PREFIX"""
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str):
+        super().__init__()
+        import redis.asyncio as redis
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._prefix = prefix
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+        self._acquire = self._redis.register_script(_ACQUIRE_LEASE)
+        self._release = self._redis.register_script(_RELEASE_LEASE)
+
+    def _key(self, key: str) -> str:
+        return self._prefix + key
+
+    async def start(self):
+        await self._redis.ping()
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        if self._handlers:
+            await self._pubsub.subscribe(*[self._key(channel) for channel in self._handlers])
+        self._reader = asyncio.create_task(self._read_messages())
+
+    async def close(self):
+        if self._reader:
+            self._reader.cancel()
+        if self._pubsub:
+            await self._pubsub.aclose()
+        await self._redis.aclose()
+
+    def subscribe(self, channel: str, handler: Handler):
+        first = channel not in self._handlers
+        super().subscribe(channel, handler)
+        if first and self._pubsub is not None:
+            asyncio.create_task(self._pubsub.subscribe(self._key(channel)))
+
+    async def _read_messages(self):
+        while True:
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+                if message is None or message["type"] != "message":
+                    continue
+                channel = message["channel"][len(self._prefix):]
+                await self._dispatch(channel, json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Mất kết nối: redis-py tự subscribe lại khi kết nối lại được
+                logger.warning("coordination pubsub error", extra={"error": str(e)})
+                await asyncio.sleep(1)
+
+    async def get(self, key: str) -> Any:
+        raw = await self._redis.get(self._key(key))
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        await self._redis.set(self._key(key), json.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    async def swap(self, key: str, value: Any, ttl: Optional[float] = None) -> Any:
+        raw = await self._redis.set(
+            self._key(key), json.dumps(value), px=int(ttl * 1000) if ttl else None, get=True
+        )
+        return json.loads(raw) if raw is not None else None
+
+    async def delete(self, key: str):
+        await self._redis.delete(self._key(key))
+
+    async def acquire_lease(self, key: str, ttl: float) -> bool:
+        return bool(await self._acquire(keys=[self._key(key)], args=[self.identity, int(ttl * 1000)]))
+
+    async def release_lease(self, key: str):
+        await self._release(keys=[self._key(key)], args=[self.identity])
+
+    async def lease_owner(self, key: str) -> Optional[dict]:
+        holder = await self._redis.get(self._key(key))
+        return json.loads(holder) if holder else None
+
+    async def publish(self, channel: str, message: dict):
+        message = {**message, "origin": self.instance_id}
+        await self._redis.publish(self._key(channel), json.dumps(message))
+
+
+class LeaderElection:
+    """
+    Giữ lease `leader:{name}`, gia hạn mỗi ttl/3. on_change(True/False) được
+    gọi trên event loop khi trở thành/không còn là leader.
+
+    Lỗi kết nối tới backend không làm mất quyền ngay: chỉ nhường khi lần gia
+    hạn thành công gần nhất đã quá ttl (lúc đó instance khác có thể đã nhận).
+    """
+
+    def __init__(self, coordinator: Coordinator, name: str, ttl: float, on_change: Callable[[bool], None]):
+        self.coordinator = coordinator
+        self.key = f"leader:{name}"
+        self.ttl = ttl
+        self.on_change = on_change
+        self.is_leader = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        if self.is_leader:
+            self._set_leader(False)
+            try:
+                await self.coordinator.release_lease(self.key)
+            except Exception as e:
+                logger.warning("leader lease release failed", extra={"lease": self.key, "error": str(e)})
+
+    def _set_leader(self, leader: bool):
+        if leader == self.is_leader:
+            return
+        self.is_leader = leader
+        print(f"👑 {self.key}: {'acquired' if leader else 'lost'} by {self.coordinator.instance_id}")
+        self.on_change(leader)
+
+    async def _run(self):
+        last_renewed = 0.0
+        while True:
+            try:
+                held = await self.coordinator.acquire_lease(self.key, self.ttl)
+                if held:
+                    last_renewed = time.monotonic()
+                self._set_leader(held)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("leader lease renew failed", extra={"lease": self.key, "error": str(e)})
+                if self.is_leader and time.monotonic() - last_renewed >= self.ttl:
+                    self._set_leader(False)
+            await asyncio.sleep(self.ttl / 3)
+
+
+_coordinator: Optional[Coordinator] = None
+
+
+def get_coordinator() -> Coordinator:
+    """Coordinator của process (tạo theo COORDINATION_BACKEND ở lần gọi đầu)"""
+    global _coordinator
+    if _coordinator is None:
+        backend = settings.COORDINATION_BACKEND.lower()
+        if backend == "local":
+            _coordinator = LocalCoordinator()
+        elif backend == "redis":
+            _coordinator = RedisCoordinator(settings.COORDINATION_URL, settings.COORDINATION_PREFIX)
+        else:
+            raise ValueError(f"Unknown coordination backend: {settings.COORDINATION_BACKEND} (expected local or redis)")
+    return _coordinator
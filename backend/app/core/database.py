@@ -2,28 +2,58 @@ from motor.motor_asyncio import AsyncIOMotorClient
 from beanie import init_beanie
 
 from app.core.config import settings
+from app.core.metrics import MongoCommandListener
 from app.models.user import User
 from app.models.session import Session
 from app.models.home import Home
 from app.models.room import Room
 from app.models.device import Device
 from app.models.activity_log import ActivityLog
+from app.models.automation_rule import AutomationRule
+
+
+_client: AsyncIOMotorClient = None
 
 
 async def init_db():
     """
     Khởi tạo kết nối MongoDB và Beanie ODM
     """
-    client = AsyncIOMotorClient(settings.MONGODB_URL)
+    global _client
+    client = _client = AsyncIOMotorClient(settings.MONGODB_URL, event_listeners=[MongoCommandListener()])
+    database = client[settings.MONGO_DATABASE_NAME]
+    await migrate_sessions(database)
     await init_beanie(
-        database=client[settings.MONGO_DATABASE_NAME],
+        database=database,
         document_models=[
             User,
             Session,
             Home,
             Room,
             Device,
-            ActivityLog
+            ActivityLog,
+            AutomationRule
         ],
     )
     print("Database initialized successfully")
+
+
+async def ping_db():
+    """Raise nếu MongoDB chưa trả lời được (dùng bởi replayer của ingest journal)"""
+    await _client.admin.command("ping")
+
+
+async def migrate_sessions(database):
+    """
+    Session cũ lưu cả JWT trong refreshToken (unique index). Phải xóa index cũ
+    trước khi Beanie tạo index jti, nếu không mọi session mới (không có
+    refreshToken) đụng unique null. Session cũ không có jti nên bị xóa -
+    user cần đăng nhập lại một lần.
+    """
+    sessions = database["sessions"]
+    indexes = await sessions.index_information()
+    if "refreshToken_1" in indexes:
+        await sessions.drop_index("refreshToken_1")
+    result = await sessions.delete_many({"jti": {"$exists": False}})
+    if result.deleted_count:
+        print(f"🧹 Removed {result.deleted_count} legacy sessions (refreshToken)")
@@ -0,0 +1,454 @@
+"""
+Journal ghi trước cho MQTT ingestion (device/new, device/data/#).
+
+Mỗi message được append vào file trên đĩa trước khi xử lý (một lệnh write,
+không chờ MongoDB), rồi:
+
+- DB bình thường: xử lý ngay như trước, xong thì đánh dấu đã áp dụng.
+- Handler lỗi kết nối / quá INGEST_DB_TIMEOUT_SECONDS: chuyển sang chế độ
+  degraded - on_message chỉ append journal (latency ingest không đổi khi DB
+  treo), replayer nền ping DB và khi DB sống lại thì áp dụng lại theo batch
+  (cùng device tuần tự, khác device song song) từ checkpoint. Đuổi kịp thì quay
+  về xử lý trực tiếp.
+
+Trên đĩa (INGEST_JOURNAL_DIR/{slot}/, mỗi worker một slot, khóa bằng flock):
+    {firstSeq:020d}.log   - segment, các record nối tiếp nhau
+    checkpoint            - seq nhỏ nhất chưa áp dụng (ghi mỗi giây)
+
+Record: header (seq, receivedAt, len(topic), len(payload)) + topic + payload
++ crc32. Record hỏng ở cuối segment (process chết giữa lúc ghi) bị cắt bỏ khi
+mở lại. Dữ liệu được fsync mỗi giây: process crash không mất gì, mất điện có
+thể mất tối đa khoảng đó.
+
+Dung lượng bị chặn bởi INGEST_JOURNAL_MAX_BYTES: vượt quá thì bỏ segment cũ
+nhất (kể cả chưa áp dụng, có metric đếm). Sau restart, các record từ
+checkpoint được áp dụng lại (at-least-once; update_device_data bỏ qua message
+cũ hơn lastSeen nên áp dụng lại không ghi đè dữ liệu mới).
+"""
+import asyncio
+import logging
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Awaitable, Callable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from pymongo.errors import ConnectionFailure, ExecutionTimeout, WTimeoutError
+
+from app.core.config import settings
+from app.core.metrics import (
+    INGEST_JOURNAL_BACKLOG,
+    INGEST_JOURNAL_BYTES,
+    INGEST_JOURNAL_DEGRADED,
+    INGEST_JOURNAL_DROPPED,
+    INGEST_JOURNAL_REPLAYED,
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ một worker dùng journal (slot 0)
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("<QdHI")  # seq, receivedAt (epoch), len(topic), len(payload)
+_CRC = struct.Struct("<I")
+_READ_CHUNK = 256 * 1024
+
+# Lỗi do DB chậm/mất kết nối: giữ record lại để replay. Lỗi khác (payload hỏng...) thì bỏ qua như trước.
+TRANSIENT_ERRORS = (ConnectionFailure, ExecutionTimeout, WTimeoutError, asyncio.TimeoutError)
+
+
+class JournalRecord(NamedTuple):
+    seq: int
+    received_at: float
+    topic: str
+    payload: bytes
+
+
+def _encode(seq: int, received_at: float, topic: str, payload: bytes) -> bytes:
+    topic_bytes = topic.encode()
+    body = _HEADER.pack(seq, received_at, len(topic_bytes), len(payload)) + topic_bytes + payload
+    return body + _CRC.pack(zlib.crc32(body))
+
+
+def _decode(buffer: bytes, offset: int) -> Optional[Tuple[JournalRecord, int]]:
+    """(record, offset kế tiếp) hoặc None nếu record thiếu/hỏng"""
+    if offset + _HEADER.size > len(buffer):
+        return None
+    seq, received_at, topic_len, payload_len = _HEADER.unpack_from(buffer, offset)
+    end = offset + _HEADER.size + topic_len + payload_len
+    if end + _CRC.size > len(buffer):
+        return None
+    if zlib.crc32(buffer[offset:end]) != _CRC.unpack_from(buffer, end)[0]:
+        return None
+    topic_start = offset + _HEADER.size
+    topic = buffer[topic_start:topic_start + topic_len].decode()
+    payload = bytes(buffer[topic_start + topic_len:end])
+    return JournalRecord(seq, received_at, topic, payload), end + _CRC.size
+
+
+def _scan(path: str, offset: int) -> Iterator[Tuple[JournalRecord, int]]:
+    """(record, offset kế tiếp trong file) từ offset, đọc từng khối; dừng ở record thiếu/hỏng"""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        buffer, position = b"", 0
+        while True:
+            decoded = _decode(buffer, position)
+            if decoded is None:
+                chunk = f.read(_READ_CHUNK)
+                if not chunk:
+                    return
+                offset += position
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            record, position = decoded
+            yield record, offset + position
+
+
+class _Segment:
+    def __init__(self, first_seq: int, path: str, size: int):
+        self.first_seq = first_seq
+        self.path = path
+        self.size = size
+
+
+class IngestJournal:
+    def __init__(self):
+        self.enabled = False
+        self.healthy = True
+        self.directory: Optional[str] = None
+        self._lock = threading.Lock()  # append chạy ở thread MQTT, còn lại trên event loop
+        self._segments: List[_Segment] = []
+        self._fd: Optional[int] = None
+        self._lock_fd: Optional[int] = None
+        self._next_seq = 0
+        self._checkpoint = 0
+        self._saved_checkpoint = -1
+        self._applied: Set[int] = set()  # seq >= checkpoint đã áp dụng (xử lý trực tiếp xong không theo thứ tự)
+        self._inflight: Set[int] = set()
+        self._handler: Optional[Callable[[JournalRecord], Awaitable[None]]] = None
+        self._probe: Optional[Callable[[], Awaitable[None]]] = None
+        self._key: Callable[[str, bytes], str] = lambda topic, payload: topic
+        # (firstSeq của segment, offset, seq kế tiếp): batch replay sau đọc tiếp từ đây
+        self._cursor: Optional[Tuple[int, int, int]] = None
+        self._tasks: List[asyncio.Task] = []
+
+    # === Vòng đời ===
+
+    def start(
+        self,
+        handler: Callable[[JournalRecord], Awaitable[None]],
+        probe: Callable[[], Awaitable[None]],
+        key: Optional[Callable[[str, bytes], str]] = None,
+    ):
+        """
+        handler(record) áp dụng lại một record (replay); probe() raise nếu DB chưa dùng được;
+        key(topic, payload) nhóm các record phải áp dụng tuần tự (mặc định: topic)
+        """
+        self._handler = handler
+        self._probe = probe
+        if key is not None:
+            self._key = key
+        self._open()
+        self.enabled = True
+        if self._checkpoint < self._next_seq:
+            # Còn record chưa áp dụng từ lần chạy trước: replay trước khi xử lý trực tiếp
+            self.healthy = False
+            INGEST_JOURNAL_DEGRADED.labels().set(1)
+            print(f"📼 Ingest journal: {self._next_seq - self._checkpoint} records pending from previous run")
+        self._tasks = [asyncio.create_task(self._replay_loop()), asyncio.create_task(self._maintain_loop())]
+        print(f"📼 Ingest journal: {self.directory}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        if not self.enabled:
+            return
+        with self._lock:
+            self.enabled = False
+            self._sync()
+            os.close(self._fd)
+            self._fd = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+
+    def _open(self):
+        self.directory = self._claim_directory(settings.INGEST_JOURNAL_DIR)
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".log"))
+        self._segments = [
+            _Segment(int(name[:-4]), os.path.join(self.directory, name), os.path.getsize(os.path.join(self.directory, name)))
+            for name in names
+        ]
+        checkpoint_path = os.path.join(self.directory, "checkpoint")
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                self._checkpoint = int(f.read().strip() or 0)
+        self._next_seq = self._checkpoint
+        if self._segments:
+            self._next_seq = max(self._next_seq, self._recover_tail(self._segments[-1]))
+            self._checkpoint = max(self._checkpoint, self._segments[0].first_seq)
+            self._fd = os.open(self._segments[-1].path, os.O_WRONLY | os.O_APPEND)
+        else:
+            self._roll()
+        self._saved_checkpoint = self._checkpoint
+
+    def _claim_directory(self, root: str) -> str:
+        """Mỗi process một thư mục con cố định qua các lần restart (0, 1, ...)"""
+        slot = 0
+        while True:
+            path = os.path.join(root, str(slot))
+            os.makedirs(path, exist_ok=True)
+            fd = os.open(os.path.join(path, "lock"), os.O_CREAT | os.O_RDWR)
+            if fcntl is not None:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(fd)  # Worker khác đang dùng slot này
+                    slot += 1
+                    continue
+            self._lock_fd = fd
+            return path
+
+    def _recover_tail(self, segment: _Segment) -> int:
+        """Cắt phần ghi dở ở cuối segment, trả về seq kế tiếp"""
+        with open(segment.path, "rb") as f:
+            buffer = f.read()
+        offset, next_seq = 0, segment.first_seq
+        while True:
+            decoded = _decode(buffer, offset)
+            if decoded is None:
+                break
+            record, offset = decoded
+            next_seq = record.seq + 1
+        if offset < len(buffer):
+            print(f"⚠️ Ingest journal: truncating {len(buffer) - offset} torn bytes in {segment.path}")
+            with open(segment.path, "r+b") as f:
+                f.truncate(offset)
+        segment.size = offset
+        return next_seq
+
+    # === Ghi (thread MQTT) ===
+
+    def append(self, topic: str, payload: bytes, received_at: float) -> Tuple[int, bool]:
+        """
+        Ghi message vào journal. Trả về (seq, direct): direct=True thì caller xử
+        lý ngay rồi gọi apply_live(seq, ...), False thì để replayer áp dụng.
+        """
+        with self._lock:
+            seq = self._next_seq
+            data = _encode(seq, received_at, topic, payload)
+            os.write(self._fd, data)
+            self._next_seq += 1
+            segment = self._segments[-1]
+            segment.size += len(data)
+            if segment.size >= settings.INGEST_JOURNAL_SEGMENT_BYTES:
+                self._roll()
+            self._enforce_limit()
+            if self.healthy:
+                self._inflight.add(seq)
+            return seq, self.healthy
+
+    def _roll(self):
+        if self._fd is not None:
+            os.fsync(self._fd)
+            os.close(self._fd)
+        path = os.path.join(self.directory, f"{self._next_seq:020d}.log")
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._segments.append(_Segment(self._next_seq, path, 0))
+
+    def _enforce_limit(self):
+        """Bỏ segment cũ nhất khi vượt INGEST_JOURNAL_MAX_BYTES (giữ segment đang ghi)"""
+        total = sum(segment.size for segment in self._segments)
+        while total > settings.INGEST_JOURNAL_MAX_BYTES and len(self._segments) > 1:
+            oldest = self._segments.pop(0)
+            total -= oldest.size
+            next_first = self._segments[0].first_seq
+            if next_first > self._checkpoint:
+                lost = next_first - self._checkpoint - sum(1 for seq in self._applied if seq < next_first)
+                if lost > 0:
+                    INGEST_JOURNAL_DROPPED.labels().inc(lost)
+                    logger.warning("ingest journal full, dropped records", extra={"records": lost})
+                self._advance_to(next_first)
+            try:
+                os.remove(oldest.path)
+            except FileNotFoundError:
+                pass
+
+    # === Áp dụng ===
+
+    def _advance_to(self, seq: int):
+        if seq > self._checkpoint:
+            self._checkpoint = seq
+            self._applied = {s for s in self._applied if s >= seq}
+
+    def _mark_applied(self, seq: int):
+        with self._lock:
+            if seq < self._checkpoint:
+                return
+            self._applied.add(seq)
+            while self._checkpoint in self._applied:
+                self._applied.discard(self._checkpoint)
+                self._checkpoint += 1
+
+    def _degrade(self, error: BaseException):
+        with self._lock:
+            if not self.healthy:
+                return
+            self.healthy = False
+        INGEST_JOURNAL_DEGRADED.labels().set(1)
+        print(f"⚠️ Ingest journal: database unavailable ({type(error).__name__}), buffering to disk")
+
+    async def apply_live(self, seq: int, coro: Awaitable[None]):
+        """Xử lý trực tiếp message vừa append; lỗi DB -> để lại cho replayer"""
+        try:
+            if not self.healthy:
+                coro.close()  # Đã chuyển sang degraded trong lúc chờ lượt: replayer sẽ áp dụng
+                return
+            try:
+                await asyncio.wait_for(coro, settings.INGEST_DB_TIMEOUT_SECONDS)
+            except TRANSIENT_ERRORS as e:
+                self._degrade(e)
+                return
+            self._mark_applied(seq)
+        finally:
+            with self._lock:
+                self._inflight.discard(seq)
+
+    async def _replay_loop(self):
+        while True:
+            try:
+                if self.healthy or self._inflight:
+                    await asyncio.sleep(0.2)
+                    continue
+                if not await self._replay_once():
+                    await asyncio.sleep(settings.INGEST_JOURNAL_RETRY_SECONDS)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("ingest journal replay failed", extra={"error": str(e)})
+                await asyncio.sleep(settings.INGEST_JOURNAL_RETRY_SECONDS)
+
+    async def _replay_once(self) -> bool:
+        try:
+            await asyncio.wait_for(self._probe(), settings.INGEST_DB_TIMEOUT_SECONDS)
+        except Exception:
+            return False
+        with self._lock:
+            start, end = self._checkpoint, self._next_seq
+            if start >= end:
+                # Đuổi kịp: append kế tiếp (đang bị chặn bởi lock) sẽ được xử lý trực tiếp
+                self.healthy = True
+        if start >= end:
+            INGEST_JOURNAL_DEGRADED.labels().set(0)
+            print("✅ Ingest journal: caught up, processing messages directly")
+            return True
+
+        records, upto = await asyncio.to_thread(self._read, start, end, settings.INGEST_JOURNAL_REPLAY_BATCH)
+        records = [record for record in records if record.seq not in self._applied]
+        if not await self._apply_batch(records):
+            return False
+        with self._lock:
+            # Seq trong [start, upto) không đọc được (segment hỏng/bị bỏ) coi như đã xử lý
+            self._advance_to(upto)
+        return True
+
+    async def _apply_batch(self, records: List[JournalRecord]) -> bool:
+        """Cùng key (cùng device, kể cả device/new của nó) tuần tự theo thứ tự nhận, các key khác song song"""
+        groups: "OrderedDict[str, List[JournalRecord]]" = OrderedDict()
+        for record in records:
+            groups.setdefault(self._key(record.topic, record.payload), []).append(record)
+
+        async def apply_group(group: List[JournalRecord]):
+            for record in group:
+                try:
+                    await asyncio.wait_for(self._handler(record), settings.INGEST_DB_TIMEOUT_SECONDS)
+                except TRANSIENT_ERRORS:
+                    raise
+                except Exception as e:
+                    print(f"Error replaying MQTT message ({record.topic}): {e}")
+                self._mark_applied(record.seq)
+                INGEST_JOURNAL_REPLAYED.labels().inc()
+
+        results = await asyncio.gather(*(apply_group(group) for group in groups.values()), return_exceptions=True)
+        return not any(isinstance(result, BaseException) for result in results)
+
+    def _read(self, start: int, end: int, limit: int) -> Tuple[List[JournalRecord], int]:
+        """
+        Đọc tối đa limit record có seq trong [start, end); trả về (records, seq đã xét tới).
+        Batch kế tiếp đọc tiếp từ cursor thay vì đọc lại segment từ đầu.
+        """
+        with self._lock:
+            segments = [s for i, s in enumerate(self._segments)
+                        if i + 1 == len(self._segments) or self._segments[i + 1].first_seq > start]
+        records: List[JournalRecord] = []
+        for segment in segments:
+            if segment.first_seq >= end:
+                break
+            position, next_seq = 0, segment.first_seq
+            cursor = self._cursor
+            if cursor is not None and cursor[0] == segment.first_seq and cursor[2] <= start:
+                position, next_seq = cursor[1], cursor[2]
+            scan = _scan(segment.path, position)
+            try:
+                for record, record_end in scan:
+                    if record.seq >= end:
+                        self._cursor = (segment.first_seq, position, next_seq)
+                        return records, end
+                    position, next_seq = record_end, record.seq + 1
+                    if record.seq >= start:
+                        records.append(record)
+                        if len(records) >= limit:
+                            self._cursor = (segment.first_seq, position, next_seq)
+                            return records, next_seq
+            except FileNotFoundError:
+                continue  # Vừa bị bỏ do vượt dung lượng
+            finally:
+                scan.close()
+            self._cursor = (segment.first_seq, position, next_seq)
+            if position < segment.size and segment is not segments[-1]:
+                logger.warning("ingest journal segment corrupted", extra={"path": segment.path, "offset": position})
+        return records, end
+
+    # === Bảo trì ===
+
+    async def _maintain_loop(self):
+        while True:
+            await asyncio.sleep(1)
+            try:
+                await asyncio.to_thread(self._maintain)
+            except Exception as e:
+                logger.error("ingest journal maintenance failed", extra={"error": str(e)})
+
+    def _maintain(self):
+        """fsync, lưu checkpoint, xóa segment đã áp dụng hết, cập nhật metric"""
+        with self._lock:
+            if not self.enabled:
+                return
+            fd = os.dup(self._fd)
+        try:
+            os.fsync(fd)  # Ngoài lock: append ở thread MQTT không phải chờ đĩa
+        finally:
+            os.close(fd)
+        with self._lock:
+            if not self.enabled:
+                return
+            checkpoint = self._checkpoint
+            while len(self._segments) > 1 and self._segments[1].first_seq <= checkpoint:
+                os.remove(self._segments.pop(0).path)
+            INGEST_JOURNAL_BYTES.labels().set(sum(segment.size for segment in self._segments))
+            INGEST_JOURNAL_BACKLOG.labels().set(self._next_seq - checkpoint - len(self._applied))
+        if checkpoint != self._saved_checkpoint:
+            path = os.path.join(self.directory, "checkpoint")
+            with open(path + ".tmp", "w") as f:
+                f.write(str(checkpoint))
+            os.replace(path + ".tmp", path)
+            self._saved_checkpoint = checkpoint
+
+    def _sync(self):
+        if self._fd is not None:
+            os.fsync(self._fd)
+
+
+ingest_journal = IngestJournal()
@@ -1,8 +1,17 @@
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 
-from app.core.database import init_db
-from app.core.mqtt import connect_mqtt, disconnect_mqtt
+from app.core.database import init_db, ping_db
+from app.core.mqtt import connect_mqtt, disconnect_mqtt, set_ingestion, publish_tracked_command, replay_record, ordering_key, SHARED_INGESTION
+from app.core.ingest_journal import ingest_journal
+from app.core import mqtt_capture
+from app.core.config import settings
+from app.core.coordination import get_coordinator, LeaderElection
+from app.services.automation import automation_engine, RULES_CHANNEL
+from app.services import stream_routing
+from app.services.command_tracker import command_tracker, REPORTS_CHANNEL
+from app.services.device import DeviceService
 
 
 @asynccontextmanager
@@ -12,11 +21,66 @@ async def lifespan(app: FastAPI):
     """
     # Startup
     await init_db()
+    coordinator = get_coordinator()
+    coordinator.subscribe(stream_routing.CONTROL_CHANNEL, stream_routing.handle_control)
+    coordinator.subscribe(RULES_CHANNEL, automation_engine.handle_remote_change)
+    coordinator.subscribe(REPORTS_CHANNEL, command_tracker.handle_remote_report)
+    await coordinator.start()
+    print(f"🤝 Coordination backend: {coordinator.name} (instance {coordinator.instance_id})")
+    await automation_engine.load()
+    command_tracker.configure(publish=publish_tracked_command, on_confirmed=DeviceService.on_command_confirmed)
+    if settings.INGEST_JOURNAL_ENABLED:
+        ingest_journal.start(handler=replay_record, probe=ping_db, key=ordering_key)
+    mqtt_capture.start_capture()
     connect_mqtt()
+    mqtt_leader = None
+    if SHARED_INGESTION:
+        # Mọi instance cùng ingest, broker chia message theo shared subscription
+        set_ingestion(True)
+    else:
+        # Chỉ một instance ingest MQTT (ghi DB, automation); instance khác chờ nhận lease khi leader chết
+        mqtt_leader = LeaderElection(coordinator, "mqtt-consumer", settings.MQTT_LEADER_LEASE_SECONDS, set_ingestion)
+        mqtt_leader.start()
+    purge_task = asyncio.create_task(_purge_expired_sessions())
+    if settings.DETECTOR_PRELOAD:
+        asyncio.create_task(_preload_detector())
     print("Application startup complete")
     
     yield
     
     # Shutdown
+    purge_task.cancel()
+    if mqtt_leader:
+        await mqtt_leader.stop()
+    from app.api.endpoints.device import active_camera_streams
+    for stream in list(active_camera_streams.values()):
+        stream.stop()  # Dừng cả worker process và giải phóng shared memory
+    await stream_routing.release_all()
     disconnect_mqtt()
+    mqtt_capture.stop_capture()
+    await ingest_journal.stop()
+    await coordinator.close()
     print("Application shutdown complete")
+
+
+async def _preload_detector():
+    """Load thư viện detector ở thread nền, không làm chậm startup"""
+    from app.services.detector import preload_backend
+    try:
+        await asyncio.to_thread(preload_backend)
+        print(f"🔥 Detector backend preloaded: {settings.DETECTOR_BACKEND}")
+    except Exception as e:
+        print(f"⚠️ Detector preload failed: {e}")
+
+
+async def _purge_expired_sessions():
+    """Định kỳ xóa session hết hạn để collection/index sessions không phình"""
+    from app.services.auth import AuthService
+    while True:
+        try:
+            deleted = await AuthService.purge_expired_sessions()
+            if deleted:
+                print(f"🧹 Purged {deleted} expired sessions")
+        except Exception as e:
+            print(f"⚠️ Session purge failed: {e}")
+        await asyncio.sleep(settings.SESSION_PURGE_INTERVAL_SECONDS)
@@ -0,0 +1,127 @@
+"""
+Cấu hình logging: ghi log qua QueueHandler (không block event loop khi ghi
+stdout/file), định dạng JSON một dòng, và access log middleware dạng pure ASGI.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import time
+from datetime import datetime, timezone
+
+from app.core.config import settings
+
+access_logger = logging.getLogger("app.access")
+
+# Các thuộc tính mặc định của LogRecord, không đưa vào phần "extra" của JSON
+_RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Mỗi record thành một dòng JSON, kèm các field truyền qua extra={...}"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+_listener = None
+
+
+def setup_logging():
+    """Cài root logger: QueueHandler -> QueueListener (thread riêng) -> stdout"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler()
+    if settings.LOG_JSON:
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        ))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(settings.LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush các record còn trong queue"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class AccessLogMiddleware:
+    """
+    Access log dạng pure ASGI (không bọc response như BaseHTTPMiddleware).
+    Ghi 1 dòng khi header response được gửi; chỉ lấy mẫu theo
+    ACCESS_LOG_SAMPLE_RATE, nhưng luôn ghi lỗi 5xx và request chậm.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.sample_rate = settings.ACCESS_LOG_SAMPLE_RATE
+        self.slow_seconds = settings.ACCESS_LOG_SLOW_MS / 1000
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        started = False
+
+        async def send_wrapper(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+                self._log(scope, message["status"], time.perf_counter() - start)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            if not started:
+                self._log(scope, 500, time.perf_counter() - start)
+            raise
+
+    def _log(self, scope, status: int, duration: float):
+        if status < 500 and duration < self.slow_seconds and random.random() >= self.sample_rate:
+            return
+        if not access_logger.isEnabledFor(logging.INFO):
+            return
+        route = scope.get("route")
+        client = scope.get("client")
+        access_logger.info(
+            "request",
+            extra={
+                "method": scope.get("method"),
+                "path": scope.get("path"),
+                "route": getattr(route, "path", None),
+                "status": status,
+                "duration_ms": round(duration * 1000, 2),
+                "client": client[0] if client else None,
+            },
+        )
@@ -0,0 +1,323 @@
+"""
+Metrics registry tối giản theo định dạng Prometheus text exposition (v0.0.4).
+
+Các metric được cập nhật từ nhiều thread (paho MQTT, camera capture/detection,
+pymongo monitoring) nên mọi thao tác ghi đều có lock.
+"""
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def get(self) -> float:
+        with self._lock:
+            return self._value
+
+
+class _GaugeChild(_CounterChild):
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._buckets = buckets
+        self._counts = [0] * len(buckets)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self._sum += value
+            self._count += 1
+            for i, bound in enumerate(self._buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        """Trả về (cumulative bucket counts, sum, count)"""
+        with self._lock:
+            cumulative, running = [], 0
+            for c in self._counts:
+                running += c
+                cumulative.append(running)
+            return cumulative, self._sum, self._count
+
+
+class _Metric(ABC):
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    @abstractmethod
+    def _new_child(self):
+        """Giá trị cho một tổ hợp label (Counter/Gauge/Histogram tự định nghĩa)"""
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {key}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def remove(self, *values):
+        with self._lock:
+            self._children.pop(tuple(str(v) for v in values), None)
+
+    def _items(self):
+        with self._lock:
+            return list(self._children.items())
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for key, child in self._items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.get())}")
+        return lines
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for key, child in self._items():
+            cumulative, total, count = child.snapshot()
+            for bound, c in zip(self.buckets, cumulative):
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {c}")
+            labels = _format_labels(self.labelnames, key, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            plain = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{plain} {_format_value(total)}")
+            lines.append(f"{self.name}_count{plain} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# === HTTP ===
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests", ("method", "route", "status"))
+HTTP_REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time until response headers are sent (streaming bodies excluded)",
+    ("method", "route"),
+)
+
+# === Auth ===
+PASSWORD_HASH_LATENCY = Histogram(
+    "password_hash_duration_seconds",
+    "bcrypt hash/verify time on the password hashing pool",
+    ("operation",),
+)
+LOGIN_RATE_LIMITED = Counter("login_rate_limited_total", "Login attempts rejected by the rate limiter", ("scope",))
+
+# === MQTT ===
+MQTT_MESSAGES = Counter("mqtt_messages_total", "MQTT messages received", ("topic",))
+MQTT_PROCESSING_LATENCY = Histogram(
+    "mqtt_message_processing_seconds",
+    "Time from MQTT message receipt until its handler finished",
+    ("topic",),
+)
+INGEST_JOURNAL_BYTES = Gauge("ingest_journal_bytes", "Disk used by the MQTT ingestion journal")
+INGEST_JOURNAL_BACKLOG = Gauge("ingest_journal_backlog_records", "Journaled MQTT messages not yet applied to MongoDB")
+INGEST_JOURNAL_DEGRADED = Gauge("ingest_journal_degraded", "1 while MongoDB is unavailable and messages are only journaled")
+INGEST_JOURNAL_REPLAYED = Counter("ingest_journal_replayed_total", "Journaled MQTT messages applied by the replayer")
+INGEST_JOURNAL_DROPPED = Counter("ingest_journal_dropped_total", "Unapplied journaled messages discarded to stay under the disk limit")
+
+# === Device commands ===
+COMMAND_LATENCY = Histogram(
+    "device_command_latency_seconds",
+    "Time from the first publish until the device confirmed the command",
+    ("action", "via"),
+    buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+COMMAND_OUTCOMES = Counter("device_commands_total", "Device commands by final status", ("action", "status"))
+COMMAND_RETRIES = Counter("device_command_retries_total", "Command re-publishes after an ack timeout", ("action",))
+
+# === MongoDB ===
+MONGO_QUERY_LATENCY = Histogram(
+    "mongo_command_duration_seconds",
+    "MongoDB command latency",
+    ("collection", "command"),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+MONGO_QUERY_FAILURES = Counter("mongo_command_failures_total", "Failed MongoDB commands", ("collection", "command"))
+
+# === Camera ===
+CAMERA_CAPTURE_FPS = Gauge("camera_capture_fps", "Frames per second read from the camera", ("device",))
+CAMERA_INFERENCE_LATENCY = Histogram(
+    "camera_inference_duration_seconds",
+    "Human detection inference + drawing latency per frame",
+    ("device",),
+)
+CAMERA_FRAMES_DROPPED = Counter("camera_frames_dropped_total", "Frames dropped because a queue was full", ("device", "queue"))
+
+
+def mqtt_topic_label(topic: str) -> str:
+    """Gom device/data/{mac} về một label để tránh bùng nổ cardinality"""
+    if topic.startswith("device/data/"):
+        return "device/data/+"
+    return topic
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Đo latency từng command MongoDB theo collection (đăng ký qua event_listeners)"""
+
+    # Các command không có tên collection làm giá trị (ping, isMaster, ...)
+    _COLLECTION_COMMANDS = {
+        "find", "insert", "update", "delete", "aggregate", "count",
+        "distinct", "findAndModify", "createIndexes", "listIndexes",
+    }
+
+    def __init__(self):
+        self._pending: Dict[Tuple[int, str], Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        name = event.command_name
+        if name not in self._COLLECTION_COMMANDS:
+            return
+        collection = event.command.get(name)
+        if not isinstance(collection, str):
+            return
+        with self._lock:
+            self._pending[(event.request_id, event.connection_id)] = (collection, name)
+
+    def _pop(self, event):
+        with self._lock:
+            return self._pending.pop((event.request_id, event.connection_id), None)
+
+    def succeeded(self, event):
+        labels = self._pop(event)
+        if labels:
+            MONGO_QUERY_LATENCY.labels(*labels).observe(event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        labels = self._pop(event)
+        if labels:
+            MONGO_QUERY_LATENCY.labels(*labels).observe(event.duration_micros / 1_000_000)
+            MONGO_QUERY_FAILURES.labels(*labels).inc()
+
+
+class PrometheusMiddleware:
+    """Pure ASGI middleware đo latency theo route template (ví dụ /api/v1/devices/{device_id})"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_holder = {"status": 500, "observed": False}
+
+        def observe():
+            if status_holder["observed"]:
+                return
+            status_holder["observed"] = True
+            route = scope.get("route")
+            route_label = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            HTTP_REQUEST_LATENCY.labels(method, route_label).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(method, route_label, status_holder["status"]).inc()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+                observe()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            observe()
@@ -1,42 +1,172 @@
 import json
+import time
+import logging
 import asyncio
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, Union
 import paho.mqtt.client as mqtt
 from app.core.config import settings
+from app.core.metrics import MQTT_MESSAGES, MQTT_PROCESSING_LATENCY, mqtt_topic_label
 from app.schemas.device import DeviceCreate
 from app.services.device import DeviceService
+from app.services.automation import automation_engine
+from app.services.command_tracker import command_tracker
+from app.services import shadow
+from app.core.ingest_journal import ingest_journal, JournalRecord, TRANSIENT_ERRORS
+from app.core import mqtt_capture, telemetry
+from app.models.automation_rule import TriggerEvent
+from app.models.device import DeviceType
+
+logger = logging.getLogger(__name__)
+
+# "leader": chỉ instance leader subscribe, "shared": mọi instance subscribe
+# qua shared subscription MQTT v5 ($share/group/...), broker chia message
+SHARED_INGESTION = settings.MQTT_INGESTION_MODE.lower() == "shared"
 
 # Khởi tạo MQTT client
-client = mqtt.Client()
+client = mqtt.Client(protocol=mqtt.MQTTv5 if SHARED_INGESTION else mqtt.MQTTv311)
 
 # Reference to the async event loop (set in connect_mqtt)
 _loop = None
 
-# Callback khi kết nối thành công
-def on_connect(client, userdata, flags, rc):
+# Topic ingest (ghi DB, chạy automation); instance không ingest vẫn kết nối để publish lệnh điều khiển
+INGESTION_TOPICS = ("device/new", "device/data/#")
+# Ack lệnh: mọi instance subscribe (không share) vì lệnh nằm trong bảng pending của instance đã gửi
+ACK_TOPIC = "device/ack/+"
+_ingesting = False
+
+
+def ingestion_subscriptions():
+    """Topic filter thực sự subscribe (có tiền tố $share/{group}/ ở chế độ shared)"""
+    if SHARED_INGESTION:
+        return [f"$share/{settings.MQTT_SHARED_GROUP}/{topic}" for topic in INGESTION_TOPICS]
+    return list(INGESTION_TOPICS)
+
+# Callback khi kết nối thành công (properties chỉ có khi dùng MQTT v5)
+def on_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
         print("✅ Connected to MQTT Broker!")
-        # Subscribe to topics
-        client.subscribe("device/new")
-        client.subscribe("device/data/#")
-        print("📥 Subscribed to: device/new, device/data/#")
+        client.subscribe(ACK_TOPIC, qos=1)
+        if _ingesting:
+            _subscribe_ingestion()
     else:
         print(f"❌ Failed to connect to MQTT, return code {rc}")
 
+def _subscribe_ingestion():
+    topics = ingestion_subscriptions()
+    for topic in topics:
+        client.subscribe(topic, qos=1 if SHARED_INGESTION else 0)
+    print(f"📥 Subscribed to: {', '.join(topics)}")
+
+def set_ingestion(enabled: bool):
+    """Bật/tắt ingest khi instance trở thành/không còn là leader MQTT consumer"""
+    global _ingesting
+    _ingesting = enabled
+    if not client.is_connected():
+        return  # on_connect sẽ subscribe khi kết nối xong
+    if enabled:
+        _subscribe_ingestion()
+    else:
+        topics = ingestion_subscriptions()
+        client.unsubscribe(topics)
+        print(f"📤 Unsubscribed from: {', '.join(topics)}")
+
+async def _timed(coro, topic_label: str, received_at: float):
+    """Đo thời gian từ lúc nhận message đến khi xử lý xong"""
+    try:
+        await coro
+    finally:
+        MQTT_PROCESSING_LATENCY.labels(topic_label).observe(time.perf_counter() - received_at)
+
+# Message của cùng một device được xử lý tuần tự theo thứ tự nhận (các device
+# khác nhau vẫn song song). run_coroutine_threadsafe giữ thứ tự FIFO nên
+# _process_in_order của từng message bắt đầu đúng thứ tự on_message.
+_pending: Dict[str, Deque] = {}
+
+async def _process_in_order(key: str, coro):
+    queue = _pending.get(key)
+    if queue is not None:
+        queue.append(coro)  # Đã có task đang xử lý key này, nó sẽ chạy tiếp
+        return
+    queue = _pending[key] = deque([coro])
+    try:
+        while queue:
+            try:
+                await queue.popleft()
+            except Exception as e:
+                print(f"Error processing MQTT message ({key}): {e}")
+    finally:
+        del _pending[key]
+
 # Callback khi nhận được message
 def on_message(client, userdata, msg):
+    received_at = time.perf_counter()
+    received_wall = datetime.now()
     topic = msg.topic
-    payload = msg.payload.decode()
-    # print(f"📩 MQTT [{topic}]: {payload[:100]}...")
-    
-    if topic == "device/new":
-        # Schedule the async function in the event loop
+    mqtt_capture.capture(topic, msg.payload, received_wall.timestamp())
+    if topic.startswith("device/ack/"):
         if _loop:
-            asyncio.run_coroutine_threadsafe(add_device(payload), _loop)
-    elif topic.startswith("device/data/"):
-        # Handle sensor data updates
-        device_id = topic.split("/")[-1]
-        if _loop:
-            asyncio.run_coroutine_threadsafe(update_device_data(device_id, payload), _loop)
+            _loop.call_soon_threadsafe(_handle_ack, topic.split("/")[-1], msg.payload.decode(errors="replace"))
+        return
+    if not _ingesting:
+        return  # Message còn trong hàng đợi sau khi mất quyền leader
+    if _loop:
+        coro = ingest_message(topic, msg.payload, received_wall, received_at)
+        if coro is not None:
+            # Schedule the async function in the event loop
+            asyncio.run_coroutine_threadsafe(coro, _loop)
+
+def ordering_key(topic: str, raw: bytes) -> str:
+    """
+    Khóa xử lý tuần tự: MAC của controller. device/new dùng controllerMAC
+    trong payload để bản tin đăng ký và report đầu tiên của cùng device không
+    chạy song song.
+    """
+    if topic == "device/new":
+        try:
+            mac = json.loads(raw).get("controllerMAC")
+        except (ValueError, AttributeError):
+            mac = None
+        return mac if isinstance(mac, str) and mac else topic
+    return topic.split("/")[-1]
+
+def ingest_message(topic: str, raw: bytes, received_wall: datetime, received_at: float):
+    """
+    Coroutine xử lý một message ingest (None nếu bỏ qua hoặc chỉ ghi journal).
+    Dùng chung cho on_message và benchmarks/mqtt_replay.py.
+    """
+    topic_label = mqtt_topic_label(topic)
+    MQTT_MESSAGES.labels(topic_label).inc()
+    # print(f"📩 MQTT [{topic}]: {raw[:100]}...")
+
+    if topic != "device/new" and not topic.startswith("device/data/"):
+        return None
+    seq = None
+    if ingest_journal.enabled:
+        # Ghi đĩa trước; DB đang lỗi thì chỉ ghi journal, replayer áp dụng sau
+        seq, direct = ingest_journal.append(topic, raw, received_wall.timestamp())
+        if not direct:
+            return None
+
+    key = ordering_key(topic, raw)
+    if topic == "device/new":
+        coro = add_device(raw.decode(errors="replace"), received_wall)
+    else:
+        # Handle sensor data updates (JSON hoặc bin1, giải mã trong update_device_data)
+        coro = update_device_data(topic.split("/")[-1], raw, received_wall)
+    if seq is not None:
+        coro = ingest_journal.apply_live(seq, coro)
+    return _process_in_order(key, _timed(coro, topic_label, received_at))
+
+async def replay_record(record: JournalRecord):
+    """Áp dụng lại message từ ingest journal (dữ liệu cũ: không chạy automation/xác nhận lệnh)"""
+    if record.topic == "device/new":
+        await add_device(record.payload.decode(errors="replace"), datetime.fromtimestamp(record.received_at))
+    else:
+        await update_device_data(
+            record.topic.split("/")[-1], record.payload, datetime.fromtimestamp(record.received_at), live=False
+        )
 
 # Gán callbacks
 client.on_connect = on_connect
@@ -60,16 +190,28 @@ def disconnect_mqtt():
     client.disconnect()
 
 # Publish command to device
-def publish_command(device_id: str, command: dict):
+def publish_command(device_id: str, command: dict, qos: int = 0):
     """Publish command to a device control topic"""
     topic = f"device/control/{device_id}"
     payload = json.dumps(command)
-    client.publish(topic, payload)
-    print(f"📤 Published to {topic}: {payload}")
+    client.publish(topic, payload, qos=qos)
+    logger.info("mqtt publish", extra={"topic": topic, "payload": command})
 
-async def add_device(payload: str):
+def publish_tracked_command(device_id: str, command: dict):
+    """Lệnh có cmdId (command_tracker): QoS 1 để broker giữ lại khi device rớt mạng ngắn"""
+    publish_command(device_id, command, qos=1)
+
+def _handle_ack(mac: str, payload: str):
+    try:
+        command_tracker.on_ack(mac, json.loads(payload))
+    except (json.JSONDecodeError, AttributeError):
+        print(f"Invalid command ack from {mac}: {payload[:100]}")
+
+async def add_device(payload: str, received_at: datetime = None):
     """
     Handles adding a new device.
+    lastSeen = thời điểm nhận message (không phải lúc xử lý), để report nhận
+    sau bản tin đăng ký không bị coi là cũ.
     """
     try:
         device_data = json.loads(payload)
@@ -81,6 +223,8 @@ async def add_device(payload: str):
                 device_data["state"] = "ON"
             elif state in ("OFF", "OFFLINE"):
                 device_data["state"] = "OFF"
+        # Encoding device/data mà device đề xuất; không hỗ trợ -> JSON
+        device_data["telemetryEncoding"] = telemetry.normalize_encoding(device_data.get("telemetryEncoding"))
 
         device_in = DeviceCreate(**device_data)
 
@@ -89,15 +233,18 @@ async def add_device(payload: str):
             device_in.name, device_in.controllerMAC
         )
         if existing_device:
+            # Chỉ ghi các trường thực sự đổi. state/speed không lấy từ bản tin đăng ký
+            # ("online" là trạng thái kết nối): đi qua shadow ở report kế tiếp.
             update_fields = {}
-            for key in ("bssid", "state", "type", "name", "streamUrl", "humanDetectionEnabled", "speed", "cameraResolution", "fps"):
-                if key in device_data:
+            for key in ("bssid", "type", "name", "streamUrl", "humanDetectionEnabled", "cameraResolution", "fps", "telemetryEncoding"):
+                if key in device_data and getattr(existing_device, key) != device_data[key]:
                     update_fields[key] = device_data[key]
-            from datetime import datetime
-            now = datetime.now()
-            update_fields["lastSeen"] = now
-            update_fields["updatedAt"] = now
-            await existing_device.update({"$set": update_fields})
+            update_fields["updatedAt"] = datetime.now()
+            # Device vừa kết nối lại (có thể đã reboot): so desired với report đầu tiên rồi gửi delta
+            if existing_device.type != DeviceType.CAMERA:
+                update_fields["shadow.resyncPending"] = True
+            # $max: bản tin đăng ký xử lý muộn (instance khác) không kéo lastSeen lùi lại
+            await existing_device.update({"$set": update_fields, "$max": {"lastSeen": received_at or datetime.now()}})
             print(f"Device re-registered: {device_in.name}")
             return
 
@@ -105,30 +252,34 @@ async def add_device(payload: str):
         new_device = await DeviceService.create_device(device_in)
         if new_device and new_device.controllerMAC:
             print(f"New device added: {new_device.name}")
-            from datetime import datetime
-            now = datetime.now()
-            await new_device.update({"$set": {"lastSeen": now, "updatedAt": now}})
-            # Subscribe to device's data topic
-            topic = f"device/data/{new_device.controllerMAC}"
-            client.subscribe(topic)
-            print(f"Subscribed to {topic}")
+            await new_device.update({"$set": {"lastSeen": received_at or datetime.now(), "updatedAt": datetime.now()}})
+            # device/data/{mac} đã nằm trong device/data/# (subscribe riêng sẽ nhận trùng ở chế độ shared)
         else:
             print("Failed to add new device.")
 
     except json.JSONDecodeError:
         print("Error decoding JSON payload")
+    except TRANSIENT_ERRORS:
+        raise  # DB lỗi: message còn trong ingest journal, replay sau
     except Exception as e:
         print(f"An error occurred: {e}")
 
-async def update_device_data(device_id: str, payload: str):
+async def update_device_data(device_id: str, payload: Union[bytes, str], received_at: datetime = None, live: bool = True):
     """
     Handle device/data/{id} message - update device sensor data
     Ở đây, device_id là controllerMAC
+
+    lastSeen = thời điểm nhận message; chỉ ghi nếu lastSeen hiện tại không mới
+    hơn, nên khi nhiều instance ingest song song (shared subscription) message
+    cũ xử lý sau message mới của cùng device sẽ bị bỏ qua.
+
+    live=False khi replay từ ingest journal: chỉ ghi DB, không chạy automation
+    và không xác nhận lệnh theo dữ liệu cũ.
     """
     from app.models.device import Device
 
     try:
-        data = json.loads(payload)
+        data, encoding = telemetry.decode_telemetry(payload)
         
         # Get device name from payload if available
         device_name = data.get("name")
@@ -139,12 +290,13 @@ async def update_device_data(device_id: str, payload: str):
         else:
             device = await Device.find_one(Device.controllerMAC == device_id)
 
-        if device:
-            from datetime import datetime
-            now = datetime.now()
+        if device and encoding != telemetry.JSON and device.telemetryEncoding != encoding:
+            print(f"Device {device_id} sent {encoding} telemetry but registered {device.telemetryEncoding}, ignored")
+        elif device:
+            received_at = received_at or datetime.now()
             update_fields = {
-                "lastSeen": now,
-                "updatedAt": now,
+                "lastSeen": received_at,
+                "updatedAt": datetime.now(),
             }
 
             # Update sensor data if present
@@ -152,25 +304,59 @@ async def update_device_data(device_id: str, payload: str):
                 update_fields["temperature"] = data["temperature"]
             if "humidity" in data:
                 update_fields["humidity"] = data["humidity"]
-            if "state" in data:
-                state = str(data["state"]).strip().upper()
-                if state in ("ONLINE", "ON"):
-                    update_fields["state"] = "ON"
-                elif state in ("OFFLINE", "OFF"):
-                    update_fields["state"] = "OFF"
-            # Chỉ update speed nếu > 0 (khi OFF, ESP32 gửi speed=0, bỏ qua để giữ speed cũ)
-            if "speed" in data and data["speed"] > 0:
-                update_fields["speed"] = data["speed"]
             # Update camera resolution if present
             if "cameraResolution" in data:
                 update_fields["cameraResolution"] = data["cameraResolution"]
 
-            await device.update({"$set": update_fields})
-            print(f"Device {device_id} data updated: {update_fields}")
+            # state/speed đi qua shadow: reported luôn, desired chỉ khi device tự đổi
+            # (nút bấm) mà không có lệnh nào đang chờ
+            device_shadow = device.shadow
+            resync = device_shadow.resyncPending and live  # Replay: để report live kế tiếp resync
+            # Camera không đi qua shadow: firmware luôn báo "ON" (đang kết nối) và chưa
+            # xử lý lệnh nào, bật/tắt camera do backend quản lý (CAMERA_ON/CAMERA_OFF)
+            reported = {} if device.type == DeviceType.CAMERA else shadow.reported_from_data(data)
+            update = shadow.merge_updates({"$set": update_fields}, shadow.reported_update(device_shadow, reported))
+            if "$inc" in update and not resync and not command_tracker.has_pending(device_id):
+                update = shadow.merge_updates(update, shadow.desired_update(device_shadow, reported))
+            if resync:
+                update["$set"]["shadow.resyncPending"] = False
+
+            result = await Device.find_one(
+                {"_id": device.id, "$or": [{"lastSeen": None}, {"lastSeen": {"$lte": received_at}}]}
+            ).update(update)
+            if result is not None and result.matched_count == 0:
+                # Instance khác đã ghi message mới hơn của device này
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("stale device data skipped", extra={"mac": device_id})
+                return
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("device data updated", extra={"mac": device_id, "fields": list(update["$set"])})
+
+            if resync:
+                # Report đầu tiên sau khi kết nối lại: chỉ gửi phần desired chưa khớp
+                delta = shadow.compute_delta(device_shadow)
+                if delta:
+                    print(f"🔁 Resync {device.name}: delta {delta}")
+                    for command in shadow.commands_for_delta(device.type, delta):
+                        await DeviceService.dispatch_command(device, command)
+
+            if not live:
+                return
+
+            # Đánh giá các automation rule có trigger là device này
+            await automation_engine.handle_event(str(device.id), TriggerEvent.DATA, data)
+
+            # Xác nhận lệnh đang chờ nếu trạng thái báo về khớp (firmware không gửi ack);
+            # lệnh có thể do instance khác gửi
+            command_tracker.on_report(device_id, data)
+            if reported or "cmdId" in data:
+                await command_tracker.share_report(device_id, data)
             
             # NOTE: Log được ghi trong device_to_response() khi FE poll
         else:
             print(f"Device not found: {device_id}")
 
+    except TRANSIENT_ERRORS:
+        raise  # DB lỗi: message còn trong ingest journal, replay sau
     except Exception as e:
         print(f"Error updating device data: {e}")
@@ -0,0 +1,130 @@
+"""
+Ghi lại traffic MQTT mà backend nhận (MQTT_CAPTURE_DIR khác rỗng) để phát
+lại bằng benchmarks/mqtt_replay.py.
+
+Mỗi process ghi một file mqtt-{thời điểm}-{pid}.cap:
+    header   b"MQCAP1\\n" + startedAt (float64, epoch)
+    record   deltaUs (uint32, so với record trước) + topicId (uint16) + len (uint32) + payload
+    topic    lần đầu gặp topic: record topicId = 0xFFFF, payload = tên topic,
+             id được cấp tuần tự từ 0 (topic chỉ lưu một lần)
+    clock    khoảng lặng > ~71 phút: record topicId = 0xFFFE, payload = epoch float64
+
+Ghi từ thread MQTT qua buffer của file; file bị cắt ngang (process chết) vẫn
+đọc được tới record đầy đủ cuối cùng.
+"""
+import os
+import struct
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+MAGIC = b"MQCAP1\n"
+_START = struct.Struct("<d")
+_RECORD = struct.Struct("<IHI")
+_TOPIC_DEF = 0xFFFF
+_CLOCK = 0xFFFE
+_MAX_DELTA_US = 0xFFFFFFFF
+
+
+class CaptureWriter:
+    def __init__(self, path: str, max_bytes: int = 0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.records = 0
+        self._file = open(path, "wb", buffering=64 * 1024)
+        self._lock = threading.Lock()
+        self._topics: Dict[str, int] = {}
+        self._last = time.time()
+        self._file.write(MAGIC + _START.pack(self._last))
+        self._bytes = len(MAGIC) + _START.size
+        self.active = True
+
+    def write(self, topic: str, payload: bytes, received_at: float):
+        with self._lock:
+            if not self.active:
+                return
+            topic_id = self._topics.get(topic)
+            if topic_id is None:
+                topic_id = self._topics[topic] = len(self._topics)
+                self._emit(_TOPIC_DEF, topic.encode(), 0)
+            delta = max(0, int((received_at - self._last) * 1_000_000))
+            if delta > _MAX_DELTA_US:
+                self._emit(_CLOCK, _START.pack(received_at), 0)
+                self._last, delta = received_at, 0
+            else:
+                # Cộng đúng giá trị đã ghi để sai số làm tròn không dồn lại
+                self._last += delta / 1_000_000
+            self._emit(topic_id, payload, delta)
+            self.records += 1
+            if self.max_bytes and self._bytes >= self.max_bytes:
+                print(f"📼 MQTT capture reached {self._bytes} bytes, stopping: {self.path}")
+                self._close()
+
+    def _emit(self, topic_id: int, payload: bytes, delta_us: int):
+        self._file.write(_RECORD.pack(delta_us, topic_id, len(payload)))
+        self._file.write(payload)
+        self._bytes += _RECORD.size + len(payload)
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self.active:
+            self.active = False
+            self._file.close()
+
+
+def read_capture(path: str) -> Iterator[Tuple[float, str, bytes]]:
+    """(receivedAt epoch, topic, payload) theo thứ tự đã nhận"""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an MQTT capture file")
+        (clock,) = _START.unpack(f.read(_START.size))
+        topics = []
+        while True:
+            header = f.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+            delta_us, topic_id, length = _RECORD.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return  # Ghi dở khi process dừng
+            if topic_id == _TOPIC_DEF:
+                topics.append(payload.decode())
+            elif topic_id == _CLOCK:
+                (clock,) = _START.unpack(payload)
+            else:
+                clock += delta_us / 1_000_000
+                yield clock, topics[topic_id], payload
+
+
+_writer: Optional[CaptureWriter] = None
+
+
+def start_capture() -> Optional[CaptureWriter]:
+    """Bật capture nếu có MQTT_CAPTURE_DIR (gọi trước khi kết nối MQTT)"""
+    # Import ở đây để replay CLI đọc file capture mà không cần .env
+    from app.core.config import settings
+    global _writer
+    if not settings.MQTT_CAPTURE_DIR:
+        return None
+    os.makedirs(settings.MQTT_CAPTURE_DIR, exist_ok=True)
+    name = f"mqtt-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.cap"
+    _writer = CaptureWriter(os.path.join(settings.MQTT_CAPTURE_DIR, name), settings.MQTT_CAPTURE_MAX_BYTES)
+    print(f"📼 Capturing MQTT traffic to {_writer.path}")
+    return _writer
+
+
+def stop_capture():
+    global _writer
+    if _writer is not None:
+        _writer.close()
+        print(f"📼 MQTT capture closed: {_writer.records} messages in {_writer.path}")
+        _writer = None
+
+
+def capture(topic: str, payload: bytes, received_at: float):
+    writer = _writer
+    if writer is not None:
+        writer.write(topic, payload, received_at)
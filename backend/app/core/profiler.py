@@ -0,0 +1,111 @@
+"""
+Wall-clock sampling profiler cho toàn bộ thread của process (event loop,
+paho MQTT, camera capture/detection...). Kết quả ở dạng "collapsed stack"
+(mỗi dòng: frame1;frame2;...;frameN count) dùng trực tiếp với flamegraph.pl
+hoặc speedscope.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import List, Optional
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._stacks: Counter = Counter()
+        self._samples = 0
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+        self._duration = 0.0
+        self._interval = 0.01
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration: float, interval: float = 0.01) -> bool:
+        """Bắt đầu lấy mẫu trong `duration` giây; trả về False nếu đang chạy"""
+        with self._lock:
+            if self.running:
+                return False
+            self._stacks = Counter()
+            self._samples = 0
+            self._duration = duration
+            self._interval = interval
+            self._started_at = time.time()
+            self._finished_at = None
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + self._duration
+        while not self._stop_event.is_set() and time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            batch = []
+            for ident, frame in frames.items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                batch.append(";".join(reversed(stack)))
+            with self._lock:
+                self._stacks.update(batch)
+                self._samples += 1
+            self._stop_event.wait(self._interval)
+        self._finished_at = time.time()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "running": self.running,
+                "samples": self._samples,
+                "intervalSeconds": self._interval,
+                "durationSeconds": self._duration,
+                "startedAt": self._started_at,
+                "finishedAt": self._finished_at,
+            }
+
+    def collapsed(self) -> str:
+        with self._lock:
+            items = self._stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+
+def thread_cpu_times() -> List[dict]:
+    """CPU time (giây) của từng thread nếu OS hỗ trợ (Linux/macOS), None nếu không"""
+    result = []
+    getcpuclockid = getattr(time, "pthread_getcpuclockid", None)
+    for thread in threading.enumerate():
+        cpu = None
+        if getcpuclockid is not None and thread.ident is not None:
+            try:
+                cpu = time.clock_gettime(getcpuclockid(thread.ident))
+            except (OSError, OverflowError):
+                cpu = None
+        result.append({"name": thread.name, "ident": thread.ident, "cpuSeconds": cpu})
+    return result
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,49 @@
+"""
+Rate limit trong RAM theo cửa sổ cố định (fixed window) cho login.
+
+Chỉ chạy trên event loop nên không cần lock. Mỗi key giữ (bắt đầu cửa sổ,
+số lần); key hết hạn được dọn định kỳ để dict không phình khi bị quét
+nhiều IP/username.
+"""
+import time
+from typing import Dict, Optional, Tuple
+
+_PRUNE_EVERY = 1024
+
+
+class FixedWindowLimiter:
+    def __init__(self, limit: int, window_seconds: float):
+        self.limit = limit
+        self.window = window_seconds
+        self._counters: Dict[str, Tuple[float, int]] = {}
+        self._ops = 0
+
+    def _current(self, key: str, now: float) -> Tuple[float, int]:
+        entry = self._counters.get(key)
+        if entry is None or now - entry[0] >= self.window:
+            return now, 0
+        return entry
+
+    def retry_after(self, key: str) -> Optional[int]:
+        """Số giây cần chờ nếu key đã hết lượt, None nếu còn lượt"""
+        now = time.monotonic()
+        start, count = self._current(key, now)
+        if count >= self.limit:
+            return max(1, int(start + self.window - now + 0.999))
+        return None
+
+    def hit(self, key: str):
+        now = time.monotonic()
+        start, count = self._current(key, now)
+        self._counters[key] = (start, count + 1)
+        self._ops += 1
+        if self._ops % _PRUNE_EVERY == 0:
+            self._prune(now)
+
+    def reset(self, key: str):
+        self._counters.pop(key, None)
+
+    def _prune(self, now: float):
+        expired = [key for key, (start, _) in self._counters.items() if now - start >= self.window]
+        for key in expired:
+            del self._counters[key]
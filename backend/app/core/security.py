@@ -1,11 +1,28 @@
+import asyncio
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional, Any, Union
 from jose import jwt
 from passlib.context import CryptContext
 from app.core.config import settings
+from app.core.metrics import PASSWORD_HASH_LATENCY
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt tốn CPU cố ý (~100-300ms): chạy trên pool riêng để không chặn event loop
+# (MQTT, camera stream) và không chiếm threadpool mặc định của FastAPI/asyncio.
+_hash_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+)
+_hash_semaphore: Optional[asyncio.Semaphore] = None
+_hash_pending = 0
+
+
+class PasswordHasherBusy(Exception):
+    """Quá nhiều yêu cầu hash/verify đang chờ (login storm)"""
+
 def create_access_token(subject: Union[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -16,13 +33,17 @@ def create_access_token(subject: Union[str, Any], expires_delta: Optional[timede
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-def create_refresh_token(subject: Union[str, Any], expires_delta: Optional[timedelta] = None) -> str:
+def new_token_id() -> str:
+    """Id ngẫu nhiên 96 bit cho claim "jti" (16 ký tự)"""
+    return secrets.token_urlsafe(12)
+
+def create_refresh_token(subject: Union[str, Any], jti: str, expires_delta: Optional[timedelta] = None) -> str:
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
     
-    to_encode = {"exp": expire, "sub": str(subject), "type": "refresh"}
+    to_encode = {"exp": expire, "sub": str(subject), "type": "refresh", "jti": jti}
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
@@ -31,3 +52,29 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
+
+
+async def _run_hash(operation: str, func, *args):
+    """Chạy func trên pool bcrypt, tối đa PASSWORD_HASH_MAX_PENDING yêu cầu chờ cùng lúc"""
+    global _hash_semaphore, _hash_pending
+    if _hash_semaphore is None:
+        _hash_semaphore = asyncio.Semaphore(settings.PASSWORD_HASH_WORKERS)
+    if _hash_pending >= settings.PASSWORD_HASH_MAX_PENDING:
+        raise PasswordHasherBusy()
+    _hash_pending += 1
+    try:
+        async with _hash_semaphore:
+            start = time.perf_counter()
+            result = await asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+            PASSWORD_HASH_LATENCY.labels(operation).observe(time.perf_counter() - start)
+            return result
+    finally:
+        _hash_pending -= 1
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_hash("verify", verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_hash("hash", get_password_hash, password)
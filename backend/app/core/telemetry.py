@@ -0,0 +1,107 @@
+"""
+Giải mã payload device/data/{mac}: JSON (mặc định) hoặc khung nhị phân "bin1"
+cho sensor gửi tần suất cao.
+
+Device chọn encoding khi đăng ký: device/new có "telemetryEncoding": "bin1"
+(không có / không hỗ trợ -> "json"). Backend chỉ nhận khung bin1 từ device đã
+đăng ký bin1.
+
+Khung bin1 (little-endian), byte đầu 0xB1 nên không nhầm với JSON ("{"):
+    0xB1 | flags (uint8) | các trường có bit trong flags, theo thứ tự:
+        bit 0  temperature  int16   x100 (°C)
+        bit 1  humidity     uint16  x100 (%)
+        bit 2  state        uint8   0 = OFF, 1 = ON
+        bit 3  speed        uint8
+    | bit 7: name (uint8 độ dài + UTF-8), cho controller có nhiều device
+
+Ví dụ sensor nhiệt độ + độ ẩm: 6 byte thay cho ~40 byte JSON.
+"""
+import json
+import struct
+from typing import Dict, Tuple, Union
+
+JSON = "json"
+BIN1 = "bin1"
+ENCODINGS = (JSON, BIN1)
+
+MAGIC = 0xB1
+_NAME_FLAG = 0x80
+# (tên, mã struct, hệ số)
+_FIELDS = (
+    ("temperature", "h", 100),
+    ("humidity", "H", 100),
+    ("state", "B", None),
+    ("speed", "B", None),
+)
+_STATES = ("OFF", "ON")
+
+# flags -> (Struct, tên trường, hệ số): mỗi tổ hợp chỉ dựng một lần
+_layouts: Dict[int, tuple] = {}
+
+
+def _layout(flags: int) -> tuple:
+    layout = _layouts.get(flags)
+    if layout is None:
+        fmt, names, scales = "<", [], []
+        for bit, (name, code, scale) in enumerate(_FIELDS):
+            if flags & (1 << bit):
+                fmt += code
+                names.append(name)
+                scales.append(scale)
+        layout = _layouts[flags] = (struct.Struct(fmt), tuple(names), tuple(scales))
+    return layout
+
+
+def normalize_encoding(encoding) -> str:
+    encoding = str(encoding or JSON).strip().lower()
+    return encoding if encoding in ENCODINGS else JSON
+
+
+def decode_bin1(raw: bytes) -> dict:
+    try:
+        flags = raw[1]
+        fields, names, scales = _layout(flags & 0x0F)
+        values = fields.unpack_from(raw, 2)
+        data = {}
+        for name, scale, value in zip(names, scales, values):
+            data[name] = value / scale if scale else value
+        if "state" in data:
+            data["state"] = _STATES[data["state"]]
+        if flags & _NAME_FLAG:
+            offset = 2 + fields.size
+            length = raw[offset]
+            name = raw[offset + 1:offset + 1 + length]
+            if len(name) != length:
+                raise ValueError("truncated name")
+            data["name"] = name.decode()
+        return data
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid bin1 telemetry frame: {e}") from e
+
+
+def encode_bin1(data: dict) -> bytes:
+    """Mã hóa như firmware (dùng cho benchmark / giả lập device)"""
+    flags, values = 0, []
+    for bit, (name, _, scale) in enumerate(_FIELDS):
+        value = data.get(name)
+        if value is None:
+            continue
+        flags |= 1 << bit
+        if name == "state":
+            value = 1 if str(value).upper() in ("ON", "ONLINE") else 0
+        values.append(int(round(value * scale)) if scale else int(value))
+    frame = bytes((MAGIC, flags | (_NAME_FLAG if data.get("name") else 0))) + _layout(flags)[0].pack(*values)
+    if data.get("name"):
+        name = data["name"].encode()
+        frame += bytes((len(name),)) + name
+    return frame
+
+
+def decode_telemetry(payload: Union[bytes, str]) -> Tuple[dict, str]:
+    """(data, encoding); lỗi định dạng -> ValueError (json.JSONDecodeError là ValueError)"""
+    if isinstance(payload, (bytes, bytearray)) and payload[:1] == b"\xb1":
+        return decode_bin1(payload), BIN1
+    data = json.loads(payload)
+    if not isinstance(data, dict):
+        raise ValueError("Telemetry payload must be a JSON object")
+    return data, JSON
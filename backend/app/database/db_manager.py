@@ -21,6 +21,7 @@ from app.models.home import Home
 from app.models.room import Room
 from app.models.device import Device
 from app.models.activity_log import ActivityLog
+from app.models.automation_rule import AutomationRule
 
 
 async def check_connection():
@@ -44,10 +45,11 @@ async def get_database_status():
         client = AsyncIOMotorClient(settings.MONGODB_URL)
         db = client[settings.MONGO_DATABASE_NAME]
         
-        # Init Beanie để có thể dùng Model
+        # Init Beanie để có thể dùng Model (chỉ đọc: không tạo index, không migrate)
         await init_beanie(
             database=db,
-            document_models=[User, Session, Home, Room, Device, ActivityLog]
+            document_models=[User, Session, Home, Room, Device, ActivityLog, AutomationRule],
+            skip_indexes=True
         )
         
         # Count documents in each collection
@@ -57,7 +59,8 @@ async def get_database_status():
             "Homes": Home,
             "Rooms": Room,
             "Devices": Device,
-            "Activity Logs": ActivityLog
+            "Activity Logs": ActivityLog,
+            "Automations": AutomationRule
         }
         
         print("📊 Database Status:")
@@ -86,6 +89,9 @@ async def reset_database():
     
     try:
         # Clear in reverse order to avoid dependency issues
+        print("Clearing Automations...")
+        await AutomationRule.delete_all()
+        
         print("Clearing Activity Logs...")
         await ActivityLog.delete_all()
         
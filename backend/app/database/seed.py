@@ -23,6 +23,7 @@ from app.models.device import Device, DeviceType, DeviceState
 from app.models.activity_log import ActivityLog, LogType
 from app.core.security import get_password_hash
 from app.core.config import settings
+from app.core.database import migrate_sessions
 
 # BSSID riêng cho từng admin (giả lập mỗi nhà 1 mạng WiFi khác nhau)
 BSSID_ADMIN1 = "11:11:11:11:11:11"
@@ -316,6 +317,7 @@ async def seed_data():
         client = AsyncIOMotorClient(settings.MONGODB_URL)
         db = client[settings.MONGO_DATABASE_NAME]
         
+        await migrate_sessions(db)
         await init_beanie(
             database=db,
             document_models=[
@@ -1,40 +1,23 @@
 import sys
 import os
 import logging
-from datetime import datetime
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi.responses import Response
 
 from app.core.config import settings
 from app.core.lifespan import lifespan
 from app.api.api import api_router
+from app.core.metrics import PrometheusMiddleware, REGISTRY, CONTENT_TYPE_LATEST
+from app.core.log_config import setup_logging, AccessLogMiddleware
 
-# Cấu hình logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+# Cấu hình logging (JSON, ghi qua queue ở thread riêng)
+setup_logging()
 logger = logging.getLogger(__name__)
 
-
-# Middleware để log mỗi request
-class LoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # Log thông tin request
-        logger.info(f"📨 {request.method} {request.url.path}")
-        
-        response = await call_next(request)
-        
-        # Log thông tin response
-        logger.info(f"✅ {request.method} {request.url.path} - Status: {response.status_code}")
-        
-        return response
-
 # Khởi tạo FastAPI app
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -42,8 +25,11 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-# Thêm logging middleware
-app.add_middleware(LoggingMiddleware)
+# Access log có lấy mẫu (pure ASGI, không bọc StreamingResponse)
+app.add_middleware(AccessLogMiddleware)
+
+# Đo latency theo route cho /metrics
+app.add_middleware(PrometheusMiddleware)
 
 # Cấu hình CORS
 if settings.CORS_ORIGINS:
@@ -62,6 +48,11 @@ app.include_router(api_router, prefix=settings.API_V1_STR)
 def root():
     return {"message": "Welcome to IoT Application Backend"}
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE_LATEST)
+
 
 if __name__ == "__main__":
     import uvicorn
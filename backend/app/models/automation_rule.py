@@ -0,0 +1,55 @@
+from beanie import Document, PydanticObjectId, Indexed
+from typing import Optional, Union
+from datetime import datetime
+from enum import Enum
+from pydantic import BaseModel, Field
+
+class TriggerEvent(str, Enum):
+    DATA = "DATA"                      # device/data/{mac} (sensor, fan state...)
+    HUMAN_DETECTED = "HUMAN_DETECTED"  # CameraStream: một người mới vào khung hình (data: trackId, occupancy)
+    PERSON_EXITED = "PERSON_EXITED"    # CameraStream: một người rời khung hình (data: trackId, occupancy)
+
+class TriggerOperator(str, Enum):
+    GT = "gt"
+    GTE = "gte"
+    LT = "lt"
+    LTE = "lte"
+    EQ = "eq"
+    NE = "ne"
+
+class RuleActionType(str, Enum):
+    """Lệnh automation được phép gửi (CAMERA_MODE cần humanDetectionEnabled nên không hỗ trợ)"""
+    ON = "ON"
+    OFF = "OFF"
+    SET_SPEED = "SET_SPEED"
+    LIGHT_ON = "LIGHT_ON"
+    LIGHT_OFF = "LIGHT_OFF"
+    CAMERA_ON = "CAMERA_ON"
+    CAMERA_OFF = "CAMERA_OFF"
+
+class RuleTrigger(BaseModel):
+    deviceId: PydanticObjectId
+    event: TriggerEvent = Field(default=TriggerEvent.DATA)
+    field: Optional[str] = None  # Ví dụ: "temperature" (không cần cho HUMAN_DETECTED)
+    operator: Optional[TriggerOperator] = None
+    value: Optional[Union[float, str]] = None
+
+class RuleAction(BaseModel):
+    deviceId: PydanticObjectId
+    action: RuleActionType
+    speed: Optional[int] = None
+
+class AutomationRule(Document):
+    homeId: Indexed(PydanticObjectId)
+    name: str
+    enabled: bool = True
+    trigger: RuleTrigger
+    action: RuleAction
+    cooldownSeconds: int = 60  # Không kích hoạt lại rule trong khoảng này
+    lastTriggeredAt: Optional[datetime] = None
+    createdAt: datetime = Field(default_factory=datetime.now)
+    updatedAt: datetime = Field(default_factory=datetime.now)
+
+    class Settings:
+        name = "automation_rules"
+        indexes = ["trigger.deviceId"]
@@ -1,8 +1,8 @@
 from beanie import Document, PydanticObjectId, Indexed
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 from enum import Enum
-from pydantic import Field
+from pydantic import BaseModel, Field
 
 class DeviceType(str, Enum):
     LIGHT = "LIGHT"
@@ -14,6 +14,19 @@ class DeviceState(str, Enum):
     ON = "ON"
     OFF = "OFF"
 
+class DetectionRegion(BaseModel):
+    name: Optional[str] = None
+    points: List[List[float]]  # Polygon [[x, y], ...], tọa độ chuẩn hóa 0..1 theo kích thước frame
+
+class DeviceShadow(BaseModel):
+    desired: Dict[str, Any] = Field(default_factory=dict)  # User/automation yêu cầu (state, speed)
+    reported: Dict[str, Any] = Field(default_factory=dict)  # Device báo về qua device/data hoặc ack
+    desiredVersion: int = 0
+    reportedVersion: int = 0
+    desiredAt: Optional[datetime] = None
+    reportedAt: Optional[datetime] = None
+    resyncPending: bool = False  # Vừa re-register: gửi delta khi có report đầu tiên
+
 class Device(Document):
     roomId: Optional[Indexed(PydanticObjectId)] = None
     name: str
@@ -21,16 +34,19 @@ class Device(Document):
     controllerMAC: Optional[Indexed(str, unique=True)] = None
     bssid: str
     type: str = Field(default=DeviceType.LIGHT)  # Store as string
-    state: str = Field(default=DeviceState.OFF)  # Store as string
+    state: str = Field(default=DeviceState.OFF)  # Store as string, = shadow.reported.state
     speed: Optional[int] = 1 # For FAN: 1..3
     streamUrl: Optional[str] = None # For CAMERA
     humanDetectionEnabled: Optional[bool] = False
+    detectionRegions: Optional[List[DetectionRegion]] = None  # For CAMERA: ROI cho detection, None = cả frame
     cameraResolution: Optional[str] = None  # For CAMERA: 1080p, 720p, ...
     fps: Optional[float] = None  # For CAMERA: frames per second
+    telemetryEncoding: str = "json"  # Encoding của device/data, chọn khi đăng ký: "json" | "bin1"
     temperature: Optional[float] = None  # For SENSOR: °C
     humidity: Optional[float] = None  # For SENSOR: %
     temperatureThreshold: Optional[float] = None  # Ngưỡng cảnh báo nhiệt độ (°C)
     lastSeen: Optional[datetime] = None
+    shadow: DeviceShadow = Field(default_factory=DeviceShadow)
     createdAt: datetime = Field(default_factory=datetime.now)
     updatedAt: datetime = Field(default_factory=datetime.now)
 
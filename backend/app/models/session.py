@@ -1,12 +1,17 @@
 from beanie import Document, PydanticObjectId, Indexed
 from datetime import datetime
-from pydantic import Field
+from pydantic import BaseModel, Field
 
 class Session(Document):
     userId: Indexed(PydanticObjectId)
-    refreshToken: Indexed(str, unique=True)
-    expiresAt: datetime
+    jti: Indexed(str, unique=True)  # Id ngắn của refresh token (claim "jti"), không lưu cả JWT
+    expiresAt: Indexed(datetime)  # Dùng cho refresh (expiresAt > now) và job dọn session hết hạn
     createdAt: datetime = Field(default_factory=datetime.utcnow)  # Keep UTC for consistency with JWT
 
     class Settings:
         name = "sessions"
+
+
+class SessionOwner(BaseModel):
+    """Projection khi refresh: chỉ đọc userId từ index jti"""
+    userId: PydanticObjectId
@@ -0,0 +1,49 @@
+from pydantic import BaseModel, model_validator
+from typing import Optional, Union
+from datetime import datetime
+from app.models.automation_rule import TriggerEvent, TriggerOperator, RuleActionType
+
+class RuleTriggerIn(BaseModel):
+    deviceId: str
+    event: TriggerEvent = TriggerEvent.DATA  # "DATA", "HUMAN_DETECTED" hoặc "PERSON_EXITED"
+    field: Optional[str] = None  # Ví dụ: "temperature", "humidity", "state"
+    operator: Optional[TriggerOperator] = None  # gt, gte, lt, lte, eq, ne
+    value: Optional[Union[float, str]] = None
+
+class RuleActionIn(BaseModel):
+    deviceId: str
+    action: RuleActionType  # "ON", "OFF", "SET_SPEED", "LIGHT_ON", ...
+    speed: Optional[int] = None
+
+    @model_validator(mode='after')
+    def require_speed(self):
+        if self.action == RuleActionType.SET_SPEED and self.speed is None:
+            raise ValueError("SET_SPEED requires speed")
+        return self
+
+class AutomationRuleCreate(BaseModel):
+    homeId: str
+    name: str
+    enabled: Optional[bool] = True
+    trigger: RuleTriggerIn
+    action: RuleActionIn
+    cooldownSeconds: Optional[int] = 60
+
+class AutomationRuleUpdate(BaseModel):
+    name: Optional[str] = None
+    enabled: Optional[bool] = None
+    trigger: Optional[RuleTriggerIn] = None
+    action: Optional[RuleActionIn] = None
+    cooldownSeconds: Optional[int] = None
+
+class AutomationRuleResponse(BaseModel):
+    id: str
+    homeId: str
+    name: str
+    enabled: bool
+    trigger: RuleTriggerIn
+    action: RuleActionIn
+    cooldownSeconds: int
+    lastTriggeredAt: Optional[datetime] = None
+    createdAt: datetime
+    updatedAt: datetime
@@ -1,7 +1,13 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Annotated, List, Optional, Tuple
 from datetime import datetime
-from app.models.device import DeviceType, DeviceState
+from app.models.device import DeviceType, DeviceState, DetectionRegion
+
+NormalizedCoord = Annotated[float, Field(ge=0, le=1)]
+
+class DetectionRegionIn(BaseModel):
+    name: Optional[str] = None
+    points: List[Tuple[NormalizedCoord, NormalizedCoord]] = Field(..., min_length=3)  # [[x, y], ...] 0..1
 
 class NewDeviceInLAN(BaseModel):
     bssid: str
@@ -19,11 +25,13 @@ class DeviceCreate(BaseModel):
     humanDetectionEnabled: Optional[bool] = False
     cameraResolution: Optional[str] = None
     fps: Optional[float] = None
+    telemetryEncoding: Optional[str] = "json"  # "json" | "bin1" (app/core/telemetry.py)
 
 class DeviceUpdate(BaseModel):
     custom_name: Optional[str] = None
     roomId: Optional[str] = None
     temperatureThreshold: Optional[float] = None  # Ngưỡng cảnh báo nhiệt độ
+    detectionRegions: Optional[List[DetectionRegionIn]] = None  # CAMERA: [] = bỏ ROI, detect cả frame
 
 class DeviceCommand(BaseModel):
     action: str  # "ON", "OFF", "SET_SPEED"
@@ -41,6 +49,7 @@ class DeviceResponse(BaseModel):
     state: DeviceState
     speed: Optional[int] = None
     humanDetectionEnabled: Optional[bool] = None
+    detectionRegions: Optional[List[DetectionRegion]] = None
     streamUrl: Optional[str] = None
     cameraResolution: Optional[str] = None
     fps: Optional[float] = None
@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+from datetime import datetime
+
+class RecordingResponse(BaseModel):
+    id: str
+    deviceId: str
+    startedAt: datetime
+    endedAt: datetime
+    durationSec: float
+    frames: int
+    bytes: int
+    playbackUrl: str  # multipart MJPEG theo đúng nhịp đã ghi
+    fileUrl: str      # file .mjpeg hỗ trợ HTTP Range
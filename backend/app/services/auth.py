@@ -1,13 +1,36 @@
 from datetime import datetime, timedelta
 from typing import Optional
+from beanie import PydanticObjectId
 from jose import jwt, JWTError
 from fastapi import HTTPException, status # Thêm dòng này
 from app.core import security
 from app.core.config import settings
-from app.models.session import Session
+from app.core.metrics import LOGIN_RATE_LIMITED
+from app.core.rate_limit import FixedWindowLimiter
+from app.models.session import Session, SessionOwner
 from app.models.user import User
 from app.schemas.auth import UserRegister
 
+# Giới hạn login: tổng số lần thử theo IP, số lần sai theo username
+_login_ip_limiter = FixedWindowLimiter(settings.LOGIN_MAX_ATTEMPTS_PER_IP, settings.LOGIN_RATE_LIMIT_WINDOW_SECONDS)
+_login_failure_limiter = FixedWindowLimiter(settings.LOGIN_MAX_FAILURES_PER_USERNAME, settings.LOGIN_RATE_LIMIT_WINDOW_SECONDS)
+
+
+def _too_many_attempts(retry_after: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many login attempts, try again later",
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+def _hasher_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Authentication service is busy, try again later",
+        headers={"Retry-After": "1"},
+    )
+
 
 class AuthService:
     @staticmethod
@@ -38,7 +61,10 @@ class AuthService:
                     detail="Email already registered"
                 )
 
-        hashed_password = security.get_password_hash(user_in.password)
+        try:
+            hashed_password = await security.get_password_hash_async(user_in.password)
+        except security.PasswordHasherBusy:
+            raise _hasher_busy()
         user = User(
             username=user_in.username,
             email=user_in.email,
@@ -48,22 +74,46 @@ class AuthService:
         return user
 
     @staticmethod
-    async def authenticate_user(username: str, password: str) -> Optional[User]:
+    async def authenticate_user(username: str, password: str, client_ip: Optional[str] = None) -> Optional[User]:
         """
         Authenticates a user.
 
         Args:
             username: The username.
             password: The password.
+            client_ip: The client address, used for per-IP rate limiting.
 
         Returns:
             The authenticated user, or None if authentication fails.
+
+        Raises:
+            HTTPException: 429 if the IP or username is rate limited,
+                503 if the password hashing pool is saturated.
         """
+        ip_key = client_ip or "unknown"
+        user_key = username.strip().lower()
+        retry_after = _login_ip_limiter.retry_after(ip_key)
+        if retry_after is not None:
+            LOGIN_RATE_LIMITED.labels("ip").inc()
+            raise _too_many_attempts(retry_after)
+        retry_after = _login_failure_limiter.retry_after(user_key)
+        if retry_after is not None:
+            LOGIN_RATE_LIMITED.labels("username").inc()
+            raise _too_many_attempts(retry_after)
+        _login_ip_limiter.hit(ip_key)
+
         user = await User.find_one(User.username == username)
         if not user:
+            _login_failure_limiter.hit(user_key)
             return None
-        if not security.verify_password(password, user.passwordHash):
+        try:
+            valid = await security.verify_password_async(password, user.passwordHash)
+        except security.PasswordHasherBusy:
+            raise _hasher_busy()
+        if not valid:
+            _login_failure_limiter.hit(user_key)
             return None
+        _login_failure_limiter.reset(user_key)
         return user
 
     @staticmethod
@@ -77,13 +127,14 @@ class AuthService:
         Returns:
             A tuple containing the access token and refresh token.
         """
+        jti = security.new_token_id()
         access_token = security.create_access_token(user.id)
-        refresh_token = security.create_refresh_token(user.id)
+        refresh_token = security.create_refresh_token(user.id, jti)
 
-        # Save session
+        # Save session (chỉ lưu jti, không lưu cả JWT)
         session = Session(
             userId=user.id,
-            refreshToken=refresh_token,
+            jti=jti,
             expiresAt=datetime.utcnow()
             + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS),
         )
@@ -96,32 +147,27 @@ class AuthService:
         """
         Refreshes an access token using a refresh token.
 
+        Chữ ký/hạn của JWT được kiểm tra cục bộ; session chỉ cần một lần tra
+        index jti, projection lấy userId (không đọc User).
+
         Args:
             refresh_token: The refresh token.
 
         Returns:
             A new access token, or None if the refresh token is invalid.
         """
-        try:
-            payload = jwt.decode(
-                refresh_token,
-                settings.SECRET_KEY,
-                algorithms=[settings.ALGORITHM],
-            )
-            if payload["type"] != "refresh":
-                return None
-
-            session = await Session.find_one(Session.refreshToken == refresh_token)
-            if not session:
-                return None
-
-            user = await User.get(session.userId)
-            if not user:
-                return None
+        jti = _refresh_token_id(refresh_token)
+        if not jti:
+            return None
 
-            return security.create_access_token(user.id)
-        except JWTError:
+        owner = await Session.find_one(
+            Session.jti == jti,
+            Session.expiresAt > datetime.utcnow(),
+            projection_model=SessionOwner,
+        )
+        if not owner:
             return None
+        return security.create_access_token(owner.userId)
 
     @staticmethod
     async def logout(refresh_token: str):
@@ -131,6 +177,46 @@ class AuthService:
         Args:
             refresh_token: The refresh token of the session to delete.
         """
-        session = await Session.find_one(Session.refreshToken == refresh_token)
-        if session:
-            await session.delete()
+        jti = _refresh_token_id(refresh_token, verify_exp=False)
+        if jti:
+            await Session.find(Session.jti == jti).delete()
+
+    @staticmethod
+    async def revoke_all_sessions(user_id: PydanticObjectId) -> int:
+        """
+        Revokes every session of a user (logout on all devices) in one delete.
+
+        Access token đã cấp vẫn dùng được đến khi hết hạn (ACCESS_TOKEN_EXPIRE_MINUTES).
+
+        Returns:
+            The number of revoked sessions.
+        """
+        result = await Session.find(Session.userId == user_id).delete()
+        return result.deleted_count if result else 0
+
+    @staticmethod
+    async def purge_expired_sessions() -> int:
+        """
+        Deletes expired sessions.
+
+        Returns:
+            The number of deleted sessions.
+        """
+        result = await Session.find(Session.expiresAt <= datetime.utcnow()).delete()
+        return result.deleted_count if result else 0
+
+
+def _refresh_token_id(refresh_token: str, verify_exp: bool = True) -> Optional[str]:
+    """jti của refresh token hợp lệ (đúng chữ ký, đúng type), None nếu không"""
+    try:
+        payload = jwt.decode(
+            refresh_token,
+            settings.SECRET_KEY,
+            algorithms=[settings.ALGORITHM],
+            options={"verify_exp": verify_exp},
+        )
+    except JWTError:
+        return None
+    if payload.get("type") != "refresh":
+        return None
+    return payload.get("jti")
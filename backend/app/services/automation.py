@@ -0,0 +1,321 @@
+import asyncio
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime
+from beanie import PydanticObjectId
+from bson.errors import InvalidId
+from app.models.automation_rule import AutomationRule, RuleTrigger, RuleAction, TriggerOperator
+from app.models.device import Device
+from app.models.room import Room
+from app.models.user import User
+from app.models.activity_log import LogType
+from app.schemas.automation import AutomationRuleCreate, AutomationRuleUpdate, RuleTriggerIn, RuleActionIn
+from app.schemas.device import DeviceCommand
+from app.services.device import DeviceService
+from app.services.home import HomeService
+from app.services.activity_log import ActivityLogService
+
+_NUMERIC_OPERATORS = {
+    TriggerOperator.GT: lambda a, b: a > b,
+    TriggerOperator.GTE: lambda a, b: a >= b,
+    TriggerOperator.LT: lambda a, b: a < b,
+    TriggerOperator.LTE: lambda a, b: a <= b,
+    TriggerOperator.EQ: lambda a, b: a == b,
+    TriggerOperator.NE: lambda a, b: a != b,
+}
+
+
+RULES_CHANNEL = "automation-rules"
+
+
+def _to_float(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def evaluate_trigger(trigger: RuleTrigger, data: Optional[dict]) -> bool:
+    """Kiểm tra điều kiện trigger với dữ liệu của event"""
+    if not trigger.field:
+        # Không có điều kiện (ví dụ HUMAN_DETECTED) -> luôn match
+        return True
+    if not data or trigger.field not in data:
+        return False
+
+    compare = _NUMERIC_OPERATORS.get(trigger.operator or TriggerOperator.EQ)
+    if compare is None:
+        return False
+
+    actual = data[trigger.field]
+    actual_num, expected_num = _to_float(actual), _to_float(trigger.value)
+    if actual_num is not None and expected_num is not None:
+        return compare(actual_num, expected_num)
+
+    # So sánh chuỗi (ví dụ state == "ON"), chỉ hỗ trợ eq/ne
+    if trigger.operator not in (None, TriggerOperator.EQ, TriggerOperator.NE):
+        return False
+    return compare(str(actual).strip().upper(), str(trigger.value).strip().upper())
+
+
+class AutomationEngine:
+    """
+    Engine chạy trong process: giữ index deviceId -> rules để mỗi event
+    chỉ đánh giá các rule liên quan, kèm cooldown theo từng rule.
+    """
+
+    def __init__(self):
+        # (deviceId, event) -> rules. Dict được thay thế nguyên khối khi reload
+        # nên thread camera đọc không cần lock.
+        self._index: Dict[tuple, List[AutomationRule]] = {}
+        self._last_fired: Dict[str, float] = {}  # ruleId -> monotonic time
+        self._cooldown_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def load(self):
+        """Nạp toàn bộ rule đang bật từ MongoDB và build index"""
+        self._loop = asyncio.get_running_loop()
+        rules = await AutomationRule.find(AutomationRule.enabled == True).to_list()
+        self._rebuild(rules)
+        for rule in rules:
+            self._restore_cooldown(rule)
+        print(f"⚙️ Automation engine loaded {len(rules)} rules")
+
+    def _rebuild(self, rules: List[AutomationRule]):
+        index: Dict[tuple, List[AutomationRule]] = {}
+        for rule in rules:
+            key = (str(rule.trigger.deviceId), rule.trigger.event)
+            index.setdefault(key, []).append(rule)
+        self._index = index
+
+    def _restore_cooldown(self, rule: AutomationRule):
+        """Đổi lastTriggeredAt (lưu DB) sang mốc monotonic để cooldown còn hiệu lực sau restart/reload"""
+        if rule.lastTriggeredAt is None:
+            return
+        elapsed = (datetime.now() - rule.lastTriggeredAt).total_seconds()
+        if elapsed >= rule.cooldownSeconds:
+            return
+        fired_at = time.monotonic() - max(0.0, elapsed)
+        rule_id = str(rule.id)
+        with self._cooldown_lock:
+            last = self._last_fired.get(rule_id)
+            if last is None or fired_at > last:
+                self._last_fired[rule_id] = fired_at
+
+    def _all_rules(self) -> List[AutomationRule]:
+        return [rule for rules in self._index.values() for rule in rules]
+
+    def upsert_rule(self, rule: AutomationRule):
+        """Cập nhật index sau khi rule được tạo/sửa"""
+        rules = [r for r in self._all_rules() if r.id != rule.id]
+        if rule.enabled:
+            rules.append(rule)
+        self._rebuild(rules)
+        self._restore_cooldown(rule)
+
+    def remove_rule(self, rule_id: PydanticObjectId):
+        self._rebuild([r for r in self._all_rules() if r.id != rule_id])
+        with self._cooldown_lock:
+            self._last_fired.pop(str(rule_id), None)
+
+    async def broadcast_change(self, rule_id: PydanticObjectId):
+        """Báo các instance khác nạp lại rule (index chỉ nằm trong RAM từng process)"""
+        from app.core.coordination import get_coordinator
+        await get_coordinator().publish(RULES_CHANNEL, {"ruleId": str(rule_id)})
+
+    async def handle_remote_change(self, message: dict):
+        """Handler của RULES_CHANNEL: đọc lại rule từ MongoDB (bị xóa -> bỏ khỏi index)"""
+        from app.core.coordination import get_coordinator
+        if message.get("origin") == get_coordinator().instance_id:
+            return
+        rule_id = PydanticObjectId(message["ruleId"])
+        rule = await AutomationRule.get(rule_id)
+        if rule:
+            self.upsert_rule(rule)
+        else:
+            self.remove_rule(rule_id)
+
+    def has_rules(self, device_id: str, event: str) -> bool:
+        return (device_id, event) in self._index
+
+    def _match(self, device_id: str, event: str, data: Optional[dict]) -> List[Tuple[AutomationRule, Optional[float]]]:
+        """
+        Các rule thỏa điều kiện và đã hết cooldown, kèm mốc fire trước đó. Mốc
+        fire được giữ chỗ ngay (event đồng thời không fire trùng), thực thi lỗi
+        thì trả lại qua _release_cooldown.
+        """
+        candidates = self._index.get((device_id, event))
+        if not candidates:
+            return []
+
+        now = time.monotonic()
+        matched = []
+        for rule in candidates:
+            if not evaluate_trigger(rule.trigger, data):
+                continue
+            rule_id = str(rule.id)
+            with self._cooldown_lock:
+                last = self._last_fired.get(rule_id)
+                if last is not None and now - last < rule.cooldownSeconds:
+                    continue
+                self._last_fired[rule_id] = now
+            matched.append((rule, last))
+        return matched
+
+    def _release_cooldown(self, rule: AutomationRule, previous: Optional[float]):
+        rule_id = str(rule.id)
+        with self._cooldown_lock:
+            if previous is None:
+                self._last_fired.pop(rule_id, None)
+            else:
+                self._last_fired[rule_id] = previous
+
+    async def handle_event(self, device_id: str, event: str, data: Optional[dict] = None):
+        """Gọi từ event loop (ví dụ update_device_data)"""
+        for rule, previous in self._match(device_id, event, data):
+            if not await self._execute(rule):
+                self._release_cooldown(rule, previous)
+
+    def submit_threadsafe(self, device_id: str, event: str, data: Optional[dict] = None):
+        """Gọi từ thread khác (camera): chỉ schedule khi có rule liên quan"""
+        if self._loop is None or not self.has_rules(device_id, event):
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.handle_event(device_id, event, data), self._loop)
+        except Exception as e:
+            print(f"⚠️ Failed to submit automation event: {e}")
+
+    async def _execute(self, rule: AutomationRule) -> bool:
+        """False nếu chưa gửi được lệnh (không tính cooldown)"""
+        try:
+            device = await Device.get(rule.action.deviceId)
+            if not device:
+                print(f"⚠️ Automation '{rule.name}': target device not found")
+                return False
+
+            command = DeviceCommand(action=rule.action.action.value, speed=rule.action.speed)
+            await DeviceService.dispatch_command(device, command)
+        except Exception as e:
+            print(f"⚠️ Error executing automation '{rule.name}': {e}")
+            return False
+
+        try:
+            now = datetime.now()
+            rule.lastTriggeredAt = now
+            await AutomationRule.find_one(AutomationRule.id == rule.id).update(
+                {"$set": {"lastTriggeredAt": now}}
+            )
+            await ActivityLogService.create_log(
+                action="AUTOMATION_TRIGGERED",
+                message=f"Automation '{rule.name}': {device.name} -> {command.action}",
+                userId=None,
+                homeId=str(rule.homeId),
+                log_type=LogType.INFO
+            )
+            print(f"⚙️ Automation '{rule.name}' fired: {device.name} -> {command.action}")
+        except Exception as e:
+            print(f"⚠️ Error recording automation '{rule.name}': {e}")
+        return True
+
+
+automation_engine = AutomationEngine()
+
+
+class AutomationService:
+    @staticmethod
+    async def _device_in_home(device_id: str, home_id: PydanticObjectId, user: User) -> bool:
+        try:
+            device = await DeviceService.get_device_by_id(device_id, user)
+        except InvalidId:
+            return False
+        if not device or not device.roomId:
+            return False
+        room = await Room.get(device.roomId)
+        return room is not None and room.homeId == home_id
+
+    @staticmethod
+    async def _build_parts(trigger_in: RuleTriggerIn, action_in: RuleActionIn, home_id: PydanticObjectId, user: User):
+        if not await AutomationService._device_in_home(trigger_in.deviceId, home_id, user):
+            return None
+        if not await AutomationService._device_in_home(action_in.deviceId, home_id, user):
+            return None
+        trigger = RuleTrigger(**{**trigger_in.model_dump(), "deviceId": PydanticObjectId(trigger_in.deviceId)})
+        action = RuleAction(**{**action_in.model_dump(), "deviceId": PydanticObjectId(action_in.deviceId)})
+        return trigger, action
+
+    @staticmethod
+    async def create_rule(rule_in: AutomationRuleCreate, user: User) -> Optional[AutomationRule]:
+        home = await HomeService.get_home_by_id(rule_in.homeId, user)
+        if not home:
+            return None
+
+        parts = await AutomationService._build_parts(rule_in.trigger, rule_in.action, home.id, user)
+        if not parts:
+            return None
+        trigger, action = parts
+
+        rule = AutomationRule(
+            homeId=home.id,
+            name=rule_in.name,
+            enabled=rule_in.enabled if rule_in.enabled is not None else True,
+            trigger=trigger,
+            action=action,
+            cooldownSeconds=rule_in.cooldownSeconds if rule_in.cooldownSeconds is not None else 60,
+        )
+        await rule.create()
+        automation_engine.upsert_rule(rule)
+        await automation_engine.broadcast_change(rule.id)
+        return rule
+
+    @staticmethod
+    async def get_rules_by_home(home_id: str, user: User) -> List[AutomationRule]:
+        home = await HomeService.get_home_by_id(home_id, user)
+        if not home:
+            return []
+        return await AutomationRule.find(AutomationRule.homeId == home.id).to_list()
+
+    @staticmethod
+    async def get_rule_by_id(rule_id: str, user: User) -> Optional[AutomationRule]:
+        try:
+            rule = await AutomationRule.get(PydanticObjectId(rule_id))
+        except InvalidId:
+            return None
+        if rule and await HomeService.get_home_by_id(str(rule.homeId), user):
+            return rule
+        return None
+
+    @staticmethod
+    async def update_rule(rule_id: str, rule_in: AutomationRuleUpdate, user: User) -> Optional[AutomationRule]:
+        rule = await AutomationService.get_rule_by_id(rule_id, user)
+        if not rule:
+            return None
+
+        update_data = rule_in.model_dump(exclude_unset=True, exclude={"trigger", "action"})
+        if rule_in.trigger is not None or rule_in.action is not None:
+            trigger_in = rule_in.trigger or RuleTriggerIn(**{**rule.trigger.model_dump(), "deviceId": str(rule.trigger.deviceId)})
+            action_in = rule_in.action or RuleActionIn(**{**rule.action.model_dump(), "deviceId": str(rule.action.deviceId)})
+            parts = await AutomationService._build_parts(trigger_in, action_in, rule.homeId, user)
+            if not parts:
+                return None
+            update_data["trigger"], update_data["action"] = parts
+        update_data["updatedAt"] = datetime.now()
+
+        for key, value in update_data.items():
+            setattr(rule, key, value)
+        await rule.save()
+        automation_engine.upsert_rule(rule)
+        await automation_engine.broadcast_change(rule.id)
+        return rule
+
+    @staticmethod
+    async def delete_rule(rule_id: str, user: User) -> bool:
+        rule = await AutomationService.get_rule_by_id(rule_id, user)
+        if not rule:
+            return False
+        await rule.delete()
+        automation_engine.remove_rule(rule.id)
+        await automation_engine.broadcast_change(rule.id)
+        return True
@@ -2,17 +2,25 @@ import cv2
 import threading
 import queue
 import time
-import torch
 import asyncio
-from ultralytics import YOLO
+from app.services.automation import automation_engine
+from app.models.automation_rule import TriggerEvent
+from app.core.metrics import CAMERA_CAPTURE_FPS, CAMERA_INFERENCE_LATENCY, CAMERA_FRAMES_DROPPED
+from app.core.config import settings
+from app.services.recording import FrameRecorder
+from app.services.stream_delivery import FrameItem, StreamSubscriber, VariantCache
+from app.services.camera_capture import open_source, Backoff, CaptureHealth, NotMjpegStreamError
+from app.services.detector import Detection, get_detector
+from app.services.tracker import PersonTracker
+from app.services.roi import RoiMask
+from app.services.stream_stats import PipelineStats
+from app.services import stream_routing
 
-# Cache để tránh spam log human detection (giống temp_alert_cache)
-_human_detection_cache: dict[str, float] = {}  # deviceId -> last_detection_time
-HUMAN_DETECTION_COOLDOWN = 30  # Chỉ log 1 lần mỗi 30 giây
+STREAM_JPEG_QUALITY = 70  # JPEG quality 70 để giảm kích thước, tăng tốc độ encode
 
 
 class CameraStream:
-    def __init__(self, cameraUrl, deviceId, frameQueueSize=2, humanDetectionMode=False):
+    def __init__(self, cameraUrl, deviceId, frameQueueSize=2, humanDetectionMode=False, recordingEnabled=None, detectionRegions=None):
         """
         Khởi tạo CameraStream.
 
@@ -20,6 +28,8 @@ class CameraStream:
         :param deviceId: ID của device trong database
         :param frameQueueSize: Kích thước tối đa của queue lưu frame (mặc định 4)
         :param humanDetectionMode: Bật/tắt chế độ phát hiện người (mặc định False)
+        :param recordingEnabled: Ghi hình khi phát hiện người (mặc định theo RECORDING_ENABLED)
+        :param detectionRegions: Polygon ROI của device (None = detect cả frame)
         """
         self.cameraUrl = cameraUrl
         self.deviceId = deviceId
@@ -30,24 +40,47 @@ class CameraStream:
         self.captureThread = None
         self.detectionThread = None
         self.running = False
+        self._stopEvent = threading.Event()  # Ngắt các lần chờ reconnect khi stop()
+        self.health = CaptureHealth()
+        self._mjpegUnsupported = False
 
-        self.processedFrameQueue = queue.Queue(maxsize=4)  # Queue cho processed frames
         self.modeLock = threading.Lock()  # Mutex cho humanDetectionMode
-        self.current_fps = 0.0
-        self.fpsLock = threading.Lock()  # Mutex cho current_fps
-        
-        # FPS tracking cho consumer (streaming endpoint)
-        self.consumer_frame_count = 0
-        self.consumer_start_time = time.time()
+        # ROI (mask tính sẵn theo kích thước frame); thay nguyên object khi cập nhật
+        self.roi = RoiMask(detectionRegions)
+
+        # Các viewer dùng chung pipeline này (mỗi viewer giữ frame mới nhất của riêng nó)
+        self.subscribers = set()
+        self.subscribersLock = threading.Lock()
+        self.variantCache = VariantCache()  # JPEG theo mức chất lượng cho viewer chậm
+        self.frameSeq = 0
         
         # Reference to event loop for async logging from thread
         self._loop = None
+
+        # Số liệu pipeline (FPS, thời gian từng bước, drop) cho API stream-stats
+        self.stats = PipelineStats()
+
+        # CPU time của từng thread (mỗi thread tự cập nhật bằng time.thread_time())
+        self.threadCpuTimes = {"capture": 0.0, "detection": 0.0}
+
+        # Recorder pre/post-event (dùng lại JPEG đã encode cho stream)
+        if recordingEnabled is None:
+            recordingEnabled = settings.RECORDING_ENABLED
+        self.recorder = FrameRecorder(deviceId) if recordingEnabled else None
+
+        # Frame mới nhất (không bị consumer lấy mất), dùng cho snapshot
+        self.latestItem = None
         
-        # Khởi tạo YOLO model với GPU nếu có
-        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.model = YOLO('yolo11s.pt')
-        self.model.to(self.device)
-        print(f"🔥 YOLO model loaded on: {self.device.upper()}")
+        # Detector người theo DETECTOR_BACKEND (torch/onnx/openvino), chỉ load khi bật detection lần đầu
+        self.detector = None
+        self._detectorError = None
+
+        # Tracker giữ box giữa các lần inference và phát sự kiện vào/ra theo track id
+        self.tracker = PersonTracker(
+            iou_threshold=settings.TRACKER_IOU_THRESHOLD,
+            min_hits=settings.TRACKER_MIN_HITS,
+            max_age=settings.TRACKER_MAX_AGE_SECONDS,
+        )
 
 
     def start(self):
@@ -55,6 +88,7 @@ class CameraStream:
         if self.running:
             return
         self.running = True
+        self._stopEvent.clear()
         
         # Lưu event loop để gọi async từ thread
         try:
@@ -62,8 +96,12 @@ class CameraStream:
         except:
             self._loop = None
             
-        self.captureThread = threading.Thread(target=self._capture_frames, daemon=True)
-        self.detectionThread = threading.Thread(target=self._detect_humans, daemon=True)
+        self.captureThread = threading.Thread(
+            target=self._capture_frames, name=f"camera-capture-{self.deviceId}", daemon=True
+        )
+        self.detectionThread = threading.Thread(
+            target=self._detect_humans, name=f"camera-detection-{self.deviceId}", daemon=True
+        )
         self.captureThread.start()
         self.detectionThread.start()
         print("CameraStream started")
@@ -74,6 +112,7 @@ class CameraStream:
             return
         print(f"🛑 Stopping CameraStream for {self.cameraUrl}")
         self.running = False
+        self._stopEvent.set()
         
         # Đợi threads kết thúc
         if self.captureThread and self.captureThread.is_alive():
@@ -81,80 +120,165 @@ class CameraStream:
         if self.detectionThread and self.detectionThread.is_alive():
             self.detectionThread.join(timeout=3)
         
+        if self.recorder:
+            self.recorder.close()
+        with self.subscribersLock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.close()
+        CAMERA_CAPTURE_FPS.remove(self.deviceId)
         print("✅ CameraStream stopped successfully")
 
-    def get_processed_frame(self):
-        """Lấy frame đã được xử lý (processed frame) từ bên ngoài."""
-        try:
-            # Lấy frame mới nhất, non-blocking
-            frame = None
-            frames_consumed = 0
-            # Đọc hết queue để lấy frame mới nhất
-            while not self.processedFrameQueue.empty():
-                try:
-                    frame = self.processedFrameQueue.get_nowait()
-                    frames_consumed += 1
-                except queue.Empty:
-                    break
-            
-            # Cập nhật FPS dựa trên số frame consumer lấy ra
-            if frame is not None and frames_consumed > 0:
-                with self.fpsLock:
-                    self.consumer_frame_count += frames_consumed
-                    # Tính FPS mỗi 30 frames
-                    if self.consumer_frame_count >= 30:
-                        elapsed = time.time() - self.consumer_start_time
-                        if elapsed > 0:
-                            self.current_fps = 30 / elapsed
-                            # print(f"📊 Consumer FPS: {self.current_fps:.2f}")
-                        self.consumer_frame_count = 0
-                        self.consumer_start_time = time.time()
-            
-            return frame.copy() if frame is not None else None
-        except Exception:
-            return None
+    def subscribe(self, loop, adaptive: bool = True) -> StreamSubscriber:
+        """Đăng ký một viewer mới (gọi từ event loop)."""
+        subscriber = StreamSubscriber(self.deviceId, loop, adaptive=adaptive, stats=self.stats)
+        with self.subscribersLock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: StreamSubscriber) -> int:
+        """Hủy viewer, trả về số viewer còn lại."""
+        subscriber.close()
+        with self.subscribersLock:
+            self.subscribers.discard(subscriber)
+            return len(self.subscribers)
+
+    def subscriber_count(self) -> int:
+        with self.subscribersLock:
+            return len(self.subscribers)
+
+    def encode_for(self, item: FrameItem, level: int):
+        """JPEG của frame theo mức chất lượng (mức 0 = JPEG chung của pipeline)."""
+        return self.variantCache.get(item, level)
+
+    def get_latest_frame(self):
+        """Frame mới nhất của pipeline (decode khi ở relay mode), None nếu chưa có."""
+        item = self.latestItem
+        return item.decoded() if item is not None else None
 
     def set_detection_mode(self, enabled: bool):
-        """Cập nhật humanDetectionMode từ bên ngoài."""
+        """Cập nhật humanDetectionMode từ bên ngoài (chuyển giữa relay và decode+detect ngay frame sau)."""
         with self.modeLock:
             if self.humanDetectionMode != enabled:
                 self.humanDetectionMode = enabled
                 print(f"🔄 Detection mode updated: {enabled}")
 
+    def set_detection_regions(self, regions):
+        """Cập nhật ROI từ bên ngoài (áp dụng từ frame sau)."""
+        self.roi = RoiMask(regions)
+        print(f"🔄 Detection regions updated: {len(self.roi.polygons)} polygon(s)")
+
     def get_fps(self) -> float:
-        """Lấy FPS hiện tại."""
-        with self.fpsLock:
-            return self.current_fps
+        """FPS thực tế gửi tới viewer nhanh nhất."""
+        with self.subscribersLock:
+            subscribers = list(self.subscribers)
+        return max((s.controller.lastFps for s in subscribers), default=0.0)
+
+    def get_stats(self) -> dict:
+        """Số liệu runtime của pipeline (trong RAM): FPS, p50/p95 từng bước, drop, viewer."""
+        stats = self.stats.snapshot()
+        if self.recorder:
+            stats["drops"]["recorder"] = self.recorder.droppedFrames
+        with self.subscribersLock:
+            subscribers = list(self.subscribers)
+        stats["subscriberCount"] = len(subscribers)
+        stats["subscribers"] = [s.stats() for s in subscribers]
+        stats["deliveredFps"] = round(max((s.controller.lastFps for s in subscribers), default=0.0), 2)
+        stats["captureState"] = self.health.to_dict()["state"]
+        return stats
+
+    def get_occupancy(self) -> dict:
+        """Số người đang trong khung hình và tổng lượt vào/ra theo tracker."""
+        return self.tracker.stats()
+
+    def get_health(self) -> dict:
+        """Trạng thái kết nối của capture stage."""
+        return self.health.to_dict()
+
+    def get_thread_cpu_times(self) -> dict:
+        """CPU time (giây) đã dùng bởi thread capture và detection."""
+        return dict(self.threadCpuTimes)
 
     def _capture_frames(self):
-        """Luồng lấy frame từ cameraUrl và put vào queue."""
-        cap = cv2.VideoCapture(self.cameraUrl)
-        if not cap.isOpened():
-            print(f"❌ Cannot open camera stream: {self.cameraUrl}")
-            self.running = False
-            return
+        """Luồng lấy frame từ cameraUrl và put vào queue, tự reconnect với exponential backoff."""
+        fps_gauge = CAMERA_CAPTURE_FPS.labels(self.deviceId)
+        dropped = CAMERA_FRAMES_DROPPED.labels(self.deviceId, "frameQueue")
+        backoff = Backoff(settings.CAMERA_RECONNECT_INITIAL_SECONDS, settings.CAMERA_RECONNECT_MAX_SECONDS)
 
-        print(f"✅ Camera capture started: {self.cameraUrl}")
-        
         while self.running:
-            ret, frame = cap.read()
-            if ret:
+            source = open_source(self.cameraUrl, prefer_mjpeg=settings.CAMERA_RELAY_ENABLED and not self._mjpegUnsupported)
+            try:
+                source.open()
+            except NotMjpegStreamError as e:
+                # Camera không phát MJPEG qua HTTP: dùng OpenCV (không relay được)
+                print(f"ℹ️ {e}, falling back to OpenCV capture")
+                self._mjpegUnsupported = True
+                continue
+            except Exception as e:
+                delay = backoff.next_delay()
+                self.health.failed(str(e), delay)
+                print(f"❌ Cannot open camera stream: {self.cameraUrl} ({e}), retry in {delay:.1f}s")
+                self._stopEvent.wait(delay)
+                continue
+
+            print(f"✅ Camera capture started: {self.cameraUrl}")
+            window_start = time.time()
+            window_frames = 0
+            last_frame_at = time.time()
+            error = None
+
+            while self.running:
+                try:
+                    captured = source.read()
+                except Exception as e:
+                    error = f"Read error: {e}"
+                    break
+                self.threadCpuTimes["capture"] = time.thread_time()
+
+                if captured is None:
+                    # Không spin: đợi ngắn, quá timeout thì reconnect
+                    if time.time() - last_frame_at > settings.CAMERA_READ_TIMEOUT_SECONDS:
+                        error = "No frame received before timeout"
+                        break
+                    self._stopEvent.wait(0.05)
+                    continue
+
+                last_frame_at = time.time()
+                backoff.reset()
+                self.health.frame_received()
+
+                window_frames += 1
+                elapsed = time.time() - window_start
+                if elapsed >= 1.0:
+                    fps_gauge.set(window_frames / elapsed)
+                    self.stats.captureFps = window_frames / elapsed
+                    window_start = time.time()
+                    window_frames = 0
+
                 # Nếu queue đầy, bỏ frame cũ nhất và thêm frame mới
                 if self.frameQueue.full():
                     try:
                         self.frameQueue.get_nowait()  # Bỏ frame cũ
+                        dropped.inc()
+                        self.stats.drop("frameQueue")
                     except queue.Empty:
                         pass
                 
                 try:
-                    self.frameQueue.put(frame, timeout=1)
+                    # Chưa decode: thread detection quyết định relay hay decode+detect
+                    self.frameQueue.put(captured, timeout=1)
                 except queue.Full:
                     pass
-            else:
-                print("⚠️ Failed to capture frame")
-                time.sleep(0.01)
 
-        cap.release()
+            source.close()
+            if self.running:
+                delay = backoff.next_delay()
+                self.health.failed(error or "Capture stopped", delay)
+                fps_gauge.set(0)
+                print(f"⚠️ Camera stream lost: {self.cameraUrl} ({error}), reconnecting in {delay:.1f}s")
+                self._stopEvent.wait(delay)
+
+        self.health.set_state(CaptureHealth.STOPPED)
         print("🛑 Camera capture thread stopped")
 
     def _detect_humans(self):
@@ -162,99 +286,173 @@ class CameraStream:
         with self.modeLock:
             initial_mode = self.humanDetectionMode
         print(f"✅ Detection thread started (mode: {initial_mode})")
+
+        inference_hist = CAMERA_INFERENCE_LATENCY.labels(self.deviceId)
+        inference_interval = max(1, settings.DETECTOR_INFERENCE_INTERVAL)
+        frames_since_inference = inference_interval  # Frame đầu tiên luôn chạy inference
+        tracking = False
         
         while self.running:
+            self.threadCpuTimes["detection"] = time.thread_time()
             try:
-                frame = self.frameQueue.get(timeout=1)
-                processed_frame = frame.copy()
+                captured = self.frameQueue.get(timeout=1)
+                now = captured.capturedAt  # Timestamp của frame = lúc capture
 
                 # Đọc humanDetectionMode với mutex
                 with self.modeLock:
                     detection_enabled = self.humanDetectionMode
 
-                if detection_enabled and self.model:
-                    # Start timing inference + drawing
-                    inference_start = time.time()
-                    
-                    results = self.model(processed_frame, classes=[0], device=self.device, verbose=False)
-                    human_detected = False
-                    for result in results:
-                        for box in result.boxes:
-                            if box.cls == 0:
-                                human_detected = True
-                                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                                cv2.rectangle(processed_frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                                cv2.putText(processed_frame, "Person", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-                    
-                    # End timing and log
-                    inference_time = time.time() - inference_start
-                    print("Inference time: ", inference_time)
-                    if human_detected:
-                        print("🚨 Human detected!")
-                        # Log human detection với cooldown để tránh spam
-                        self._log_human_detection()
+                if tracking and not detection_enabled:
+                    self.tracker.reset()
+                    tracking = False
+
+                human_detected = False
+                if not detection_enabled and captured.jpeg is not None:
+                    # Relay mode: chuyển nguyên bytes JPEG từ camera, không decode/encode
+                    processed_frame = None
+                    jpeg = captured.jpeg
                 else:
-                    time.sleep(0.01)
+                    if captured.is_decoded:
+                        processed_frame = captured.decode()
+                    else:
+                        decode_start = time.perf_counter()
+                        processed_frame = captured.decode()
+                        self.stats.observe("decode", time.perf_counter() - decode_start)
+                    if processed_frame is None:
+                        continue
 
-                # Put frame vào queue, nếu đầy thì bỏ frame cũ
-                if self.processedFrameQueue.full():
-                    try:
-                        self.processedFrameQueue.get_nowait()
-                    except queue.Empty:
-                        pass
-                try:
-                    self.processedFrameQueue.put_nowait(processed_frame)
-                except queue.Full:
-                    pass
+                    if detection_enabled and self._ensure_detector():
+                        tracking = True
+                        roi = self.roi
+                        if frames_since_inference >= inference_interval:
+                            # Start timing inference
+                            inference_start = time.time()
+                            if roi.enabled:
+                                # Chỉ chạy detector trên vùng bao ROI, rồi lọc box theo mask
+                                region, offset_x, offset_y = roi.crop(processed_frame)
+                                detections = [
+                                    Detection(d.x1 + offset_x, d.y1 + offset_y, d.x2 + offset_x, d.y2 + offset_y, d.score)
+                                    for d in self.detector.detect(region)
+                                ]
+                                detections = roi.filter(detections, processed_frame.shape)
+                            else:
+                                detections = self.detector.detect(processed_frame)
+                            inference_time = time.time() - inference_start
+                            inference_hist.observe(inference_time)
+                            self.stats.observe("inference", inference_time)
+                            update = self.tracker.update(detections, now)
+                            frames_since_inference = 1
+                        else:
+                            # Bỏ qua inference: box được nội suy bởi tracker
+                            update = self.tracker.predict(now)
+                            frames_since_inference += 1
+
+                        if roi.enabled:
+                            roi.draw(processed_frame)
+                        for track in update.tracks:
+                            x1, y1, x2, y2 = track.int_box()
+                            cv2.rectangle(processed_frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                            cv2.putText(processed_frame, f"Person #{track.id}", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+                        human_detected = bool(update.tracks)
+
+                        occupancy = len(update.tracks)
+                        for track in update.entered:
+                            self._on_person_event(track.id, True, occupancy)
+                        for track in update.exited:
+                            self._on_person_event(track.id, False, occupancy)
+
+                    # Encode JPEG một lần, dùng chung cho stream và recorder
+                    encode_start = time.perf_counter()
+                    ret, buffer = cv2.imencode('.jpg', processed_frame, [cv2.IMWRITE_JPEG_QUALITY, STREAM_JPEG_QUALITY])
+                    self.stats.observe("encode", time.perf_counter() - encode_start)
+                    if not ret:
+                        continue
+                    jpeg = buffer.tobytes()
+
+                if self.recorder:
+                    if human_detected:
+                        self.recorder.trigger(now)
+                    self.recorder.push(now, jpeg)
+
+                self.frameSeq += 1
+                self._publish(FrameItem(self.frameSeq, now, jpeg, frame=processed_frame))
 
             except queue.Empty:
                 continue
         
         print("🛑 Detection thread stopped")
 
-    def _log_human_detection(self):
-        """Log human detection với cooldown để tránh spam"""
-        global _human_detection_cache
-        
-        current_time = time.time()
-        last_detection = _human_detection_cache.get(self.deviceId, 0)
-        
-        # Chỉ log nếu đã qua cooldown period
-        if current_time - last_detection < HUMAN_DETECTION_COOLDOWN:
-            return
-        
-        _human_detection_cache[self.deviceId] = current_time
-        
-        # Gọi async log từ thread
-        if self._loop:
-            try:
-                asyncio.run_coroutine_threadsafe(
-                    self._async_log_human_detection(),
-                    self._loop
-                )
-            except Exception as e:
-                print(f"⚠️ Failed to log human detection: {e}")
+    def _ensure_detector(self) -> bool:
+        """Load detector trong thread detection (không chặn event loop); lỗi thì chỉ báo một lần"""
+        if self.detector is not None:
+            return True
+        if self._detectorError is not None:
+            return False
+        load_start = time.time()
+        try:
+            self.detector = get_detector()
+        except Exception as e:
+            self._detectorError = str(e)
+            print(f"❌ Cannot load person detector ({settings.DETECTOR_BACKEND}): {e}")
+            return False
+        print(f"🔥 Person detector loaded: {self.detector.name} ({time.time() - load_start:.1f}s)")
+        return True
+
+    def _publish(self, item: FrameItem):
+        """Gửi frame tới tất cả viewer (viewer chậm tự bỏ frame cũ)"""
+        self.latestItem = item
+        with self.subscribersLock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.offer(item)
+
+    def _on_person_event(self, track_id: int, entered: bool, occupancy: int):
+        """Sự kiện vào/ra của một track"""
+        notify_person_event(self.deviceId, self._loop, track_id, entered, occupancy)
 
-    async def _async_log_human_detection(self):
-        """Async function để ghi log vào database"""
+
+def notify_person_event(device_id: str, loop, track_id: int, entered: bool, occupancy: int):
+    """Chuyển sự kiện vào/ra cho automation và activity log (mỗi track một lần, không cần cooldown)"""
+    # Nhiều instance cùng mở pipeline cho một camera: bỏ nếu instance khác là chủ sở hữu
+    if stream_routing.owned_elsewhere(device_id):
+        return
+    if entered:
+        print(f"🚨 Person #{track_id} entered")
+    # Automation có cooldown riêng theo rule
+    event = TriggerEvent.HUMAN_DETECTED if entered else TriggerEvent.PERSON_EXITED
+    automation_engine.submit_threadsafe(device_id, event, {"trackId": track_id, "occupancy": occupancy})
+
+    # Gọi async log từ thread
+    if loop:
         try:
-            from beanie import PydanticObjectId
-            from app.models.device import Device
-            from app.models.room import Room
-            from app.services.activity_log import ActivityLogService
-            from app.models.activity_log import LogType
-            
-            device = await Device.get(PydanticObjectId(self.deviceId))
-            if device and device.roomId:
-                room = await Room.get(device.roomId)
-                if room:
-                    await ActivityLogService.create_log(
-                        action="HUMAN_DETECTED",
-                        message=f"🚨 {device.name}: Human detected in room",
-                        userId=None,
-                        homeId=str(room.homeId),
-                        log_type=LogType.WARNING
-                    )
-                    print(f"✅ Human detection logged for {device.name}")
+            asyncio.run_coroutine_threadsafe(log_person_event(device_id, track_id, entered), loop)
         except Exception as e:
-            print(f"⚠️ Error logging human detection: {e}")
\ No newline at end of file
+            print(f"⚠️ Failed to log person event: {e}")
+
+
+async def log_person_event(device_id: str, track_id: int, entered: bool):
+    """Async function để ghi log vào database"""
+    try:
+        from beanie import PydanticObjectId
+        from app.models.device import Device
+        from app.models.room import Room
+        from app.services.activity_log import ActivityLogService
+        from app.models.activity_log import LogType
+        
+        device = await Device.get(PydanticObjectId(device_id))
+        if device and device.roomId:
+            room = await Room.get(device.roomId)
+            if room:
+                if entered:
+                    action, message, log_type = "HUMAN_DETECTED", f"🚨 {device.name}: Person #{track_id} entered the room", LogType.WARNING
+                else:
+                    action, message, log_type = "PERSON_EXITED", f"{device.name}: Person #{track_id} left the room", LogType.INFO
+                await ActivityLogService.create_log(
+                    action=action,
+                    message=message,
+                    userId=None,
+                    homeId=str(room.homeId),
+                    log_type=log_type
+                )
+    except Exception as e:
+        print(f"⚠️ Error logging person event: {e}")
@@ -0,0 +1,244 @@
+"""
+Nguồn frame cho CameraStream.
+
+- OpenCvSource: cv2.VideoCapture (mọi loại URL), có CAP_PROP_BUFFERSIZE và
+  timeout mở/đọc để giảm độ trễ và không bị treo; giải mã phần cứng
+  (H.264/RTSP qua FFmpeg) khi bật CAMERA_HW_ACCELERATION.
+- MjpegHttpSource: parser multipart/x-mixed-replace nhẹ cho ESP32-CAM, trả về
+  nguyên bytes JPEG; chỉ decode khi pipeline thực sự cần pixel.
+
+CaptureHealth lưu trạng thái kết nối để API hiển thị (CONNECTING, STREAMING,
+RECONNECTING, STOPPED).
+"""
+import random
+import threading
+import time
+import urllib.request
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from app.core.config import settings
+
+
+class NotMjpegStreamError(ConnectionError):
+    """URL không trả về multipart MJPEG"""
+
+
+class CapturedFrame:
+    """Một frame từ camera: bytes JPEG gốc (nếu có) và/hoặc ảnh đã decode"""
+
+    __slots__ = ("jpeg", "_frame", "capturedAt")
+
+    def __init__(self, jpeg: Optional[bytes] = None, frame=None):
+        self.jpeg = jpeg
+        self._frame = frame
+        self.capturedAt = time.time()  # Mốc đo độ trễ glass-to-client
+
+    @property
+    def is_decoded(self) -> bool:
+        return self._frame is not None
+
+    def decode(self):
+        """Decode JPEG khi cần (chỉ một lần)"""
+        if self._frame is None and self.jpeg is not None:
+            self._frame = cv2.imdecode(np.frombuffer(self.jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return self._frame
+
+
+# CAMERA_HW_ACCELERATION -> tên hằng VideoAccelerationType của OpenCV
+_HW_ACCELERATION = {
+    "any": "VIDEO_ACCELERATION_ANY",
+    "d3d11": "VIDEO_ACCELERATION_D3D11",
+    "vaapi": "VIDEO_ACCELERATION_VAAPI",
+    "mfx": "VIDEO_ACCELERATION_MFX",
+}
+
+
+def _hw_acceleration_params() -> list:
+    """Bản OpenCV cũ (< 4.5.2) không có CAP_PROP_HW_ACCELERATION -> giải mã CPU"""
+    name = _HW_ACCELERATION.get(settings.CAMERA_HW_ACCELERATION.strip().lower())
+    if not name or not hasattr(cv2, "CAP_PROP_HW_ACCELERATION") or not hasattr(cv2, name):
+        return []
+    return [cv2.CAP_PROP_HW_ACCELERATION, getattr(cv2, name)]
+
+
+class OpenCvSource:
+    def __init__(self, url: str):
+        self.url = url
+        self.cap = None
+
+    def open(self):
+        timeout_ms = int(settings.CAMERA_READ_TIMEOUT_SECONDS * 1000)
+        params = []
+        if hasattr(cv2, "CAP_PROP_OPEN_TIMEOUT_MSEC"):
+            params += [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, timeout_ms]
+        if hasattr(cv2, "CAP_PROP_READ_TIMEOUT_MSEC"):
+            params += [cv2.CAP_PROP_READ_TIMEOUT_MSEC, timeout_ms]
+        params += _hw_acceleration_params()
+        self.cap = cv2.VideoCapture(self.url, cv2.CAP_ANY, params) if params else cv2.VideoCapture(self.url)
+        if not self.cap.isOpened():
+            raise ConnectionError(f"Cannot open camera stream: {self.url}")
+        # Buffer nhỏ = frame mới nhất, độ trễ thấp
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, settings.CAMERA_BUFFER_SIZE)
+
+    def read(self) -> Optional[CapturedFrame]:
+        ret, frame = self.cap.read()
+        return CapturedFrame(frame=frame) if ret else None
+
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+
+class MjpegHttpSource:
+    """Đọc trực tiếp multipart MJPEG qua HTTP, không qua FFmpeg"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.resp = None
+        self.boundary = b""
+        self._at_part_headers = False  # Đã đọc qua dòng boundary của part tiếp theo
+
+    def open(self):
+        self.resp = urllib.request.urlopen(self.url, timeout=settings.CAMERA_READ_TIMEOUT_SECONDS)
+        content_type = self.resp.headers.get("Content-Type", "")
+        if "multipart" not in content_type or "boundary=" not in content_type:
+            self.close()
+            raise NotMjpegStreamError(f"Not an MJPEG stream ({content_type}): {self.url}")
+        boundary = content_type.split("boundary=", 1)[1].split(";", 1)[0].strip().strip('"')
+        self.boundary = boundary[2:] if boundary.startswith("--") else boundary
+        self.boundary = self.boundary.encode()
+        self._at_part_headers = False
+
+    def _is_boundary(self, line: bytes) -> bool:
+        stripped = line.strip()
+        return stripped.startswith(b"--" + self.boundary) or stripped == self.boundary
+
+    def read(self) -> Optional[CapturedFrame]:
+        resp = self.resp
+        if not self._at_part_headers:
+            while True:
+                line = resp.readline()
+                if not line:
+                    raise EOFError("MJPEG stream closed")
+                if self._is_boundary(line):
+                    break
+
+        content_length = None
+        while True:
+            line = resp.readline()
+            if not line:
+                raise EOFError("MJPEG stream closed")
+            line = line.strip()
+            if not line:
+                break
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"content-length":
+                content_length = int(value.strip())
+
+        if content_length is not None:
+            data = resp.read(content_length)
+            if len(data) < content_length:
+                raise EOFError("MJPEG stream truncated")
+            self._at_part_headers = False
+        else:
+            # Không có Content-Length: đọc đến boundary tiếp theo
+            chunks = []
+            while True:
+                line = resp.readline()
+                if not line:
+                    raise EOFError("MJPEG stream closed")
+                if self._is_boundary(line):
+                    break
+                chunks.append(line)
+            data = b"".join(chunks).rstrip(b"\r\n")
+            self._at_part_headers = True
+
+        return CapturedFrame(jpeg=data) if data else None
+
+    def close(self):
+        if self.resp is not None:
+            try:
+                self.resp.close()
+            except OSError:
+                pass
+            self.resp = None
+
+
+def open_source(url: str, prefer_mjpeg: bool = False):
+    """Chọn nguồn theo CAMERA_CAPTURE_BACKEND (chưa mở kết nối); relay mode cần MJPEG parser"""
+    use_mjpeg = prefer_mjpeg or settings.CAMERA_CAPTURE_BACKEND == "mjpeg"
+    if use_mjpeg and url.startswith(("http://", "https://")):
+        return MjpegHttpSource(url)
+    return OpenCvSource(url)
+
+
+class CaptureHealth:
+    CONNECTING = "CONNECTING"
+    STREAMING = "STREAMING"
+    RECONNECTING = "RECONNECTING"
+    STOPPED = "STOPPED"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = self.CONNECTING
+        self.lastFrameAt: Optional[float] = None
+        self.connectedAt: Optional[float] = None
+        self.reconnects = 0
+        self.consecutiveFailures = 0
+        self.lastError: Optional[str] = None
+        self.nextRetryAt: Optional[float] = None
+
+    def set_state(self, state: str):
+        with self._lock:
+            self.state = state
+
+    def frame_received(self):
+        now = time.time()
+        with self._lock:
+            if self.state != self.STREAMING:
+                self.state = self.STREAMING
+                self.connectedAt = now
+            self.lastFrameAt = now
+            self.consecutiveFailures = 0
+            self.nextRetryAt = None
+
+    def failed(self, error: str, retry_in: float):
+        with self._lock:
+            self.state = self.RECONNECTING
+            self.reconnects += 1
+            self.consecutiveFailures += 1
+            self.lastError = error
+            self.nextRetryAt = time.time() + retry_in
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "lastFrameAt": self.lastFrameAt,
+                "connectedAt": self.connectedAt,
+                "reconnects": self.reconnects,
+                "consecutiveFailures": self.consecutiveFailures,
+                "lastError": self.lastError,
+                "nextRetryAt": self.nextRetryAt,
+            }
+
+
+class Backoff:
+    """Exponential backoff có jitter cho reconnect"""
+
+    def __init__(self, initial: float, maximum: float):
+        self.initial = initial
+        self.maximum = maximum
+        self.current = initial
+
+    def next_delay(self) -> float:
+        delay = self.current * random.uniform(0.8, 1.2)
+        self.current = min(self.current * 2, self.maximum)
+        return delay
+
+    def reset(self):
+        self.current = self.initial
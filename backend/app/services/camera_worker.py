@@ -0,0 +1,413 @@
+"""
+Chạy pipeline camera trong process riêng (CAMERA_WORKER_PROCESSES=true).
+
+Decode, vẽ box và inference chạy trong worker process nên không tranh GIL
+với event loop của uvicorn. Worker ghi JPEG đã xử lý vào ring buffer trên
+shared memory; API process chỉ đọc bytes và phát cho viewer như CameraStream.
+
+    API process                                   Worker process
+    ProcessCameraStream ── control queue ──────▶  CameraStream (capture +
+      reader thread     ◀── event queue ────────    detection threads,
+      (viewer fan-out)  ◀── FrameRing (shm) ────    recorder)
+
+Thread reader của ProcessCameraStream kiêm supervisor: khi worker chết bất
+thường thì khởi động lại với exponential backoff, giữ nguyên detection mode
+và ROI hiện tại. Worker tự thoát khi API process không còn.
+"""
+import asyncio
+import multiprocessing as mp
+import queue
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Optional
+
+from app.core.config import settings
+from app.services.camera import CameraStream, notify_person_event
+from app.services.camera_capture import Backoff
+from app.services.stream_delivery import FrameItem, StreamSubscriber, VariantCache
+from app.services.stream_stats import PipelineStats
+
+_HEADER = struct.Struct("<QII")        # latest seq, số slot, kích thước data mỗi slot
+_SLOT_HEADER = struct.Struct("<QdIIQ")  # seq bắt đầu ghi, timestamp, length, padding, seq ghi xong
+_SEQ = struct.Struct("<Q")
+_SEQ_END_OFFSET = 24
+
+STATUS_INTERVAL_SECONDS = 1.0
+
+
+class FrameRing:
+    """
+    Ring buffer JPEG trên shared memory, một writer (worker) - một reader (API).
+    Mỗi slot được bao bởi seq trước/sau khi ghi (kiểu seqlock): reader chỉ nhận
+    frame khi hai giá trị khớp với seq mong đợi, tức là slot không bị ghi đè
+    trong lúc copy.
+    """
+
+    def __init__(self, name: Optional[str] = None, slots: int = 4, slot_bytes: int = 1 << 20):
+        if name is None:
+            size = _HEADER.size + slots * (_SLOT_HEADER.size + slot_bytes)
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            _HEADER.pack_into(self.shm.buf, 0, 0, slots, slot_bytes)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        _, self.slots, self.slotBytes = _HEADER.unpack_from(self.shm.buf, 0)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def _slot_offset(self, seq: int) -> int:
+        return _HEADER.size + (seq % self.slots) * (_SLOT_HEADER.size + self.slotBytes)
+
+    def write(self, seq: int, ts: float, data: bytes) -> bool:
+        """Ghi frame (seq tăng dần, bắt đầu từ 1); False nếu frame lớn hơn slot"""
+        if len(data) > self.slotBytes:
+            return False
+        buf = self.shm.buf
+        offset = self._slot_offset(seq)
+        _SLOT_HEADER.pack_into(buf, offset, seq, ts, len(data), 0, 0)
+        start = offset + _SLOT_HEADER.size
+        buf[start:start + len(data)] = data
+        _SEQ.pack_into(buf, offset + _SEQ_END_OFFSET, seq)
+        _SEQ.pack_into(buf, 0, seq)
+        return True
+
+    def read_latest(self, last_seq: int):
+        """(seq, ts, jpeg) của frame mới nhất nếu khác last_seq, None nếu chưa có/đang bị ghi"""
+        buf = self.shm.buf
+        latest = _SEQ.unpack_from(buf, 0)[0]
+        if latest == 0 or latest == last_seq:
+            return None
+        offset = self._slot_offset(latest)
+        if _SEQ.unpack_from(buf, offset + _SEQ_END_OFFSET)[0] != latest:
+            return None
+        _, ts, length, _, _ = _SLOT_HEADER.unpack_from(buf, offset)
+        start = offset + _SLOT_HEADER.size
+        data = bytes(buf[start:start + length])
+        if _SEQ.unpack_from(buf, offset)[0] != latest:
+            return None  # Bị ghi đè trong lúc copy
+        return latest, ts, data
+
+    def reset(self):
+        _SEQ.pack_into(self.shm.buf, 0, 0)
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class _WorkerCameraStream(CameraStream):
+    """CameraStream trong worker: frame ra shared memory, sự kiện về API process"""
+
+    def __init__(self, ring: FrameRing, events, frame_ready, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ring = ring
+        self.events = events
+        self.frameReady = frame_ready
+        self.oversizedFrames = 0
+
+    def _publish(self, item: FrameItem):
+        self.latestItem = item
+        if self.ring.write(item.seq, item.ts, item.jpeg):
+            self.frameReady.release()
+        else:
+            self.oversizedFrames += 1
+
+    def _on_person_event(self, track_id: int, entered: bool, occupancy: int):
+        try:
+            self.events.put_nowait(("person", track_id, entered, occupancy))
+        except queue.Full:
+            pass
+
+
+def _worker_main(options: dict, ring_name: str, control, events, frame_ready):
+    """Entry point của worker process"""
+    ring = FrameRing(name=ring_name)
+    stream = _WorkerCameraStream(
+        ring, events, frame_ready,
+        options["cameraUrl"],
+        deviceId=options["deviceId"],
+        humanDetectionMode=options["humanDetectionMode"],
+        detectionRegions=options["detectionRegions"],
+    )
+    stream.start()
+    parent = mp.parent_process()
+    next_status = 0.0
+    try:
+        while True:
+            try:
+                message = control.get(timeout=0.5)
+            except queue.Empty:
+                message = None
+            if message is not None:
+                kind = message[0]
+                if kind == "stop":
+                    break
+                if kind == "mode":
+                    stream.set_detection_mode(message[1])
+                elif kind == "regions":
+                    stream.set_detection_regions(message[1])
+
+            if parent is not None and not parent.is_alive():
+                break
+            now = time.monotonic()
+            if now >= next_status:
+                next_status = now + STATUS_INTERVAL_SECONDS
+                try:
+                    events.put_nowait(("status", {
+                        "health": stream.get_health(),
+                        "occupancy": stream.get_occupancy(),
+                        "threadCpuTimes": stream.get_thread_cpu_times(),
+                        "oversizedFrames": stream.oversizedFrames,
+                        "stats": stream.get_stats(),
+                    }))
+                except queue.Full:
+                    pass
+    finally:
+        stream.stop()
+        ring.close()
+
+
+def _plain_regions(regions):
+    """DetectionRegion/dict -> list dict để pickle sang worker"""
+    if not regions:
+        return None
+    return [
+        {"points": [list(p) for p in (r["points"] if isinstance(r, dict) else r.points)]}
+        for r in regions
+    ]
+
+
+class ProcessCameraStream:
+    """Cùng interface với CameraStream nhưng pipeline chạy trong worker process"""
+
+    def __init__(self, cameraUrl, deviceId, humanDetectionMode=False, detectionRegions=None):
+        self.cameraUrl = cameraUrl
+        self.deviceId = deviceId
+        self.humanDetectionMode = humanDetectionMode
+        self.detectionRegions = _plain_regions(detectionRegions)
+        self.running = False
+
+        self.subscribers = set()
+        self.subscribersLock = threading.Lock()
+        self.variantCache = VariantCache()
+        self.frameSeq = 0
+        self.latestItem = None
+        # Số liệu đo ở API process (glassToClient, drop của viewer); phần còn lại lấy từ worker
+        self.stats = PipelineStats()
+
+        self._ctx = mp.get_context("spawn")
+        self._ring: Optional[FrameRing] = None
+        self._process = None
+        self._control = None
+        self._events = None
+        self._frameReady = None
+        self._readerThread = None
+        self._loop = None
+        self._lastSeq = 0
+        self._status: dict = {}
+        self._restarts = 0
+        self._backoff = Backoff(settings.CAMERA_RECONNECT_INITIAL_SECONDS, settings.CAMERA_WORKER_RESTART_MAX_SECONDS)
+        self._restartAt: Optional[float] = None
+        self._lastExitCode = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        # Event loop để ghi activity log cho sự kiện từ worker
+        try:
+            self._loop = asyncio.get_event_loop()
+        except RuntimeError:
+            self._loop = None
+        self._ring = FrameRing(slots=settings.CAMERA_WORKER_RING_SLOTS, slot_bytes=settings.CAMERA_WORKER_SLOT_BYTES)
+        self._spawn()
+        self._readerThread = threading.Thread(
+            target=self._read_frames, name=f"camera-reader-{self.deviceId}", daemon=True
+        )
+        self._readerThread.start()
+        print(f"CameraStream started in worker process (pid {self._process.pid})")
+
+    def _spawn(self):
+        self._control = self._ctx.Queue()
+        self._events = self._ctx.Queue(maxsize=256)
+        self._frameReady = self._ctx.Semaphore(0)
+        self._ring.reset()
+        self._lastSeq = 0
+        options = {
+            "cameraUrl": self.cameraUrl,
+            "deviceId": self.deviceId,
+            "humanDetectionMode": self.humanDetectionMode,
+            "detectionRegions": self.detectionRegions,
+        }
+        self._process = self._ctx.Process(
+            target=_worker_main,
+            args=(options, self._ring.name, self._control, self._events, self._frameReady),
+            name=f"camera-worker-{self.deviceId}",
+            daemon=True,
+        )
+        self._process.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        print(f"🛑 Stopping camera worker for {self.cameraUrl}")
+        self.running = False
+        if self._readerThread and self._readerThread.is_alive():
+            self._readerThread.join(timeout=2)
+        if self._process is not None:
+            self._control.put(("stop",))
+            self._process.join(timeout=5)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join(timeout=2)
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+        with self.subscribersLock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.close()
+        print("✅ Camera worker stopped successfully")
+
+    def _read_frames(self):
+        """Đọc frame từ shared memory, phát cho viewer, xử lý sự kiện và giám sát worker"""
+        while self.running:
+            self._frameReady.acquire(timeout=0.5)
+            result = self._ring.read_latest(self._lastSeq)
+            if result is not None:
+                self._lastSeq, ts, jpeg = result
+                self.frameSeq += 1
+                self._publish(FrameItem(self.frameSeq, ts, jpeg))
+            self._drain_events()
+            self._supervise()
+
+    def _publish(self, item: FrameItem):
+        self.latestItem = item
+        with self.subscribersLock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.offer(item)
+
+    def _drain_events(self):
+        while True:
+            try:
+                message = self._events.get_nowait()
+            except queue.Empty:
+                return
+            if message[0] == "status":
+                self._status = message[1]
+                if self._status.get("health", {}).get("state") == "STREAMING":
+                    self._backoff.reset()
+            elif message[0] == "person":
+                _, track_id, entered, occupancy = message
+                notify_person_event(self.deviceId, self._loop, track_id, entered, occupancy)
+
+    def _supervise(self):
+        """Khởi động lại worker chết bất thường (exponential backoff)"""
+        if not self.running or self._process.is_alive():
+            return
+        now = time.monotonic()
+        if self._restartAt is None:
+            self._lastExitCode = self._process.exitcode
+            delay = self._backoff.next_delay()
+            self._restartAt = now + delay
+            print(f"⚠️ Camera worker for {self.deviceId} exited ({self._lastExitCode}), restarting in {delay:.1f}s")
+            return
+        if now >= self._restartAt:
+            self._restartAt = None
+            self._restarts += 1
+            self._spawn()
+
+    def subscribe(self, loop, adaptive: bool = True) -> StreamSubscriber:
+        subscriber = StreamSubscriber(self.deviceId, loop, adaptive=adaptive, stats=self.stats)
+        with self.subscribersLock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: StreamSubscriber) -> int:
+        subscriber.close()
+        with self.subscribersLock:
+            self.subscribers.discard(subscriber)
+            return len(self.subscribers)
+
+    def subscriber_count(self) -> int:
+        with self.subscribersLock:
+            return len(self.subscribers)
+
+    def encode_for(self, item: FrameItem, level: int):
+        return self.variantCache.get(item, level)
+
+    def get_latest_frame(self):
+        item = self.latestItem
+        return item.decoded() if item is not None else None
+
+    def set_detection_mode(self, enabled: bool):
+        self.humanDetectionMode = enabled
+        if self.running:
+            self._control.put(("mode", enabled))
+
+    def set_detection_regions(self, regions):
+        self.detectionRegions = _plain_regions(regions)
+        if self.running:
+            self._control.put(("regions", self.detectionRegions))
+
+    def get_fps(self) -> float:
+        with self.subscribersLock:
+            subscribers = list(self.subscribers)
+        return max((s.controller.lastFps for s in subscribers), default=0.0)
+
+    def get_health(self) -> dict:
+        health = dict(self._status.get("health") or {"state": "CONNECTING"})
+        process = self._process
+        health["worker"] = {
+            "pid": process.pid if process is not None else None,
+            "alive": process is not None and process.is_alive(),
+            "restarts": self._restarts,
+            "lastExitCode": self._lastExitCode,
+            "oversizedFrames": self._status.get("oversizedFrames", 0),
+        }
+        return health
+
+    def get_stats(self) -> dict:
+        worker_stats = self._status.get("stats") or {}
+        local = self.stats.snapshot()
+        stats = {
+            "captureFps": worker_stats.get("captureFps", 0.0),
+            "timingsMs": {**worker_stats.get("timingsMs", {}), **local["timingsMs"]},
+            "drops": {**worker_stats.get("drops", {}), **local["drops"]},
+        }
+        stats["drops"]["sharedMemoryOversized"] = self._status.get("oversizedFrames", 0)
+        with self.subscribersLock:
+            subscribers = list(self.subscribers)
+        stats["subscriberCount"] = len(subscribers)
+        stats["subscribers"] = [s.stats() for s in subscribers]
+        stats["deliveredFps"] = round(max((s.controller.lastFps for s in subscribers), default=0.0), 2)
+        stats["captureState"] = (self._status.get("health") or {}).get("state", "CONNECTING")
+        return stats
+
+    def get_occupancy(self) -> dict:
+        return self._status.get("occupancy") or {"occupancy": 0, "entries": 0, "exits": 0, "tracks": []}
+
+    def get_thread_cpu_times(self) -> dict:
+        return dict(self._status.get("threadCpuTimes") or {})
+
+
+def create_camera_stream(cameraUrl, deviceId, humanDetectionMode=False, detectionRegions=None):
+    """CameraStream trong process hiện tại hoặc trong worker process theo CAMERA_WORKER_PROCESSES"""
+    if settings.CAMERA_WORKER_PROCESSES:
+        return ProcessCameraStream(cameraUrl, deviceId, humanDetectionMode, detectionRegions)
+    return CameraStream(
+        cameraUrl,
+        deviceId=deviceId,
+        humanDetectionMode=humanDetectionMode,
+        detectionRegions=detectionRegions,
+    )
@@ -0,0 +1,232 @@
+"""
+Theo dõi lệnh gửi xuống device qua MQTT (chỉ trong RAM).
+
+Mỗi lệnh mang cmdId, được publish QoS 1 và nằm trong bảng pending cho tới khi:
+- device trả lời trên device/ack/{mac} {"cmdId", "status": "OK"|"ERROR"} -> CONFIRMED / REJECTED,
+- hoặc device/data/{mac} báo trạng thái khớp với lệnh (firmware chưa gửi ack) -> CONFIRMED;
+  instance ingest report đó có thể khác instance đã gửi lệnh nên report được
+  chuyển qua REPORTS_CHANNEL của coordinator,
+- hoặc quá COMMAND_ACK_TIMEOUT_SECONDS: gửi lại cùng cmdId (device bỏ qua lệnh
+  trùng), hết COMMAND_MAX_RETRIES lần -> TIMEOUT.
+
+Mọi thao tác chạy trên event loop nên không cần lock. Lệnh đã xong được giữ
+lại COMMAND_HISTORY_SIZE lệnh gần nhất để API tra cứu kết quả.
+"""
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.metrics import COMMAND_LATENCY, COMMAND_OUTCOMES, COMMAND_RETRIES
+
+
+_KNOWN_ACTIONS = {"ON", "OFF", "SET_SPEED", "LIGHT_ON", "LIGHT_OFF"}
+
+REPORTS_CHANNEL = "command-reports"
+
+
+def _action_label(action: str) -> str:
+    """action do client gửi lên: gom giá trị lạ để label metric không bùng nổ"""
+    return action if action in _KNOWN_ACTIONS else "OTHER"
+
+
+class CommandStatus:
+    PENDING = "PENDING"
+    CONFIRMED = "CONFIRMED"
+    REJECTED = "REJECTED"
+    TIMEOUT = "TIMEOUT"
+
+
+def expected_report(action: str, speed: Optional[int]) -> Optional[dict]:
+    """Trạng thái device/data phải báo để coi như lệnh đã được thực hiện"""
+    if action in ("ON", "LIGHT_ON"):
+        return {"state": "ON"}
+    if action in ("OFF", "LIGHT_OFF"):
+        return {"state": "OFF"}
+    if action == "SET_SPEED" and speed is not None:
+        return {"state": "OFF"} if speed == 0 else {"speed": speed}
+    return None
+
+
+def _reported_state(data: dict) -> Optional[str]:
+    # Firmware quạt gửi "status", các firmware khác gửi "state"
+    value = data.get("state", data.get("status"))
+    if value is None:
+        return None
+    value = str(value).strip().upper()
+    return {"ONLINE": "ON", "OFFLINE": "OFF"}.get(value, value)
+
+
+class TrackedCommand:
+    def __init__(self, device_id: str, device_name: str, mac: str, payload: dict, expected: Optional[dict]):
+        self.cmdId = uuid.uuid4().hex[:12]
+        self.deviceId = device_id
+        self.deviceName = device_name
+        self.mac = mac
+        self.action = payload["action"]
+        self.payload = {**payload, "cmdId": self.cmdId}
+        self.expected = expected
+        self.status = CommandStatus.PENDING
+        self.attempts = 0
+        self.createdAt = datetime.now()
+        self.completedAt: Optional[datetime] = None
+        self.confirmedBy: Optional[str] = None  # "ack" | "data"
+        self.error: Optional[str] = None
+        self._started = time.perf_counter()
+        self._latency = 0.0
+        self._last_sent = 0.0
+        self._done = asyncio.get_running_loop().create_future()
+
+    @property
+    def latencyMs(self) -> Optional[float]:
+        if self.completedAt is None or self.status != CommandStatus.CONFIRMED:
+            return None
+        return round(self._latency * 1000, 1)
+
+    def matches(self, data: dict) -> bool:
+        if not self.expected:
+            return False
+        name = data.get("name")
+        if name and name != self.deviceName:
+            return False  # Controller có nhiều device (ESP32-CAM: đèn + camera)
+        for key, value in self.expected.items():
+            reported = _reported_state(data) if key == "state" else data.get(key)
+            if reported != value:
+                return False
+        return True
+
+    async def wait(self, timeout: float) -> str:
+        try:
+            await asyncio.wait_for(asyncio.shield(self._done), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.status
+
+    def to_dict(self) -> dict:
+        return {
+            "cmdId": self.cmdId,
+            "deviceId": self.deviceId,
+            "action": self.action,
+            "status": self.status,
+            "attempts": self.attempts,
+            "confirmedBy": self.confirmedBy,
+            "latencyMs": self.latencyMs,
+            "error": self.error,
+            "createdAt": self.createdAt,
+            "completedAt": self.completedAt,
+        }
+
+
+class CommandTracker:
+    def __init__(self):
+        self._pending: Dict[str, TrackedCommand] = {}
+        self._history: "OrderedDict[str, TrackedCommand]" = OrderedDict()
+        self._publish: Optional[Callable[[str, dict], None]] = None
+        self._on_confirmed: Optional[Callable[[TrackedCommand], None]] = None
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def configure(self, publish: Callable[[str, dict], None], on_confirmed: Callable[[TrackedCommand], None]):
+        """publish(mac, payload) gửi QoS 1; on_confirmed(command) chạy khi device xác nhận"""
+        self._publish = publish
+        self._on_confirmed = on_confirmed
+
+    def send(self, device_id: str, device_name: str, mac: str, payload: dict) -> TrackedCommand:
+        command = TrackedCommand(device_id, device_name, mac, payload, expected_report(payload["action"], payload.get("speed")))
+        self._pending[command.cmdId] = command
+        self._transmit(command)
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep())
+        return command
+
+    def get(self, cmd_id: str) -> Optional[TrackedCommand]:
+        return self._pending.get(cmd_id) or self._history.get(cmd_id)
+
+    def recent(self, device_id: str, limit: int = 20) -> List[TrackedCommand]:
+        commands = [c for c in list(self._pending.values()) + list(self._history.values()) if c.deviceId == device_id]
+        commands.sort(key=lambda c: c.createdAt, reverse=True)
+        return commands[:limit]
+
+    def has_pending(self, mac: str) -> bool:
+        return any(c.mac == mac for c in self._pending.values())
+
+    def on_ack(self, mac: str, ack: dict):
+        """device/ack/{mac}"""
+        command = self._pending.get(str(ack.get("cmdId")))
+        if command is None or command.mac != mac:
+            return  # Ack trễ của lệnh đã xong, hoặc lệnh của instance khác
+        if str(ack.get("status", "OK")).upper() == "OK":
+            self._complete(command, CommandStatus.CONFIRMED, "ack")
+        else:
+            command.error = ack.get("error") or "Device rejected the command"
+            self._complete(command, CommandStatus.REJECTED, "ack")
+
+    def on_report(self, mac: str, data: dict):
+        """device/data/{mac}: xác nhận các lệnh đang chờ có trạng thái khớp"""
+        if "cmdId" in data:
+            self.on_ack(mac, data)
+        for command in [c for c in self._pending.values() if c.mac == mac]:
+            if command.matches(data):
+                self._complete(command, CommandStatus.CONFIRMED, "data")
+
+    async def share_report(self, mac: str, data: dict):
+        """Chuyển report (đã on_report tại chỗ) cho các instance khác"""
+        from app.core.coordination import get_coordinator
+        coordinator = get_coordinator()
+        if coordinator.name == "local":
+            return  # Một instance: không ai khác giữ lệnh
+        try:
+            await coordinator.publish(REPORTS_CHANNEL, {"mac": mac, "data": data})
+        except Exception as e:
+            print(f"⚠️ Could not share report of {mac}: {e}")
+
+    async def handle_remote_report(self, message: dict):
+        """Handler của REPORTS_CHANNEL"""
+        from app.core.coordination import get_coordinator
+        if message.get("origin") == get_coordinator().instance_id:
+            return
+        self.on_report(message["mac"], message["data"])
+
+    def _transmit(self, command: TrackedCommand):
+        command.attempts += 1
+        command._last_sent = time.perf_counter()
+        if command.attempts > 1:
+            COMMAND_RETRIES.labels(_action_label(command.action)).inc()
+        self._publish(command.mac, command.payload)
+
+    def _complete(self, command: TrackedCommand, status: str, confirmed_by: Optional[str] = None):
+        self._pending.pop(command.cmdId, None)
+        command._latency = time.perf_counter() - command._started
+        command.status = status
+        command.confirmedBy = confirmed_by
+        command.completedAt = datetime.now()
+        COMMAND_OUTCOMES.labels(_action_label(command.action), status).inc()
+        if status == CommandStatus.CONFIRMED:
+            COMMAND_LATENCY.labels(_action_label(command.action), confirmed_by).observe(command._latency)
+            if self._on_confirmed:
+                self._on_confirmed(command)
+        if not command._done.done():
+            command._done.set_result(status)
+        self._history[command.cmdId] = command
+        while len(self._history) > settings.COMMAND_HISTORY_SIZE:
+            self._history.popitem(last=False)
+
+    async def _sweep(self):
+        """Gửi lại / đánh dấu TIMEOUT; tự dừng khi không còn lệnh chờ"""
+        timeout = settings.COMMAND_ACK_TIMEOUT_SECONDS
+        while self._pending:
+            await asyncio.sleep(min(0.25, timeout / 4))
+            now = time.perf_counter()
+            for command in list(self._pending.values()):
+                if now - command._last_sent < timeout:
+                    continue
+                if command.attempts <= settings.COMMAND_MAX_RETRIES:
+                    self._transmit(command)
+                else:
+                    command.error = f"No acknowledgment after {command.attempts} attempts"
+                    self._complete(command, CommandStatus.TIMEOUT)
+
+
+command_tracker = CommandTracker()
@@ -0,0 +1,215 @@
+"""
+Detector người cho CameraStream, chọn backend qua DETECTOR_BACKEND.
+
+- "torch":    ultralytics YOLO (mặc định, như trước), dùng CUDA nếu có.
+- "onnx":     ONNX Runtime trên CPU với model YOLO đã export (.onnx), kể cả
+              bản INT8 quantize (xem benchmarks/detector_bench.py --export).
+- "openvino": OpenVINO Runtime (.onnx hoặc .xml), phù hợp CPU Intel.
+
+Các backend export dùng chung pre/post-processing (letterbox + NMS) nên cho
+kết quả tương đương backend torch. Session ONNX Runtime an toàn khi gọi từ
+nhiều thread nên được dùng chung giữa các camera để tiết kiệm RAM.
+"""
+import threading
+from abc import ABC, abstractmethod
+from typing import List, NamedTuple, Optional
+
+import cv2
+import numpy as np
+
+from app.core.config import settings
+
+PERSON_CLASS_ID = 0
+
+
+class Detection(NamedTuple):
+    x1: int
+    y1: int
+    x2: int
+    y2: int
+    score: float
+
+
+class PersonDetector(ABC):
+    """Interface chung: detect(frame BGR) -> danh sách box người"""
+
+    name = "base"
+    shared = False  # True nếu một instance dùng được cho nhiều thread detection
+
+    @abstractmethod
+    def detect(self, frame) -> List[Detection]:
+        """Box người trong frame, tọa độ pixel của frame gốc"""
+
+
+class UltralyticsDetector(PersonDetector):
+    name = "torch"
+
+    def __init__(self, model_path: str = "yolo11s.pt", conf: float = 0.25):
+        import torch
+        from ultralytics import YOLO
+
+        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.conf = conf
+        self.model = YOLO(model_path)
+        self.model.to(self.device)
+
+    def detect(self, frame) -> List[Detection]:
+        results = self.model(frame, classes=[PERSON_CLASS_ID], conf=self.conf, device=self.device, verbose=False)
+        detections = []
+        for result in results:
+            for box in result.boxes:
+                if int(box.cls) == PERSON_CLASS_ID:
+                    x1, y1, x2, y2 = map(int, box.xyxy[0])
+                    detections.append(Detection(x1, y1, x2, y2, float(box.conf)))
+        return detections
+
+
+class _ExportedYoloDetector(PersonDetector):
+    """Pre/post-processing cho model YOLO export (output [1, 4 + classes, anchors])"""
+
+    def __init__(self, input_size: int = 640, conf: float = 0.25, iou: float = 0.45):
+        self.inputSize = input_size
+        self.conf = conf
+        self.iou = iou
+
+    def _preprocess(self, frame):
+        height, width = frame.shape[:2]
+        scale = min(self.inputSize / height, self.inputSize / width)
+        new_w, new_h = int(round(width * scale)), int(round(height * scale))
+        pad_x = (self.inputSize - new_w) // 2
+        pad_y = (self.inputSize - new_h) // 2
+
+        canvas = np.full((self.inputSize, self.inputSize, 3), 114, dtype=np.uint8)
+        canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        blob = cv2.dnn.blobFromImage(canvas, 1 / 255.0, swapRB=True)  # NCHW float32, RGB
+        return blob, scale, pad_x, pad_y
+
+    def _postprocess(self, output, scale: float, pad_x: int, pad_y: int, width: int, height: int) -> List[Detection]:
+        preds = np.squeeze(output, axis=0)  # [4 + classes, anchors]
+        scores = preds[4 + PERSON_CLASS_ID]
+        keep = scores >= self.conf
+        if not np.any(keep):
+            return []
+        scores = scores[keep]
+        cx, cy, w, h = preds[0][keep], preds[1][keep], preds[2][keep], preds[3][keep]
+        x1 = (cx - w / 2 - pad_x) / scale
+        y1 = (cy - h / 2 - pad_y) / scale
+        boxes = np.stack([x1, y1, w / scale, h / scale], axis=1)
+
+        indices = cv2.dnn.NMSBoxes(boxes.tolist(), scores.tolist(), self.conf, self.iou)
+        detections = []
+        for i in np.array(indices).flatten():
+            bx, by, bw, bh = boxes[i]
+            detections.append(Detection(
+                max(0, int(bx)), max(0, int(by)),
+                min(width - 1, int(bx + bw)), min(height - 1, int(by + bh)),
+                float(scores[i]),
+            ))
+        return detections
+
+    @abstractmethod
+    def _infer(self, blob):
+        """Chạy model trên blob (1, 3, H, W) float32, trả về output thô của YOLO"""
+
+    def detect(self, frame) -> List[Detection]:
+        height, width = frame.shape[:2]
+        blob, scale, pad_x, pad_y = self._preprocess(frame)
+        return self._postprocess(self._infer(blob), scale, pad_x, pad_y, width, height)
+
+
+class OnnxDetector(_ExportedYoloDetector):
+    name = "onnx"
+    shared = True
+
+    def __init__(self, model_path: str, threads: int = 0, **kwargs):
+        import onnxruntime as ort
+
+        super().__init__(**kwargs)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.inputName = self.session.get_inputs()[0].name
+
+    def _infer(self, blob):
+        return self.session.run(None, {self.inputName: blob})[0]
+
+
+class OpenVinoDetector(_ExportedYoloDetector):
+    name = "openvino"
+
+    def __init__(self, model_path: str, threads: int = 0, **kwargs):
+        import openvino as ov
+
+        super().__init__(**kwargs)
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads:
+            config["INFERENCE_NUM_THREADS"] = threads
+        core = ov.Core()
+        self.compiledModel = core.compile_model(core.read_model(model_path), "CPU", config)
+        # Infer request không dùng chung giữa các thread -> mỗi camera một instance
+        self.request = self.compiledModel.create_infer_request()
+
+    def _infer(self, blob):
+        self.request.infer({0: blob})
+        return self.request.get_output_tensor(0).data
+
+
+_BACKENDS = {
+    "torch": UltralyticsDetector,
+    "onnx": OnnxDetector,
+    "openvino": OpenVinoDetector,
+}
+
+# Model mặc định khi DETECTOR_MODEL_PATH để trống (tên file do ultralytics export tạo ra)
+_DEFAULT_MODEL_PATHS = {
+    "torch": "yolo11s.pt",
+    "onnx": "yolo11s.onnx",
+    "openvino": "yolo11s_openvino_model/yolo11s.xml",
+}
+
+_shared_detectors: dict = {}
+_shared_lock = threading.Lock()
+
+
+def build_detector(backend: str, model_path: Optional[str] = None) -> PersonDetector:
+    """Tạo detector mới cho backend (không dùng cache)"""
+    if backend not in _BACKENDS:
+        raise ValueError(f"Unknown detector backend: {backend} (expected one of {', '.join(_BACKENDS)})")
+    model_path = model_path or settings.DETECTOR_MODEL_PATH or _DEFAULT_MODEL_PATHS[backend]
+    if backend == "torch":
+        return UltralyticsDetector(model_path, conf=settings.DETECTOR_CONF_THRESHOLD)
+    return _BACKENDS[backend](
+        model_path,
+        threads=settings.DETECTOR_THREADS,
+        input_size=settings.DETECTOR_INPUT_SIZE,
+        conf=settings.DETECTOR_CONF_THRESHOLD,
+    )
+
+
+def get_detector() -> PersonDetector:
+    """Detector theo Settings; backend thread-safe được dùng chung giữa các camera"""
+    backend = settings.DETECTOR_BACKEND
+    detector_cls = _BACKENDS.get(backend)
+    if detector_cls is None or not detector_cls.shared:
+        return build_detector(backend)
+    with _shared_lock:
+        detector = _shared_detectors.get(backend)
+        if detector is None:
+            detector = build_detector(backend)
+            _shared_detectors[backend] = detector
+        return detector
+
+
+def preload_backend():
+    """Import sẵn thư viện của DETECTOR_BACKEND (torch/ultralytics rất nặng) ở thread nền"""
+    modules = {
+        "torch": ("torch", "ultralytics"),
+        "onnx": ("onnxruntime",),
+        "openvino": ("openvino",),
+    }.get(settings.DETECTOR_BACKEND, ())
+    for module in modules:
+        __import__(module)
+    if _BACKENDS.get(settings.DETECTOR_BACKEND, PersonDetector).shared:
+        get_detector()
@@ -1,10 +1,20 @@
-from typing import List, Optional
+import asyncio
+from typing import List, Optional, Set
 from datetime import datetime
 from beanie import PydanticObjectId
-from app.models.device import Device
+from app.core.config import settings
+from app.models.device import Device, DeviceType
 from app.models.user import User
 from app.schemas.device import DeviceCreate, DeviceUpdate, DeviceCommand
 from app.services.room import RoomService
+from app.services.command_tracker import command_tracker, TrackedCommand
+from app.services import shadow
+
+# Lệnh backend tự áp dụng (không gửi xuống device, không theo dõi ack)
+BACKEND_ACTIONS = ("CAMERA_MODE", "CAMERA_ON", "CAMERA_OFF")
+
+# Giữ tham chiếu tới task nền để event loop không thu hồi giữa chừng
+_background_tasks: Set[asyncio.Task] = set()
 
 class DeviceService:
     @staticmethod
@@ -74,9 +84,17 @@ class DeviceService:
                 return None
             update_data["roomId"] = PydanticObjectId(update_data["roomId"])
 
+        if "detectionRegions" in update_data and not update_data["detectionRegions"]:
+            update_data["detectionRegions"] = None
+
         await device.update({"$set": update_data})
         for key, value in update_data.items():
             setattr(device, key, value)
+
+        # Áp dụng ROI mới cho stream đang chạy (có thể ở instance khác)
+        if "detectionRegions" in update_data:
+            from app.services import stream_routing
+            await stream_routing.send_control(device_id, detectionRegions=update_data["detectionRegions"])
         return device
 
     @staticmethod
@@ -93,10 +111,28 @@ class DeviceService:
         return True
 
     @staticmethod
-    async def send_command(device_id: str, command: DeviceCommand, user: User) -> bool:
+    async def send_command(device_id: str, command: DeviceCommand, user: User, wait: bool = False) -> Optional[dict]:
+        """
+        Gửi lệnh, trả về trạng thái lệnh (None nếu không tìm thấy device/không có quyền).
+        wait=True: chờ device xác nhận (hoặc hết số lần gửi lại) trước khi trả về.
+        """
         device = await DeviceService.get_device_by_id(device_id, user)
         if not device:
-            return False
+            return None
+
+        tracked = await DeviceService.dispatch_command(device, command)
+        if tracked is None:
+            # CAMERA_MODE / CAMERA_ON / CAMERA_OFF áp dụng ngay ở backend; device không có controllerMAC thì không gửi được
+            status = "APPLIED" if command.action in BACKEND_ACTIONS else "NOT_SENT"
+            return {"action": command.action, "status": status}
+        if wait:
+            await tracked.wait(settings.COMMAND_ACK_TIMEOUT_SECONDS * (settings.COMMAND_MAX_RETRIES + 1) + 1)
+        return tracked.to_dict()
+
+    @staticmethod
+    async def dispatch_command(device: Device, command: DeviceCommand) -> Optional[TrackedCommand]:
+        """Thực thi lệnh trên device đã được kiểm tra quyền (dùng chung cho API và automation)"""
+        device_id = str(device.id)
 
         # Xử lý CAMERA_MODE riêng - chỉ update DB và cập nhật stream, không publish MQTT
         if command.action == "CAMERA_MODE":
@@ -106,34 +142,54 @@ class DeviceService:
             }
             await device.update({"$set": update_data})
             
-            # Cập nhật detection mode cho stream đang chạy (nếu có)
-            from app.api.endpoints.device import active_camera_streams
-            if device_id in active_camera_streams:
-                active_camera_streams[device_id].set_detection_mode(command.humanDetectionEnabled)
+            # Cập nhật detection mode cho stream đang chạy (có thể ở instance khác)
+            from app.services import stream_routing
+            await stream_routing.send_control(device_id, humanDetectionEnabled=command.humanDetectionEnabled)
             
-            return True
+            return None
+
+        # Firmware ESP32-CAM không xử lý bật/tắt camera: backend ghi trạng thái, không gửi MQTT
+        if command.action in ("CAMERA_ON", "CAMERA_OFF"):
+            await device.update({"$set": {
+                "state": "ON" if command.action == "CAMERA_ON" else "OFF",
+                "updatedAt": datetime.now()
+            }})
+            return None
 
         # Publish command to MQTT topic for the device (cho các lệnh khác)
-        from app.core.mqtt import publish_command
-        
-        if device.controllerMAC:
-            mqtt_command = {
-                "action": command.action,
-            }
-            if command.speed is not None:
-                mqtt_command["speed"] = command.speed
-            
-            publish_command(device.controllerMAC, mqtt_command)
-            
-            # Update DB ngay để UI mượt (log sẽ được ghi trong device_to_response khi FE poll)
-            update_data = {"updatedAt": datetime.now()}
-            if command.action in ["ON", "LIGHT_ON", "CAMERA_ON"]:
-                update_data["state"] = "ON"
-            elif command.action in ["OFF", "LIGHT_OFF", "CAMERA_OFF"]:
-                update_data["state"] = "OFF"
-            if command.speed is not None:
-                update_data["speed"] = command.speed
-                
-            await device.update({"$set": update_data})
-            
-        return True
\ No newline at end of file
+        if not device.controllerMAC:
+            return None
+        mqtt_command = {
+            "action": command.action,
+        }
+        if command.speed is not None:
+            mqtt_command["speed"] = command.speed
+
+        # Chỉ ghi desired; state/reported cập nhật khi device xác nhận (on_command_confirmed)
+        desired = shadow.desired_from_command(command.action, command.speed)
+        if desired and device.type != DeviceType.CAMERA:
+            mqtt_command["version"] = await shadow.set_desired(device, desired)
+        return command_tracker.send(device_id, device.name, device.controllerMAC, mqtt_command)
+
+    @staticmethod
+    def on_command_confirmed(command: TrackedCommand):
+        """Callback của command_tracker (trên event loop)"""
+        task = asyncio.create_task(DeviceService._apply_confirmed_command(command))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    @staticmethod
+    async def _apply_confirmed_command(command: TrackedCommand):
+        # Log sẽ được ghi trong device_to_response khi FE poll
+        try:
+            device = await Device.get(PydanticObjectId(command.deviceId))
+            if not device:
+                return
+            update = shadow.reported_update(
+                device.shadow, shadow.desired_from_command(command.action, command.payload.get("speed"))
+            )
+            if update:
+                update["$set"]["updatedAt"] = datetime.now()
+                await Device.find_one(Device.id == device.id).update(update)
+        except Exception as e:
+            print(f"Error applying confirmed command {command.cmdId}: {e}")
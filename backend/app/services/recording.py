@@ -0,0 +1,254 @@
+"""
+Ghi hình camera khi phát hiện người.
+
+CameraStream đẩy mọi frame JPEG (đã encode sẵn cho stream) vào ring buffer
+trong RAM - chỉ là một thao tác append, không encode/ghi đĩa thêm. Khi có
+HUMAN_DETECTED, ring buffer (pre-event) được flush ra segment file và ghi
+tiếp đến hết post-event. Việc ghi đĩa chạy ở thread riêng.
+
+Cấu trúc trên đĩa:
+    {RECORDING_DIR}/{deviceId}/index.jsonl          - mỗi dòng một segment
+    {RECORDING_DIR}/{deviceId}/{segmentId}.mjpeg    - các JPEG nối tiếp nhau
+    {RECORDING_DIR}/{deviceId}/{segmentId}.idx      - (ts_ms, offset, length) mỗi frame
+"""
+import asyncio
+import json
+import os
+import queue
+import struct
+import threading
+import time
+from collections import deque
+from itertools import islice
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+
+_FRAME_ENTRY = struct.Struct("<QQI")  # timestamp ms, offset, length
+_index_lock = threading.Lock()
+
+
+def _device_dir(device_id: str) -> str:
+    return os.path.join(settings.RECORDING_DIR, device_id)
+
+
+class _Segment:
+    def __init__(self, device_id: str, started_at: float):
+        self.device_id = device_id
+        self.id = str(int(started_at * 1000))
+        self.started_at = started_at
+        self.ended_at = started_at
+        self.frames = 0
+        directory = _device_dir(device_id)
+        os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, f"{self.id}.mjpeg")
+        self._data = open(self.data_path, "wb")
+        self._idx = open(os.path.join(directory, f"{self.id}.idx"), "wb")
+        self._offset = 0
+
+    def write(self, ts: float, jpeg: bytes):
+        self._data.write(jpeg)
+        self._idx.write(_FRAME_ENTRY.pack(int(ts * 1000), self._offset, len(jpeg)))
+        self._offset += len(jpeg)
+        self.frames += 1
+        self.ended_at = ts
+
+    def abort(self):
+        """Lỗi ghi đĩa: đóng file, không thêm vào index"""
+        for f in (self._data, self._idx):
+            try:
+                f.close()
+            except OSError:
+                pass
+
+    def close(self):
+        self._data.close()
+        self._idx.close()
+        entry = {
+            "id": self.id,
+            "deviceId": self.device_id,
+            "startedAt": self.started_at,
+            "endedAt": self.ended_at,
+            "frames": self.frames,
+            "bytes": self._offset,
+        }
+        with _index_lock:
+            with open(os.path.join(_device_dir(self.device_id), "index.jsonl"), "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+
+class FrameRecorder:
+    def __init__(
+        self,
+        device_id: str,
+        pre_seconds: float = None,
+        post_seconds: float = None,
+        segment_seconds: float = None,
+    ):
+        self.deviceId = device_id
+        self.preSeconds = settings.RECORDING_PRE_SECONDS if pre_seconds is None else pre_seconds
+        self.postSeconds = settings.RECORDING_POST_SECONDS if post_seconds is None else post_seconds
+        self.segmentSeconds = settings.RECORDING_SEGMENT_SECONDS if segment_seconds is None else segment_seconds
+
+        self._ring: deque = deque()  # (ts, jpeg) trong preSeconds gần nhất
+        self._recordUntil = 0.0
+        self._writeQueue: queue.Queue = queue.Queue(maxsize=512)
+        self._writerThread: Optional[threading.Thread] = None
+        self.droppedFrames = 0
+
+    @property
+    def recording(self) -> bool:
+        return self._recordUntil > 0
+
+    def push(self, ts: float, jpeg: bytes):
+        """Gọi cho mỗi frame từ thread detection"""
+        if self._recordUntil:
+            if ts <= self._recordUntil:
+                self._enqueue(("frame", ts, jpeg))
+                return
+            self._recordUntil = 0.0
+            self._enqueue(("close", ts, None))
+
+        ring = self._ring
+        ring.append((ts, jpeg))
+        cutoff = ts - self.preSeconds
+        while ring and ring[0][0] < cutoff:
+            ring.popleft()
+
+    def trigger(self, ts: float):
+        """Bắt đầu (hoặc gia hạn) ghi hình khi phát hiện người"""
+        if not self._recordUntil:
+            self._ensure_writer()
+            self._enqueue(("open", self._ring[0][0] if self._ring else ts, None))
+            while self._ring:
+                frame_ts, jpeg = self._ring.popleft()
+                self._enqueue(("frame", frame_ts, jpeg))
+        self._recordUntil = ts + self.postSeconds
+
+    def close(self):
+        if self._writerThread is None:
+            return
+        if self._recordUntil:
+            self._recordUntil = 0.0
+            self._enqueue(("close", time.time(), None))
+        self._writeQueue.put(("stop", 0.0, None))
+        self._writerThread.join(timeout=5)
+        self._writerThread = None
+
+    def _enqueue(self, item):
+        try:
+            self._writeQueue.put_nowait(item)
+        except queue.Full:
+            # Đĩa quá chậm: bỏ frame thay vì chặn pipeline (open/close vẫn phải vào queue)
+            if item[0] == "frame":
+                self.droppedFrames += 1
+            else:
+                self._writeQueue.put(item)
+
+    def _ensure_writer(self):
+        if self._writerThread is None or not self._writerThread.is_alive():
+            self._writerThread = threading.Thread(
+                target=self._writer, name=f"camera-recorder-{self.deviceId}", daemon=True
+            )
+            self._writerThread.start()
+
+    def _writer(self):
+        segment: Optional[_Segment] = None
+        while True:
+            kind, ts, jpeg = self._writeQueue.get()
+            try:
+                if kind == "open":
+                    if segment is None:
+                        segment = _Segment(self.deviceId, ts)
+                elif kind == "frame":
+                    if segment is None:
+                        segment = _Segment(self.deviceId, ts)
+                    elif ts - segment.started_at >= self.segmentSeconds:
+                        segment.close()
+                        segment = _Segment(self.deviceId, ts)
+                    segment.write(ts, jpeg)
+                elif kind in ("close", "stop"):
+                    if segment is not None:
+                        segment.close()
+                        print(f"🎞️ Recording saved: {segment.data_path} ({segment.frames} frames)")
+                        segment = None
+                    if kind == "stop":
+                        return
+            except OSError as e:
+                print(f"⚠️ Recording write error: {e}")
+                if segment is not None:
+                    segment.abort()
+                segment = None
+
+
+class RecordingIndex:
+    """
+    Đọc index segment trên đĩa theo device và khoảng thời gian. Các hàm đọc
+    file là sync: endpoint gọi qua asyncio.to_thread / aiter_frames.
+    """
+
+    @staticmethod
+    def list_segments(device_id: str, start: Optional[float] = None, end: Optional[float] = None) -> List[dict]:
+        path = os.path.join(_device_dir(device_id), "index.jsonl")
+        if not os.path.exists(path):
+            return []
+        segments = []
+        with _index_lock:
+            with open(path) as f:
+                lines = f.readlines()
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if start is not None and entry["endedAt"] < start:
+                continue
+            if end is not None and entry["startedAt"] > end:
+                continue
+            segments.append(entry)
+        segments.sort(key=lambda s: s["startedAt"], reverse=True)
+        return segments
+
+    @staticmethod
+    def get_segment(device_id: str, segment_id: str) -> Optional[dict]:
+        if not segment_id.isdigit():
+            return None
+        for entry in RecordingIndex.list_segments(device_id):
+            if entry["id"] == segment_id:
+                return entry
+        return None
+
+    @staticmethod
+    def data_path(device_id: str, segment_id: str) -> str:
+        return os.path.join(_device_dir(device_id), f"{segment_id}.mjpeg")
+
+    @staticmethod
+    def iter_frames(device_id: str, segment_id: str) -> Iterator[Tuple[float, bytes]]:
+        """Đọc lần lượt (timestamp, jpeg) của một segment"""
+        directory = _device_dir(device_id)
+        with open(os.path.join(directory, f"{segment_id}.idx"), "rb") as idx, \
+                open(os.path.join(directory, f"{segment_id}.mjpeg"), "rb") as data:
+            while True:
+                raw = idx.read(_FRAME_ENTRY.size)
+                if len(raw) < _FRAME_ENTRY.size:
+                    return
+                ts_ms, offset, length = _FRAME_ENTRY.unpack(raw)
+                data.seek(offset)
+                yield ts_ms / 1000, data.read(length)
+
+    @staticmethod
+    async def aiter_frames(device_id: str, segment_id: str, batch: int = 16) -> AsyncIterator[Tuple[float, bytes]]:
+        """Như iter_frames nhưng đọc đĩa ở thread pool, từng batch frame"""
+        frames = RecordingIndex.iter_frames(device_id, segment_id)
+        try:
+            while True:
+                chunk = await asyncio.to_thread(lambda: list(islice(frames, batch)))
+                if not chunk:
+                    return
+                for frame in chunk:
+                    yield frame
+        finally:
+            try:
+                frames.close()
+            except ValueError:
+                pass  # Bị hủy khi thread còn đang đọc: generator tự đóng file khi bị thu gom
@@ -0,0 +1,80 @@
+"""
+Vùng quan tâm (ROI) cho detection của từng camera.
+
+Polygon lưu trên Device.detectionRegions với tọa độ chuẩn hóa 0..1 nên không
+phụ thuộc độ phân giải. RoiMask tính sẵn (và cache theo kích thước frame):
+- mask nhị phân của hợp các polygon, dùng để lọc box,
+- hình chữ nhật bao ngoài, dùng để crop input của detector (ít pixel hơn),
+- polygon theo pixel để vẽ lên stream.
+"""
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from app.services.detector import Detection
+
+
+def _region_points(region) -> List[List[float]]:
+    """Chấp nhận DetectionRegion (từ DB) hoặc dict (vừa update qua API)"""
+    return region["points"] if isinstance(region, dict) else region.points
+
+
+class _PreparedRoi:
+    def __init__(self, polygons: List[np.ndarray], width: int, height: int):
+        self.polygons = [
+            np.round(poly * [width - 1, height - 1]).astype(np.int32) for poly in polygons
+        ]
+        self.mask = np.zeros((height, width), dtype=np.uint8)
+        cv2.fillPoly(self.mask, self.polygons, 255)
+
+        x, y, w, h = cv2.boundingRect(np.concatenate(self.polygons))
+        self.rect = (x, y, x + w, y + h)
+        # Crop không đáng kể (ROI gần cả frame) thì bỏ qua để khỏi copy
+        self.cropUseful = w * h < 0.9 * width * height
+
+
+class RoiMask:
+    def __init__(self, regions=None):
+        self.polygons: List[np.ndarray] = []
+        for region in regions or []:
+            points = np.asarray(_region_points(region), dtype=np.float32)
+            if len(points) >= 3:
+                self.polygons.append(np.clip(points, 0.0, 1.0))
+        self._prepared: Optional[_PreparedRoi] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.polygons)
+
+    def prepare(self, shape) -> _PreparedRoi:
+        """Mask/rect cho kích thước frame (tính lại khi camera đổi độ phân giải)"""
+        height, width = shape[:2]
+        prepared = self._prepared
+        if prepared is None or prepared.mask.shape != (height, width):
+            prepared = _PreparedRoi(self.polygons, width, height)
+            self._prepared = prepared
+        return prepared
+
+    def crop(self, frame) -> Tuple[np.ndarray, int, int]:
+        """Phần frame chứa ROI (view, không copy) và offset (x, y) của nó"""
+        prepared = self.prepare(frame.shape)
+        if not prepared.cropUseful:
+            return frame, 0, 0
+        x1, y1, x2, y2 = prepared.rect
+        return frame[y1:y2, x1:x2], x1, y1
+
+    def filter(self, detections: List[Detection], frame_shape) -> List[Detection]:
+        """Giữ box có điểm chân (giữa cạnh dưới) nằm trong ROI"""
+        mask = self.prepare(frame_shape).mask
+        height, width = mask.shape
+        kept = []
+        for det in detections:
+            x = min(width - 1, max(0, (det.x1 + det.x2) // 2))
+            y = min(height - 1, max(0, det.y2))
+            if mask[y, x]:
+                kept.append(det)
+        return kept
+
+    def draw(self, frame):
+        cv2.polylines(frame, self.prepare(frame.shape).polygons, True, (0, 200, 255), 1)
@@ -0,0 +1,146 @@
+"""
+Device shadow: tách trạng thái người dùng yêu cầu (desired) khỏi trạng thái
+device báo về (reported), mỗi phần có version riêng.
+
+- send_command chỉ ghi desired (desiredVersion + 1, tăng nguyên tử trong DB).
+- Camera không có shadow: firmware chưa xử lý lệnh camera nào, bật/tắt do
+  backend ghi thẳng vào Device.state.
+- device/data ghi reported (reportedVersion + 1 khi thực sự đổi) và mirror ra
+  Device.state/speed cho các API cũ. Thay đổi do device tự làm (nút bấm trên
+  quạt) khi không có lệnh đang chờ được nhận làm desired mới.
+- device/new (re-register) đánh dấu resyncPending: ở report đầu tiên sau đó
+  backend so desired với trạng thái thật và chỉ gửi phần chênh lệch (delta).
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from beanie import UpdateResponse
+
+from app.models.device import Device, DeviceShadow, DeviceType
+from app.schemas.device import DeviceCommand
+
+# Các trường được đồng bộ qua shadow
+SHADOW_FIELDS = ("state", "speed")
+
+
+def desired_from_command(action: str, speed: Optional[int]) -> Dict:
+    """Phần desired mà một lệnh yêu cầu"""
+    if action in ("ON", "LIGHT_ON"):
+        desired = {"state": "ON"}
+    elif action in ("OFF", "LIGHT_OFF"):
+        desired = {"state": "OFF"}
+    else:
+        desired = {}
+    if action == "SET_SPEED" and speed is not None:
+        # Quạt: speed 0 = tắt, speed > 0 = bật
+        desired = {"state": "OFF"} if speed == 0 else {"state": "ON", "speed": speed}
+    elif speed is not None:
+        desired["speed"] = speed
+    return desired
+
+
+def reported_from_data(data: dict) -> Dict:
+    """Phần reported trong payload device/data (firmware quạt gửi "status" thay cho "state")"""
+    reported = {}
+    value = data.get("state", data.get("status"))
+    if value is not None:
+        value = str(value).strip().upper()
+        if value in ("ONLINE", "ON"):
+            reported["state"] = "ON"
+        elif value in ("OFFLINE", "OFF"):
+            reported["state"] = "OFF"
+    # Khi OFF, ESP32 gửi speed=0: giữ speed cũ
+    if isinstance(data.get("speed"), int) and data["speed"] > 0:
+        reported["speed"] = data["speed"]
+    return reported
+
+
+def compute_delta(shadow: DeviceShadow) -> Dict:
+    """desired chưa khớp reported. Quạt đang/ sẽ tắt thì speed không quan trọng."""
+    delta = {key: value for key, value in shadow.desired.items() if shadow.reported.get(key) != value}
+    if shadow.desired.get("state") == "OFF":
+        delta.pop("speed", None)
+    return delta
+
+
+def commands_for_delta(device_type: str, delta: Dict) -> List[DeviceCommand]:
+    """Chuyển delta thành lệnh mà firmware hiểu (tối đa một lệnh)"""
+    if not delta:
+        return []
+    device_type = str(device_type).strip().upper()
+    if device_type == DeviceType.FAN:
+        if delta.get("state") == "OFF":
+            return [DeviceCommand(action="OFF")]
+        if "speed" in delta:
+            return [DeviceCommand(action="SET_SPEED", speed=delta["speed"])]
+        return [DeviceCommand(action="ON")]
+    if device_type == DeviceType.LIGHT and "state" in delta:
+        return [DeviceCommand(action="LIGHT_ON" if delta["state"] == "ON" else "LIGHT_OFF")]
+    return []
+
+
+def desired_update(shadow: DeviceShadow, changes: Dict) -> Dict:
+    """Toán tử update ghi desired; rỗng nếu không có gì đổi"""
+    changed = {key: value for key, value in changes.items() if shadow.desired.get(key) != value}
+    if not changed:
+        return {}
+    update = {"$set": {f"shadow.desired.{key}": value for key, value in changed.items()}}
+    update["$set"]["shadow.desiredAt"] = datetime.now()
+    update["$inc"] = {"shadow.desiredVersion": 1}
+    shadow.desired.update(changed)
+    shadow.desiredVersion += 1
+    return update
+
+
+def reported_update(shadow: DeviceShadow, reported: Dict) -> Dict:
+    """Toán tử update ghi reported (+ mirror Device.state/speed); rỗng nếu không đổi"""
+    changed = {key: value for key, value in reported.items() if shadow.reported.get(key) != value}
+    if not changed:
+        return {}
+    update = {"$set": {}}
+    for key, value in changed.items():
+        update["$set"][f"shadow.reported.{key}"] = value
+        update["$set"][key] = value
+    update["$set"]["shadow.reportedAt"] = datetime.now()
+    update["$inc"] = {"shadow.reportedVersion": 1}
+    shadow.reported.update(changed)
+    shadow.reportedVersion += 1
+    return update
+
+
+def merge_updates(*updates: Dict) -> Dict:
+    merged: Dict[str, Dict] = {}
+    for update in updates:
+        for operator, fields in update.items():
+            merged.setdefault(operator, {}).update(fields)
+    return merged
+
+
+async def set_desired(device: Device, changes: Dict) -> int:
+    """
+    Ghi desired từ lệnh của user/automation, trả về desiredVersion.
+    Version đọc lại từ document sau $inc: hai lệnh đồng thời (API, automation,
+    instance khác) nhận hai version khác nhau.
+    """
+    update = desired_update(device.shadow, changes)
+    if update:
+        update["$set"]["updatedAt"] = datetime.now()
+        updated = await Device.find_one(Device.id == device.id).update(
+            update, response_type=UpdateResponse.NEW_DOCUMENT
+        )
+        if updated is not None:
+            device.shadow = updated.shadow
+    return device.shadow.desiredVersion
+
+
+def to_dict(shadow: DeviceShadow) -> dict:
+    return {
+        "desired": shadow.desired,
+        "reported": shadow.reported,
+        "delta": compute_delta(shadow),
+        "desiredVersion": shadow.desiredVersion,
+        "reportedVersion": shadow.reportedVersion,
+        "desiredAt": shadow.desiredAt,
+        "reportedAt": shadow.reportedAt,
+        "resyncPending": shadow.resyncPending,
+    }
@@ -0,0 +1,107 @@
+import asyncio
+import time
+from typing import Dict, Optional, Tuple
+
+import cv2
+
+from app.core.config import settings
+
+THUMBNAIL_JPEG_QUALITY = 70
+
+# (deviceId, width) -> (created_at, jpeg)
+_thumbnail_cache: Dict[Tuple[str, int], Tuple[float, bytes]] = {}
+# deviceId -> (created_at, frame): các width khác nhau dùng chung một lần grab
+_frame_cache: Dict[str, Tuple[float, object]] = {}
+# deviceId -> grab đang chạy. Mỗi device chỉ một grab: request hết timeout không
+# hủy được thread cv2, request sau chờ tiếp chính grab đó thay vì mở thêm thread
+_grabs: Dict[str, asyncio.Task] = {}
+
+
+def _encode_thumbnail(frame, width: int) -> Optional[bytes]:
+    height, frame_width = frame.shape[:2]
+    if width and frame_width > width:
+        frame = cv2.resize(frame, (width, int(height * width / frame_width)), interpolation=cv2.INTER_AREA)
+    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_JPEG_QUALITY])
+    return buffer.tobytes() if ret else None
+
+
+def _grab_single_frame(stream_url: str):
+    """Mở stream, đọc đúng một frame rồi đóng (chạy trong thread)"""
+    cap = cv2.VideoCapture(stream_url)
+    try:
+        if not cap.isOpened():
+            return None
+        ret, frame = cap.read()
+        return frame if ret else None
+    finally:
+        cap.release()
+
+
+def _start_grab(device_id: str, stream_url: str) -> asyncio.Task:
+    task = _grabs.get(device_id)
+    if task is None:
+        task = asyncio.create_task(asyncio.to_thread(_grab_single_frame, stream_url))
+        _grabs[device_id] = task
+
+        def done(t: asyncio.Task):
+            _grabs.pop(device_id, None)
+            if not t.cancelled() and t.exception() is None and t.result() is not None:
+                _frame_cache[device_id] = (time.time(), t.result())
+
+        task.add_done_callback(done)
+    return task
+
+
+def _fresh(entry) -> bool:
+    return entry is not None and time.time() - entry[0] < settings.SNAPSHOT_TTL_SECONDS
+
+
+class SnapshotService:
+    @staticmethod
+    def _cached(device_id: str, width: int) -> Optional[bytes]:
+        entry = _thumbnail_cache.get((device_id, width))
+        return entry[1] if _fresh(entry) else None
+
+    @staticmethod
+    def _store(device_id: str, width: int, jpeg: bytes):
+        # Bỏ thumbnail hết hạn để cache không phình theo số width client gửi lên
+        for key in [key for key, entry in _thumbnail_cache.items() if not _fresh(entry)]:
+            del _thumbnail_cache[key]
+        _thumbnail_cache[(device_id, width)] = (time.time(), jpeg)
+
+    @staticmethod
+    async def get_snapshot(device_id: str, stream_url: str, width: int, stream=None) -> Optional[bytes]:
+        """
+        Trả về thumbnail JPEG của camera:
+        - Cache (device, width) còn hạn -> dùng luôn
+        - Có CameraStream đang chạy -> lấy frame mới nhất của pipeline
+        - Frame grab gần đây (width khác) còn hạn -> resize lại
+        - Không thì grab một frame ngắn từ streamUrl (không chạy YOLO)
+        """
+        cached = SnapshotService._cached(device_id, width)
+        if cached:
+            return cached
+
+        # Relay mode: get_latest_frame decode JPEG full-res -> ngoài event loop
+        frame = await asyncio.to_thread(stream.get_latest_frame) if stream is not None else None
+        if frame is None:
+            entry = _frame_cache.get(device_id)
+            frame = entry[1] if _fresh(entry) else None
+        if frame is None:
+            try:
+                frame = await asyncio.wait_for(
+                    asyncio.shield(_start_grab(device_id, stream_url)),
+                    timeout=settings.SNAPSHOT_GRAB_TIMEOUT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                frame = None  # Grab vẫn chạy tiếp, request sau dùng lại
+            except Exception as e:
+                print(f"⚠️ Snapshot grab failed for {device_id}: {e}")
+                frame = None
+        if frame is None:
+            return None
+
+        jpeg = await asyncio.to_thread(_encode_thumbnail, frame, width)
+        if jpeg:
+            SnapshotService._store(device_id, width, jpeg)
+        return jpeg
@@ -0,0 +1,227 @@
+"""
+Phân phối frame từ một CameraStream (pipeline chung) tới nhiều người xem.
+
+Mỗi subscriber chỉ giữ frame mới nhất chưa gửi (viewer chậm thì bỏ frame cũ,
+không làm chậm pipeline). AdaptiveController đo thời gian `yield` của
+StreamingResponse (bị chặn khi socket của client đầy) và số frame bị bỏ để
+hạ/nâng mức chất lượng: độ phân giải, JPEG quality, FPS tối đa. Mức 0 dùng
+lại JPEG đã encode sẵn của pipeline; các mức thấp hơn được encode một lần
+cho mỗi (frame, mức) và dùng chung giữa các subscriber.
+"""
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from app.core.metrics import CAMERA_FRAMES_DROPPED
+
+
+@dataclass(frozen=True)
+class QualityLevel:
+    scale: float            # Tỉ lệ độ phân giải so với frame gốc
+    quality: int            # JPEG quality
+    maxFps: Optional[float]  # None = không giới hạn
+
+
+QUALITY_LEVELS = [
+    QualityLevel(1.0, 70, None),   # JPEG chung của pipeline
+    QualityLevel(1.0, 50, None),
+    QualityLevel(0.75, 50, 12),
+    QualityLevel(0.5, 40, 8),
+    QualityLevel(0.5, 30, 4),
+]
+
+ADAPT_WINDOW_SECONDS = 2.0
+DEGRADE_BUSY_RATIO = 0.7    # >70% thời gian bị chặn khi gửi -> client không đọc kịp
+DEGRADE_DROP_RATIO = 0.3
+UPGRADE_BUSY_RATIO = 0.3
+UPGRADE_DROP_RATIO = 0.1
+UPGRADE_STREAK = 2          # Số cửa sổ "tốt" liên tiếp trước khi nâng chất lượng
+
+
+class FrameItem:
+    """Frame đã qua pipeline: luôn có JPEG, ảnh decode chỉ có khi đã decode+detect"""
+
+    __slots__ = ("seq", "ts", "jpeg", "frame")
+
+    def __init__(self, seq: int, ts: float, jpeg: bytes, frame=None):
+        self.seq = seq
+        self.ts = ts
+        self.jpeg = jpeg
+        self.frame = frame  # numpy array (đã vẽ box nếu có detection), None ở relay mode
+
+    def decoded(self):
+        """Ảnh của frame; ở relay mode decode từ JPEG khi có người cần"""
+        if self.frame is None:
+            self.frame = cv2.imdecode(np.frombuffer(self.jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return self.frame
+
+
+def encode_variant(item: FrameItem, level: QualityLevel) -> Optional[bytes]:
+    frame = item.decoded()
+    if frame is None:
+        return None
+    if level.scale < 1.0:
+        height, width = frame.shape[:2]
+        frame = cv2.resize(frame, (int(width * level.scale), int(height * level.scale)), interpolation=cv2.INTER_AREA)
+    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, level.quality])
+    return buffer.tobytes() if ret else None
+
+
+class VariantCache:
+    """Cache JPEG theo mức chất lượng cho frame mới nhất (dùng chung giữa subscribers)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # level index -> (seq, jpeg)
+
+    def get(self, item: FrameItem, level_index: int) -> Optional[bytes]:
+        if level_index == 0:
+            return item.jpeg
+        with self._lock:
+            entry = self._entries.get(level_index)
+            if entry and entry[0] == item.seq:
+                return entry[1]
+        jpeg = encode_variant(item, QUALITY_LEVELS[level_index])
+        if jpeg is not None:
+            with self._lock:
+                self._entries[level_index] = (item.seq, jpeg)
+        return jpeg
+
+
+class AdaptiveController:
+    def __init__(self, level: int = 0, adaptive: bool = True):
+        self.level = level
+        self.adaptive = adaptive
+        self._window_start = time.monotonic()
+        self._send_time = 0.0
+        self._sent = 0
+        self._bytes = 0
+        self._dropped = 0
+        self._good_streak = 0
+        self.lastThroughput = 0.0  # bytes/s trong cửa sổ gần nhất
+        self.lastFps = 0.0
+
+    def record_send(self, nbytes: int, seconds: float):
+        self._send_time += seconds
+        self._sent += 1
+        self._bytes += nbytes
+        self._maybe_adapt()
+
+    def record_drop(self, count: int = 1):
+        self._dropped += count
+
+    def _maybe_adapt(self):
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < ADAPT_WINDOW_SECONDS:
+            return
+
+        busy_ratio = self._send_time / elapsed
+        total = self._sent + self._dropped
+        drop_ratio = self._dropped / total if total else 0.0
+        self.lastThroughput = self._bytes / elapsed
+        self.lastFps = self._sent / elapsed
+
+        if self.adaptive:
+            if busy_ratio > DEGRADE_BUSY_RATIO or drop_ratio > DEGRADE_DROP_RATIO:
+                self._good_streak = 0
+                if self.level < len(QUALITY_LEVELS) - 1:
+                    self.level += 1
+            elif busy_ratio < UPGRADE_BUSY_RATIO and drop_ratio < UPGRADE_DROP_RATIO:
+                self._good_streak += 1
+                if self._good_streak >= UPGRADE_STREAK and self.level > 0:
+                    self.level -= 1
+                    self._good_streak = 0
+            else:
+                self._good_streak = 0
+
+        self._window_start = now
+        self._send_time = 0.0
+        self._sent = 0
+        self._bytes = 0
+        self._dropped = 0
+
+
+class StreamSubscriber:
+    """Một viewer của CameraStream; offer() gọi từ thread pipeline"""
+
+    def __init__(self, device_id: str, loop: asyncio.AbstractEventLoop, adaptive: bool = True, stats=None):
+        self.deviceId = device_id
+        self.stats = stats  # PipelineStats của stream (đếm drop dồn, kể cả viewer đã rời)
+        self.controller = AdaptiveController(adaptive=adaptive)
+        self.framesSent = 0
+        self.framesDropped = 0
+        self.closed = False
+        self._loop = loop
+        self._event = asyncio.Event()
+        self._lock = threading.Lock()
+        self._pending: Optional[FrameItem] = None
+        self._last_sent_at = 0.0
+        self._dropped_metric = CAMERA_FRAMES_DROPPED.labels(device_id, "processedFrameQueue")
+
+    def offer(self, item: FrameItem):
+        with self._lock:
+            if self._pending is not None:
+                self.framesDropped += 1
+                self.controller.record_drop()
+                self._dropped_metric.inc()
+                if self.stats is not None:
+                    self.stats.drop("processedFrameQueue")
+            self._pending = item
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            # Event loop đã đóng
+            self.closed = True
+
+    def close(self):
+        self.closed = True
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            pass
+
+    async def next_frame(self, timeout: float = 1.0) -> Optional[FrameItem]:
+        """Chờ frame tiếp theo cần gửi (đã áp dụng giới hạn FPS của mức hiện tại)"""
+        deadline = time.monotonic() + timeout
+        while not self.closed:
+            with self._lock:
+                item, self._pending = self._pending, None
+                if item is None:
+                    self._event.clear()
+            if item is not None:
+                max_fps = QUALITY_LEVELS[self.controller.level].maxFps
+                if max_fps and time.monotonic() - self._last_sent_at < 1.0 / max_fps:
+                    continue  # Bỏ qua để giữ FPS tối đa của mức này
+                return item
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return None
+        return None
+
+    def record_send(self, nbytes: int, seconds: float):
+        self._last_sent_at = time.monotonic()
+        self.framesSent += 1
+        self.controller.record_send(nbytes, seconds)
+
+    def stats(self) -> dict:
+        level = QUALITY_LEVELS[self.controller.level]
+        return {
+            "level": self.controller.level,
+            "scale": level.scale,
+            "jpegQuality": level.quality,
+            "maxFps": level.maxFps,
+            "deliveredFps": round(self.controller.lastFps, 2),
+            "throughputBytesPerSec": round(self.controller.lastThroughput),
+            "framesSent": self.framesSent,
+            "framesDropped": self.framesDropped,
+        }
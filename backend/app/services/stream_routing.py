@@ -0,0 +1,115 @@
+"""
+Định tuyến camera stream khi chạy nhiều instance.
+
+Pipeline của một camera chỉ nên chạy ở một instance (chủ sở hữu, giữ lease
+`stream-owner:{deviceId}`). Instance khác:
+- có INSTANCE_URL của chủ -> chuyển hướng viewer tới đó,
+- đọc health/stats/occupancy từ bản snapshot chủ ghi vào trạng thái chung,
+- lệnh CAMERA_MODE / cập nhật ROI được broadcast, instance nào có stream thì áp dụng.
+
+Nếu không chuyển hướng được (các worker cùng port), instance vẫn mở pipeline
+riêng để phục vụ viewer nhưng không phát sự kiện vào/ra (automation, activity
+log) khi biết chắc instance khác giữ lease, để không bị trùng. Coordinator lỗi
+(không biết ai là chủ) thì vẫn phát tại chỗ: trùng còn hơn mất sự kiện.
+"""
+from typing import Optional, Set
+
+from app.core.config import settings
+from app.core.coordination import get_coordinator
+
+CONTROL_CHANNEL = "camera-control"
+
+# Device id mà instance này đang giữ lease (đọc từ thread camera)
+_owned: Set[str] = set()
+# Device id mà instance khác đang giữ lease (claim gần nhất trả về False)
+_foreign: Set[str] = set()
+
+
+def _owner_key(device_id: str) -> str:
+    return f"stream-owner:{device_id}"
+
+
+def _status_key(device_id: str) -> str:
+    return f"stream-status:{device_id}"
+
+
+def is_owner(device_id: str) -> bool:
+    return device_id in _owned
+
+
+def owned_elsewhere(device_id: str) -> bool:
+    """True chỉ khi biết chắc instance khác giữ lease (đọc từ thread camera)"""
+    return device_id in _foreign
+
+
+async def claim(device_id: str) -> bool:
+    """Lấy/gia hạn quyền sở hữu pipeline camera; gọi định kỳ khi stream còn chạy"""
+    try:
+        owned = await get_coordinator().acquire_lease(_owner_key(device_id), settings.STREAM_OWNER_LEASE_SECONDS)
+    except Exception:
+        # Không biết ai là chủ sở hữu
+        _owned.discard(device_id)
+        _foreign.discard(device_id)
+        raise
+    if owned:
+        _owned.add(device_id)
+        _foreign.discard(device_id)
+    else:
+        _owned.discard(device_id)
+        _foreign.add(device_id)
+    return owned
+
+
+async def release(device_id: str):
+    _foreign.discard(device_id)
+    if device_id in _owned:
+        _owned.discard(device_id)
+        coordinator = get_coordinator()
+        await coordinator.release_lease(_owner_key(device_id))
+        await coordinator.delete(_status_key(device_id))
+
+
+async def release_all():
+    """Khi tắt instance: trả mọi lease để instance khác nhận camera ngay"""
+    for device_id in list(_owned):
+        await release(device_id)
+
+
+async def remote_owner_url(device_id: str) -> Optional[str]:
+    """URL của instance khác đang chạy pipeline (None nếu là chính nó, chưa ai chạy, hoặc không có URL)"""
+    coordinator = get_coordinator()
+    owner = await coordinator.lease_owner(_owner_key(device_id))
+    if owner is None or coordinator.is_self(owner):
+        return None
+    return owner.get("url")
+
+
+async def publish_status(device_id: str, stream):
+    """Chủ sở hữu ghi snapshot trạng thái để instance khác trả lời các API đọc"""
+    await get_coordinator().set(
+        _status_key(device_id),
+        {"health": stream.get_health(), "stats": stream.get_stats(), "occupancy": stream.get_occupancy()},
+        ttl=settings.STREAM_OWNER_LEASE_SECONDS,
+    )
+
+
+async def get_status(device_id: str, section: str) -> Optional[dict]:
+    """health / stats / occupancy của pipeline ở instance khác (None nếu không có)"""
+    status = await get_coordinator().get(_status_key(device_id))
+    return status.get(section) if status else None
+
+
+async def send_control(device_id: str, **changes):
+    """Broadcast thay đổi (humanDetectionEnabled, detectionRegions) tới instance đang chạy stream"""
+    await get_coordinator().publish(CONTROL_CHANNEL, {"deviceId": device_id, **changes})
+
+
+async def handle_control(message: dict):
+    from app.api.endpoints.device import active_camera_streams
+    stream = active_camera_streams.get(message["deviceId"])
+    if stream is None:
+        return
+    if "humanDetectionEnabled" in message:
+        stream.set_detection_mode(message["humanDetectionEnabled"])
+    if "detectionRegions" in message:
+        stream.set_detection_regions(message["detectionRegions"])
@@ -0,0 +1,55 @@
+"""
+Số liệu runtime của một pipeline camera, chỉ giữ trong RAM (không ghi MongoDB).
+
+Mỗi loại thời gian (decode, inference, encode, glassToClient) giữ một cửa sổ
+các mẫu gần nhất để tính p50/p95; drop được đếm dồn theo từng hàng đợi.
+"""
+import threading
+from collections import deque
+from typing import Dict
+
+WINDOW_SAMPLES = 300
+
+
+def _summary(samples) -> dict:
+    if not samples:
+        return {"count": 0, "p50": None, "p95": None, "max": None}
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return {
+        "count": len(ordered),
+        "p50": round(ordered[int(round(0.50 * last))] * 1000, 2),
+        "p95": round(ordered[int(round(0.95 * last))] * 1000, 2),
+        "max": round(ordered[last] * 1000, 2),
+    }
+
+
+class PipelineStats:
+    def __init__(self, window: int = WINDOW_SAMPLES):
+        self._lock = threading.Lock()
+        self._window = window
+        self._timings: Dict[str, deque] = {}
+        self._drops: Dict[str, int] = {}
+        self.captureFps = 0.0
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            samples = self._timings.get(name)
+            if samples is None:
+                samples = self._timings[name] = deque(maxlen=self._window)
+            samples.append(seconds)
+
+    def drop(self, queue_name: str, count: int = 1):
+        with self._lock:
+            self._drops[queue_name] = self._drops.get(queue_name, 0) + count
+
+    def snapshot(self) -> dict:
+        """timingsMs: p50/p95/max (ms) trên WINDOW_SAMPLES mẫu gần nhất; drops: tổng từ khi stream chạy"""
+        with self._lock:
+            timings = {name: list(samples) for name, samples in self._timings.items()}
+            drops = dict(self._drops)
+        return {
+            "captureFps": round(self.captureFps, 2),
+            "timingsMs": {name: _summary(samples) for name, samples in timings.items()},
+            "drops": drops,
+        }
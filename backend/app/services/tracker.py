@@ -0,0 +1,203 @@
+"""
+Tracker người nhẹ (kiểu SORT) cho CameraStream.
+
+Mỗi track có một Kalman filter vận tốc không đổi trên (cx, cy, w, h), ghép
+với detection mới bằng IoU (greedy). Nhờ đó:
+- Frame không chạy inference (DETECTOR_INFERENCE_INTERVAL > 1) vẫn có box,
+  nội suy bằng bước predict theo thời gian thực.
+- Box không nhấp nháy khi detector bỏ sót một vài frame.
+- Mỗi người có track id riêng: sự kiện "vào" phát ra một lần khi track được
+  xác nhận (đủ min_hits), sự kiện "ra" khi track mất quá max_age giây.
+"""
+import threading
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+from app.services.detector import Detection
+
+
+def iou(a, b) -> float:
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    if inter <= 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return inter / (area_a + area_b - inter)
+
+
+class KalmanBoxFilter:
+    """State [cx, cy, w, h, vx, vy, vw, vh], đo [cx, cy, w, h]; dt theo giây"""
+
+    _H = np.hstack([np.eye(4), np.zeros((4, 4))])
+
+    def __init__(self, box, ts: float):
+        x1, y1, x2, y2 = box
+        self.x = np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1, 0, 0, 0, 0], dtype=float)
+        # Chưa biết vận tốc -> phương sai lớn
+        self.P = np.diag([10.0, 10.0, 10.0, 10.0, 1e4, 1e4, 1e4, 1e4])
+        self.R = np.diag([4.0, 4.0, 16.0, 16.0])
+        self.ts = ts
+
+    def predict(self, ts: float):
+        dt = ts - self.ts
+        if dt <= 0:
+            return
+        F = np.eye(8)
+        F[:4, 4:] = np.eye(4) * dt
+        q = np.array([1.0, 1.0, 1.0, 1.0, 50.0, 50.0, 25.0, 25.0]) * dt
+        self.x = F @ self.x
+        self.x[2] = max(self.x[2], 1.0)
+        self.x[3] = max(self.x[3], 1.0)
+        self.P = F @ self.P @ F.T + np.diag(q)
+        self.ts = ts
+
+    def update(self, box):
+        x1, y1, x2, y2 = box
+        z = np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], dtype=float)
+        H = self._H
+        S = H @ self.P @ H.T + self.R
+        K = self.P @ H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ (z - H @ self.x)
+        self.P = (np.eye(8) - K @ H) @ self.P
+
+    def box(self):
+        cx, cy, w, h = self.x[:4]
+        return (cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2)
+
+
+class Track:
+    def __init__(self, detection: Detection, ts: float):
+        self.id: Optional[int] = None  # Gán khi được xác nhận
+        self.filter = KalmanBoxFilter(detection[:4], ts)
+        self.hits = 1
+        self.score = detection.score
+        self.firstSeen = ts
+        self.lastSeen = ts
+
+    @property
+    def confirmed(self) -> bool:
+        return self.id is not None
+
+    def box(self):
+        return self.filter.box()
+
+    def int_box(self):
+        return tuple(int(v) for v in self.box())
+
+    def to_dict(self) -> dict:
+        x1, y1, x2, y2 = self.int_box()
+        return {
+            "id": self.id,
+            "box": [x1, y1, x2, y2],
+            "score": round(self.score, 3),
+            "firstSeen": self.firstSeen,
+            "lastSeen": self.lastSeen,
+        }
+
+
+class TrackerUpdate(NamedTuple):
+    tracks: List[Track]    # Track đã xác nhận (để vẽ / tính occupancy)
+    entered: List[Track]   # Vừa được xác nhận ở lần update này
+    exited: List[Track]    # Vừa bị loại (mất quá max_age)
+
+
+class PersonTracker:
+    def __init__(self, iou_threshold: float = 0.3, min_hits: int = 2, max_age: float = 2.0):
+        self.iouThreshold = iou_threshold
+        self.minHits = min_hits
+        self.maxAge = max_age
+        self._lock = threading.Lock()  # stats() được đọc từ event loop
+        self._tracks: List[Track] = []
+        self._nextId = 1
+        self.entries = 0
+        self.exits = 0
+
+    def _expire(self, ts: float, inference: bool) -> List[Track]:
+        """Loại track quá hạn; trả về các track vừa 'ra'"""
+        exited = []
+        alive = []
+        for track in self._tracks:
+            if not track.confirmed:
+                # Track chưa xác nhận bị bỏ ngay khi detector không thấy lại (thường là false positive)
+                if inference and track.lastSeen < ts:
+                    continue
+            elif ts - track.lastSeen > self.maxAge:
+                exited.append(track)
+                self.exits += 1
+                continue
+            alive.append(track)
+        self._tracks = alive
+        return exited
+
+    def predict(self, ts: float) -> TrackerUpdate:
+        """Frame không chạy inference: chỉ nội suy box"""
+        with self._lock:
+            for track in self._tracks:
+                track.filter.predict(ts)
+            exited = self._expire(ts, inference=False)
+            return TrackerUpdate([t for t in self._tracks if t.confirmed], [], exited)
+
+    def update(self, detections: List[Detection], ts: float) -> TrackerUpdate:
+        """Frame có kết quả detector"""
+        with self._lock:
+            for track in self._tracks:
+                track.filter.predict(ts)
+
+            # Ghép greedy theo IoU giảm dần
+            pairs = []
+            for ti, track in enumerate(self._tracks):
+                predicted = track.box()
+                for di, det in enumerate(detections):
+                    overlap = iou(predicted, det[:4])
+                    if overlap >= self.iouThreshold:
+                        pairs.append((overlap, ti, di))
+            pairs.sort(reverse=True)
+
+            matched_tracks, matched_dets = set(), set()
+            entered = []
+            for _, ti, di in pairs:
+                if ti in matched_tracks or di in matched_dets:
+                    continue
+                matched_tracks.add(ti)
+                matched_dets.add(di)
+                track, det = self._tracks[ti], detections[di]
+                track.filter.update(det[:4])
+                track.hits += 1
+                track.score = det.score
+                track.lastSeen = ts
+                if not track.confirmed and track.hits >= self.minHits:
+                    track.id = self._nextId
+                    self._nextId += 1
+                    self.entries += 1
+                    entered.append(track)
+
+            for di, det in enumerate(detections):
+                if di not in matched_dets:
+                    track = Track(det, ts)
+                    if self.minHits <= 1:
+                        track.id = self._nextId
+                        self._nextId += 1
+                        self.entries += 1
+                        entered.append(track)
+                    self._tracks.append(track)
+
+            exited = self._expire(ts, inference=True)
+            return TrackerUpdate([t for t in self._tracks if t.confirmed], entered, exited)
+
+    def reset(self):
+        """Bỏ toàn bộ track (khi tắt detection), không phát sự kiện 'ra'"""
+        with self._lock:
+            self._tracks = []
+
+    def stats(self) -> dict:
+        with self._lock:
+            tracks = [t.to_dict() for t in self._tracks if t.confirmed]
+            return {
+                "occupancy": len(tracks),
+                "entries": self.entries,
+                "exits": self.exits,
+                "tracks": tracks,
+            }
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Detector Benchmark
+So sánh latency mỗi frame và bộ nhớ của các backend detector người
+(torch / onnx / onnx INT8 / openvino) trên cùng một tập frame.
+
+Mỗi backend chạy trong một process riêng để số liệu RSS không lẫn nhau
+(torch và onnxruntime đều giữ bộ nhớ sau khi load).
+
+Chạy từ thư mục backend (cần .env như khi chạy server):
+    # Export yolo11s.pt -> yolo11s.onnx, yolo11s-int8.onnx (calibrate bằng frames), openvino
+    python benchmarks/detector_bench.py --export --frames samples/ --openvino
+
+    python benchmarks/detector_bench.py --frames samples/ --count 200 \\
+        --backends torch,onnx,onnx=yolo11s-int8.onnx,openvino --threads 4
+
+--frames nhận thư mục ảnh, file video / URL camera, hoặc bỏ trống để dùng
+frame tổng hợp (chỉ đo tốc độ, không có người trong ảnh).
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import resource
+import sys
+import tempfile
+import time
+from queue import Empty
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def memory_mb() -> dict:
+    """RSS hiện tại và đỉnh (MB) của process"""
+    result = {"rssMb": None, "peakRssMb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    result["rssMb"] = int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"):
+                    result["peakRssMb"] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return result
+
+
+def load_frames(source: Optional[str], count: int, width: int, height: int) -> List[np.ndarray]:
+    if not source:
+        rng = np.random.default_rng(0)
+        return [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(count)]
+
+    frames = []
+    if os.path.isdir(source):
+        names = sorted(n for n in os.listdir(source) if n.lower().endswith((".jpg", ".jpeg", ".png")))
+        for name in names:
+            frame = cv2.imread(os.path.join(source, name))
+            if frame is not None:
+                frames.append(frame)
+    else:
+        cap = cv2.VideoCapture(source)
+        while len(frames) < count:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+    if not frames:
+        raise SystemExit(f"No frames loaded from {source}")
+    # Lặp lại cho đủ count (thư mục ít ảnh)
+    return [frames[i % len(frames)] for i in range(count)]
+
+
+def parse_backend(spec: str):
+    """'onnx=path/to/model.onnx' -> ('onnx', 'path/to/model.onnx')"""
+    backend, _, model_path = spec.partition("=")
+    return backend.strip(), (model_path.strip() or None)
+
+
+def run_backend(spec: str, frames_path: str, warmup: int, threads: int, input_size: int, queue):
+    from app.services.detector import OnnxDetector, OpenVinoDetector, UltralyticsDetector, _DEFAULT_MODEL_PATHS
+
+    backend, model_path = parse_backend(spec)
+    model_path = model_path or _DEFAULT_MODEL_PATHS.get(backend)
+    with np.load(frames_path) as data:
+        frames = [data[f"arr_{i}"] for i in range(len(data.files))]
+    before = memory_mb()
+
+    load_start = time.perf_counter()
+    if backend == "torch":
+        detector = UltralyticsDetector(model_path)
+    elif backend == "onnx":
+        detector = OnnxDetector(model_path, threads=threads, input_size=input_size)
+    elif backend == "openvino":
+        detector = OpenVinoDetector(model_path, threads=threads, input_size=input_size)
+    else:
+        raise ValueError(f"Unknown backend: {backend}")
+    load_seconds = time.perf_counter() - load_start
+    loaded = memory_mb()
+
+    for frame in frames[:warmup]:
+        detector.detect(frame)
+
+    latencies = []
+    detections = 0
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for frame in frames:
+        start = time.perf_counter()
+        detections += len(detector.detect(frame))
+        latencies.append((time.perf_counter() - start) * 1000)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    after = memory_mb()
+
+    queue.put({
+        "backend": spec,
+        "model": model_path,
+        "frames": len(frames),
+        "loadSeconds": round(load_seconds, 2),
+        "latencyMs": {
+            "mean": round(sum(latencies) / len(latencies), 2),
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+        },
+        "fps": round(len(frames) / wall, 1),
+        "cpuCoresUsed": round(cpu / wall, 2),
+        "detections": detections,
+        "memoryMb": {
+            "baseline": before["rssMb"],
+            "afterLoad": loaded["rssMb"],
+            "afterRun": after["rssMb"],
+            "peak": after["peakRssMb"],
+        },
+    })
+
+
+def export_models(model: str, frames: List[np.ndarray], input_size: int, openvino: bool):
+    """Export .pt sang ONNX, quantize INT8 (static, calibrate bằng frames) và OpenVINO"""
+    from ultralytics import YOLO
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    from app.services.detector import _ExportedYoloDetector
+
+    onnx_path = YOLO(model).export(format="onnx", imgsz=input_size, dynamic=False, simplify=True)
+    print(f"✅ ONNX: {onnx_path}")
+
+    preprocess = _ExportedYoloDetector(input_size=input_size)
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self, input_name: str):
+            self._inputs = iter({input_name: preprocess._preprocess(f)[0]} for f in frames[:100])
+
+        def get_next(self):
+            return next(self._inputs, None)
+
+    import onnx
+    input_name = onnx.load(onnx_path).graph.input[0].name
+    int8_path = onnx_path.replace(".onnx", "-int8.onnx")
+    quantize_static(
+        onnx_path, int8_path, FrameReader(input_name),
+        quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+    print(f"✅ ONNX INT8: {int8_path}")
+
+    if openvino:
+        openvino_path = YOLO(model).export(format="openvino", imgsz=input_size)
+        print(f"✅ OpenVINO: {openvino_path}")
+
+
+def print_report(results: List[dict]):
+    print("\n" + "=" * 96)
+    print(f"{'backend':<32}{'p50 ms':>9}{'p95 ms':>9}{'fps':>8}{'cores':>7}{'load MB':>10}{'peak MB':>10}{'dets':>7}")
+    print("-" * 96)
+    for r in results:
+        if "error" in r:
+            print(f"{r['backend']:<32}  ERROR: {r['error']}")
+            continue
+        mem = r["memoryMb"]
+        load_mb = (mem["afterLoad"] or 0) - (mem["baseline"] or 0)
+        print(
+            f"{r['backend']:<32}{r['latencyMs']['p50']:>9}{r['latencyMs']['p95']:>9}{r['fps']:>8}"
+            f"{r['cpuCoresUsed']:>7}{load_mb:>10.0f}{mem['peak']:>10.0f}{r['detections']:>7}"
+        )
+    print("=" * 96)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark person detector backends")
+    parser.add_argument("--frames", help="Thư mục ảnh, file video hoặc URL camera (trống = frame tổng hợp)")
+    parser.add_argument("--count", type=int, default=100, help="Số frame đo")
+    parser.add_argument("--width", type=int, default=640, help="Kích thước frame tổng hợp")
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--backends", default="torch,onnx", help="Danh sách backend[=model], cách nhau bởi dấu phẩy")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=0, help="Số thread CPU cho onnx/openvino (0 = mặc định)")
+    parser.add_argument("--input-size", type=int, default=640)
+    parser.add_argument("--export", action="store_true", help="Export model trước khi đo")
+    parser.add_argument("--model", default="yolo11s.pt", help="Model .pt để export")
+    parser.add_argument("--openvino", action="store_true", help="Export thêm bản OpenVINO")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    frames = load_frames(args.frames, args.count, args.width, args.height)
+    if args.export:
+        export_models(args.model, frames, args.input_size, args.openvino)
+
+    ctx = mp.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        frames_path = os.path.join(tmp, "frames.npz")
+        np.savez(frames_path, *frames)  # Ảnh trong thư mục có thể khác kích thước
+        for spec in [s for s in args.backends.split(",") if s.strip()]:
+            print(f"⏱️  {spec} ...")
+            queue = ctx.Queue()
+            proc = ctx.Process(
+                target=run_backend, args=(spec, frames_path, args.warmup, args.threads, args.input_size, queue)
+            )
+            proc.start()
+            proc.join()
+            try:
+                results.append(queue.get(timeout=1))
+            except Empty:
+                results.append({"backend": spec, "error": f"process exited with code {proc.exitcode}"})
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"📄 Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+Load Testing Harness
+Giả lập hàng nghìn thiết bị ESP32 publish device/new và device/data/{mac}
+lên mosquitto local, cùng với các dashboard client poll REST API và mở
+camera stream từ một nguồn MJPEG tổng hợp.
+
+Báo cáo:
+- Throughput MQTT (msg/s) thực tế đã publish
+- Độ trễ end-to-end: publish -> giá trị xuất hiện qua API (probe devices)
+- Latency REST (p50/p95/p99) của dashboard clients
+- FPS và time-to-first-frame của camera stream clients
+
+Ví dụ:
+    python benchmarks/load_test.py --devices 2000 --rate 0.5 --duration 60 \\
+        --dashboards 20 --username admin1 --password admin1 \\
+        --cameras 2 --stream-clients 4
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import paho.mqtt.client as mqtt
+
+SIM_BSSID = "LT:00:00:00:00:01"      # Thiết bị tải chính
+PROBE_BSSID = "LT:00:00:00:00:02"    # Thiết bị đo độ trễ end-to-end
+CAMERA_BSSID = "LT:00:00:00:00:03"   # Camera tổng hợp
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def fake_mac(prefix: int, index: int) -> str:
+    return "{:02X}:{:02X}:{:02X}:{:02X}:{:02X}:{:02X}".format(
+        0x02, prefix, (index >> 24) & 0xFF, (index >> 16) & 0xFF, (index >> 8) & 0xFF, index & 0xFF
+    )
+
+
+class Stats:
+    """Thu thập số liệu từ nhiều thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = {}
+        self.counters: Dict[str, int] = {}
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            self.samples.setdefault(name, []).append(value)
+
+    def inc(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self) -> dict:
+        with self._lock:
+            result = {"counters": dict(self.counters), "latency": {}}
+            for name, values in self.samples.items():
+                result["latency"][name] = {
+                    "count": len(values),
+                    "p50": percentile(values, 50),
+                    "p95": percentile(values, 95),
+                    "p99": percentile(values, 99),
+                    "max": max(values),
+                }
+            return result
+
+
+# === MQTT device simulation ===
+
+def device_registration(mac: str, bssid: str, device_type: str, name: str, stream_url: Optional[str] = None) -> str:
+    payload = {
+        "type": device_type,
+        "name": name,
+        "bssid": bssid,
+        "controllerMAC": mac,
+        "state": "online",
+    }
+    if stream_url:
+        payload["streamUrl"] = stream_url
+    return json.dumps(payload)
+
+
+class DevicePublisher(threading.Thread):
+    """Một kết nối MQTT publish thay cho nhiều thiết bị (giống topic ESP32 thật)"""
+
+    def __init__(self, index: int, macs: List[str], args, stats: Stats, stop_event: threading.Event):
+        super().__init__(name=f"publisher-{index}", daemon=True)
+        self.macs = macs
+        self.args = args
+        self.stats = stats
+        self.stop_event = stop_event
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"loadtest-{index}-{random.randint(0, 1 << 30)}")
+
+    def run(self):
+        self.client.connect(self.args.broker, self.args.port, 60)
+        self.client.loop_start()
+        try:
+            for mac in self.macs:
+                self.client.publish("device/new", device_registration(mac, SIM_BSSID, "SENSOR", "LoadTest Sensor"))
+                self.stats.inc("mqtt_registrations")
+                if self.stop_event.is_set():
+                    return
+
+            if not self.macs or self.args.rate <= 0:
+                self.stop_event.wait()
+                return
+
+            # Tổng tốc độ của kết nối này = số thiết bị * rate mỗi thiết bị
+            interval = 1.0 / (len(self.macs) * self.args.rate)
+            next_send = time.perf_counter()
+            i = 0
+            while not self.stop_event.is_set():
+                mac = self.macs[i % len(self.macs)]
+                payload = json.dumps({
+                    "temperature": round(random.uniform(20, 35), 2),
+                    "humidity": round(random.uniform(40, 80), 2),
+                    "uptime": int(time.time()),
+                    "rssi": -random.randint(40, 80),
+                })
+                self.client.publish(f"device/data/{mac}", payload, qos=self.args.qos)
+                self.stats.inc("mqtt_published")
+                i += 1
+                next_send += interval
+                delay = next_send - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -1.0:
+                    # Không theo kịp tốc độ yêu cầu: reset lịch để tránh burst
+                    self.stats.inc("mqtt_publisher_lag")
+                    next_send = time.perf_counter()
+        finally:
+            self.client.loop_stop()
+            self.client.disconnect()
+
+
+class LatencyProbe(threading.Thread):
+    """
+    Publish một giá trị nhiệt độ duy nhất cho probe device rồi poll
+    GET /devices/lan?bssid=PROBE_BSSID đến khi giá trị xuất hiện.
+    """
+
+    def __init__(self, args, stats: Stats, stop_event: threading.Event):
+        super().__init__(name="latency-probe", daemon=True)
+        self.args = args
+        self.stats = stats
+        self.stop_event = stop_event
+        self.macs = [fake_mac(0xEE, i) for i in range(args.probes)]
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"loadtest-probe-{random.randint(0, 1 << 30)}")
+        self.seq = 0
+
+    def _lan_devices(self) -> Dict[str, dict]:
+        url = f"{self.args.api}/devices/lan?bssid={urllib.parse.quote(PROBE_BSSID)}"
+        with urllib.request.urlopen(url, timeout=10) as resp:
+            return {d["controllerMAC"]: d for d in json.loads(resp.read())}
+
+    def run(self):
+        self.client.connect(self.args.broker, self.args.port, 60)
+        self.client.loop_start()
+        try:
+            for mac in self.macs:
+                self.client.publish("device/new", device_registration(mac, PROBE_BSSID, "SENSOR", "LoadTest Probe"), qos=1)
+            time.sleep(2)  # Chờ backend tạo device
+
+            while not self.stop_event.is_set():
+                mac = random.choice(self.macs)
+                self.seq += 1
+                marker = round(1000 + self.seq / 1000, 3)  # Giá trị không trùng với dữ liệu thường
+                start = time.perf_counter()
+                self.client.publish(f"device/data/{mac}", json.dumps({"temperature": marker}), qos=1)
+                self.stats.inc("probe_sent")
+
+                deadline = start + self.args.probe_timeout
+                while time.perf_counter() < deadline and not self.stop_event.is_set():
+                    try:
+                        device = self._lan_devices().get(mac)
+                    except (urllib.error.URLError, OSError, ValueError):
+                        device = None
+                    if device and device.get("temperature") == marker:
+                        self.stats.observe("e2e_publish_to_api", time.perf_counter() - start)
+                        break
+                    time.sleep(self.args.probe_poll)
+                else:
+                    if not self.stop_event.is_set():
+                        self.stats.inc("probe_timeout")
+                self.stop_event.wait(self.args.probe_interval)
+        finally:
+            self.client.loop_stop()
+            self.client.disconnect()
+
+
+# === REST dashboard simulation ===
+
+def login(api: str, username: str, password: str) -> str:
+    body = json.dumps({"username": username, "password": password}).encode()
+    req = urllib.request.Request(f"{api}/login", data=body, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        return json.loads(resp.read())["access_token"]
+
+
+class DashboardClient(threading.Thread):
+    """Poll homes -> rooms -> devices giống trang Dashboard của web"""
+
+    def __init__(self, index: int, token: str, args, stats: Stats, stop_event: threading.Event):
+        super().__init__(name=f"dashboard-{index}", daemon=True)
+        self.token = token
+        self.args = args
+        self.stats = stats
+        self.stop_event = stop_event
+
+    def _get(self, path: str, label: str):
+        req = urllib.request.Request(f"{self.args.api}{path}", headers={"Authorization": f"Bearer {self.token}"})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=30) as resp:
+                data = json.loads(resp.read())
+            self.stats.observe(f"rest {label}", time.perf_counter() - start)
+            self.stats.inc("rest_ok")
+            return data
+        except (urllib.error.URLError, OSError, ValueError):
+            self.stats.inc("rest_errors")
+            return []
+
+    def run(self):
+        # Lệch pha để các client không poll cùng lúc
+        self.stop_event.wait(random.uniform(0, self.args.poll_interval))
+        while not self.stop_event.is_set():
+            for home in self._get("/homes/", "GET /homes"):
+                for room in self._get(f"/rooms/?homeId={home['id']}", "GET /rooms"):
+                    self._get(f"/devices/?roomId={room['id']}", "GET /devices")
+            self.stop_event.wait(self.args.poll_interval)
+
+
+# === Synthetic MJPEG source + stream clients ===
+
+def make_jpeg_frames(count: int, width: int, height: int) -> List[bytes]:
+    import cv2
+    import numpy as np
+
+    frames = []
+    for i in range(count):
+        img = np.full((height, width, 3), (i * 7) % 255, dtype=np.uint8)
+        cv2.putText(img, f"LOADTEST {i}", (20, height // 2), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 2)
+        ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        if ok:
+            frames.append(buf.tobytes())
+    return frames
+
+
+def start_mjpeg_server(host: str, port: int, fps: float, frames: List[bytes], stop_event: threading.Event) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+            self.end_headers()
+            i = 0
+            try:
+                while not stop_event.is_set():
+                    frame = frames[i % len(frames)]
+                    self.wfile.write(
+                        b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: "
+                        + str(len(frame)).encode() + b"\r\n\r\n" + frame + b"\r\n"
+                    )
+                    i += 1
+                    time.sleep(1.0 / fps)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mjpeg-source", daemon=True).start()
+    return server
+
+
+class StreamClient(threading.Thread):
+    """Mở /devices/camera-stream và đếm số frame nhận được"""
+
+    def __init__(self, index: int, device_id: str, token: str, args, stats: Stats, stop_event: threading.Event):
+        super().__init__(name=f"stream-client-{index}", daemon=True)
+        self.device_id = device_id
+        self.token = token
+        self.args = args
+        self.stats = stats
+        self.stop_event = stop_event
+
+    def run(self):
+        url = f"{self.args.api}/devices/camera-stream?device_id={self.device_id}&token={self.token}"
+        start = time.perf_counter()
+        frames = 0
+        first_frame_at = None
+        try:
+            with urllib.request.urlopen(url, timeout=30) as resp:
+                while not self.stop_event.is_set():
+                    line = resp.readline()
+                    if not line:
+                        break
+                    if line.startswith(b"--frame"):
+                        frames += 1
+                        if first_frame_at is None:
+                            first_frame_at = time.perf_counter()
+                            self.stats.observe("stream time_to_first_frame", first_frame_at - start)
+        except (urllib.error.URLError, OSError):
+            self.stats.inc("stream_errors")
+        if first_frame_at is not None and frames > 1:
+            self.stats.observe("stream fps", (frames - 1) / max(time.perf_counter() - first_frame_at, 1e-6))
+        self.stats.inc("stream_frames", frames)
+
+
+def register_cameras(args, stop_event: threading.Event) -> List[str]:
+    """Đăng ký camera tổng hợp qua MQTT, trả về danh sách device id từ API"""
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"loadtest-cam-{random.randint(0, 1 << 30)}")
+    client.connect(args.broker, args.port, 60)
+    client.loop_start()
+    for i in range(args.cameras):
+        stream_url = f"http://{args.mjpeg_public_host}:{args.mjpeg_port}/stream/{i}"
+        client.publish("device/new", device_registration(fake_mac(0xCA, i), CAMERA_BSSID, "CAMERA", f"LoadTest Camera {i}", stream_url), qos=1)
+    time.sleep(2)
+    client.loop_stop()
+    client.disconnect()
+
+    url = f"{args.api}/devices/lan?bssid={urllib.parse.quote(CAMERA_BSSID)}"
+    with urllib.request.urlopen(url, timeout=10) as resp:
+        return [d["id"] for d in json.loads(resp.read())]
+
+
+def print_report(summary: dict, elapsed: float):
+    counters = summary["counters"]
+    print("\n" + "=" * 60)
+    print("📊 LOAD TEST REPORT")
+    print("=" * 60)
+    print(f"Duration            : {elapsed:.1f}s")
+    published = counters.get("mqtt_published", 0)
+    print(f"MQTT published      : {published} ({published / max(elapsed, 1e-6):.1f} msg/s)")
+    for key in sorted(counters):
+        if key != "mqtt_published":
+            print(f"{key:<20}: {counters[key]}")
+    print("-" * 60)
+    print(f"{'metric':<32}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for name, s in sorted(summary["latency"].items()):
+        unit = 1 if name == "stream fps" else 1000  # fps giữ nguyên, còn lại ms
+        print(f"{name:<32}{s['count']:>7}" + "".join(f"{s[k] * unit:>9.1f}" for k in ("p50", "p95", "p99", "max")))
+    print("(latency in ms, stream fps in frames/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SmartHome backend load generator")
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--api", default="http://localhost:8000/api/v1")
+    parser.add_argument("--devices", type=int, default=1000, help="Số thiết bị giả lập")
+    parser.add_argument("--rate", type=float, default=0.5, help="Message/giây cho mỗi thiết bị")
+    parser.add_argument("--connections", type=int, default=8, help="Số kết nối MQTT chia nhau các thiết bị")
+    parser.add_argument("--qos", type=int, default=0, choices=[0, 1])
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--probes", type=int, default=3, help="Số thiết bị đo độ trễ end-to-end")
+    parser.add_argument("--probe-interval", type=float, default=1.0)
+    parser.add_argument("--probe-poll", type=float, default=0.05)
+    parser.add_argument("--probe-timeout", type=float, default=10.0)
+    parser.add_argument("--dashboards", type=int, default=0, help="Số dashboard client poll REST")
+    parser.add_argument("--poll-interval", type=float, default=2.0)
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    parser.add_argument("--cameras", type=int, default=0, help="Số camera tổng hợp (MJPEG)")
+    parser.add_argument("--stream-clients", type=int, default=0)
+    parser.add_argument("--mjpeg-port", type=int, default=8090)
+    parser.add_argument("--mjpeg-public-host", default="127.0.0.1", help="Host mà backend dùng để đọc nguồn MJPEG")
+    parser.add_argument("--camera-fps", type=float, default=15)
+    parser.add_argument("--json", dest="json_out", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    if (args.dashboards or args.stream_clients) and not (args.username and args.password):
+        parser.error("--username/--password are required for dashboards and stream clients")
+
+    stats = Stats()
+    stop_event = threading.Event()
+    workers: List[threading.Thread] = []
+
+    macs = [fake_mac(0x10, i) for i in range(args.devices)]
+    connections = max(1, min(args.connections, len(macs) or 1))
+    for c in range(connections):
+        workers.append(DevicePublisher(c, macs[c::connections], args, stats, stop_event))
+    if args.probes > 0:
+        workers.append(LatencyProbe(args, stats, stop_event))
+
+    token = None
+    if args.dashboards or args.stream_clients:
+        token = login(args.api, args.username, args.password)
+    for i in range(args.dashboards):
+        workers.append(DashboardClient(i, token, args, stats, stop_event))
+
+    mjpeg_server = None
+    if args.cameras > 0:
+        mjpeg_server = start_mjpeg_server("0.0.0.0", args.mjpeg_port, args.camera_fps, make_jpeg_frames(30, 640, 480), stop_event)
+        camera_ids = register_cameras(args, stop_event)
+        if camera_ids:
+            for i in range(args.stream_clients):
+                workers.append(StreamClient(i, camera_ids[i % len(camera_ids)], token, args, stats, stop_event))
+        else:
+            print("⚠️ No synthetic cameras visible through the API, skipping stream clients")
+
+    print(f"🚀 Running load test for {args.duration:.0f}s: {args.devices} devices @ {args.rate} msg/s, "
+          f"{args.dashboards} dashboards, {args.stream_clients} stream clients")
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    try:
+        time.sleep(args.duration)
+    except KeyboardInterrupt:
+        print("Interrupted, collecting results...")
+    stop_event.set()
+    for worker in workers:
+        worker.join(timeout=5)
+    elapsed = time.perf_counter() - started
+    if mjpeg_server:
+        mjpeg_server.shutdown()
+
+    summary = stats.summary()
+    print_report(summary, elapsed)
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump({"args": vars(args), "elapsedSeconds": elapsed, **summary}, f, indent=2)
+        print(f"Results written to {args.json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
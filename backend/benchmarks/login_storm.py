@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Login Storm Benchmark
+Đo ảnh hưởng của một đợt login dồn dập (bcrypt) lên độ trễ của các request
+khác: một probe gọi GET /auth/me (async, đi qua event loop) đều đặn, trước
+và trong khi nhiều client đồng thời POST /auth/login.
+
+Báo cáo p50/p95/p99 của probe ở hai pha (baseline / storm), throughput và
+phân bố status code của login (200, 401, 429 rate limit, 503 pool bận).
+
+Ví dụ:
+    python benchmarks/login_storm.py --username admin1 --password admin1 \\
+        --concurrency 50 --duration 20
+
+    # Brute force một tài khoản (kiểm tra rate limit theo username/IP)
+    python benchmarks/login_storm.py --username admin1 --password admin1 --wrong-password
+
+Lưu ý: mọi request đến từ cùng một IP; để đo riêng tác động của bcrypt hãy
+tăng LOGIN_MAX_ATTEMPTS_PER_IP của server trong lúc chạy.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from typing import List, Optional
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def request(url: str, data: Optional[dict] = None, token: Optional[str] = None, timeout: float = 30):
+    """(status, body, latency giây)"""
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    body = json.dumps(data).encode() if data is not None else None
+    req = urllib.request.Request(url, data=body, headers=headers, method="POST" if body else "GET")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            payload = resp.read()
+            return resp.status, payload, time.perf_counter() - start
+    except urllib.error.HTTPError as e:
+        return e.code, e.read(), time.perf_counter() - start
+    except (urllib.error.URLError, OSError):
+        return 0, b"", time.perf_counter() - start
+
+
+def run_probe(url: str, token: str, rate: float, stop: threading.Event, latencies: List[float], errors: Counter):
+    interval = 1.0 / rate
+    next_at = time.perf_counter()
+    while not stop.is_set():
+        status, _, latency = request(url, token=token)
+        if status == 200:
+            latencies.append(latency * 1000)
+        else:
+            errors[status] += 1
+        next_at += interval
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            stop.wait(delay)
+        else:
+            next_at = time.perf_counter()
+
+
+def run_login_worker(url: str, username: str, password: str, stop: threading.Event,
+                     latencies: List[float], statuses: Counter, lock: threading.Lock):
+    while not stop.is_set():
+        status, _, latency = request(url, {"username": username, "password": password})
+        with lock:
+            statuses[status] += 1
+            latencies.append(latency * 1000)
+        if status in (429, 503):
+            stop.wait(0.05)  # Không spin khi bị từ chối
+
+
+def summary(values: List[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+
+def fmt(value: Optional[float]) -> str:
+    return f"{value:.1f}" if value is not None else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API latency under a login storm")
+    parser.add_argument("--base-url", default="http://localhost:8000/api/v1")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--concurrency", type=int, default=32, help="Số client login đồng thời")
+    parser.add_argument("--duration", type=float, default=15, help="Thời gian mỗi pha (giây)")
+    parser.add_argument("--probe-rate", type=float, default=20, help="Số request probe mỗi giây")
+    parser.add_argument("--wrong-password", action="store_true", help="Storm dùng mật khẩu sai (brute force)")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    login_url = f"{args.base_url}/auth/login"
+    probe_url = f"{args.base_url}/auth/me"
+
+    status, body, _ = request(login_url, {"username": args.username, "password": args.password})
+    if status != 200:
+        print(f"❌ Initial login failed ({status}): {body[:200]!r}")
+        sys.exit(1)
+    token = json.loads(body)["access_token"]
+
+    # Pha 1: baseline
+    print(f"⏱️  Baseline: probe {args.probe_rate}/s for {args.duration}s")
+    baseline, baseline_errors = [], Counter()
+    stop = threading.Event()
+    probe = threading.Thread(target=run_probe, args=(probe_url, token, args.probe_rate, stop, baseline, baseline_errors))
+    probe.start()
+    time.sleep(args.duration)
+    stop.set()
+    probe.join()
+
+    # Pha 2: storm
+    print(f"🌩️  Storm: {args.concurrency} login clients for {args.duration}s")
+    storm, storm_errors = [], Counter()
+    login_latencies, login_statuses, lock = [], Counter(), threading.Lock()
+    password = args.password + "-wrong" if args.wrong_password else args.password
+    stop = threading.Event()
+    threads = [threading.Thread(target=run_probe, args=(probe_url, token, args.probe_rate, stop, storm, storm_errors))]
+    threads += [
+        threading.Thread(
+            target=run_login_worker,
+            args=(login_url, args.username, password, stop, login_latencies, login_statuses, lock),
+            daemon=True,
+        )
+        for _ in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=35)
+
+    report = {
+        "probeBaselineMs": summary(baseline),
+        "probeStormMs": summary(storm),
+        "probeErrors": {"baseline": dict(baseline_errors), "storm": dict(storm_errors)},
+        "loginMs": summary(login_latencies),
+        "loginPerSecond": round(len(login_latencies) / args.duration, 1),
+        "loginStatuses": dict(login_statuses),
+    }
+
+    print("\n" + "=" * 64)
+    print(f"{'GET /auth/me (ms)':<28}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for name, key in (("baseline", "probeBaselineMs"), ("during login storm", "probeStormMs")):
+        s = report[key]
+        print(f"{name:<28}{fmt(s['p50']):>9}{fmt(s['p95']):>9}{fmt(s['p99']):>9}{fmt(s['max']):>9}")
+    s = report["loginMs"]
+    print(f"{'POST /auth/login':<28}{fmt(s['p50']):>9}{fmt(s['p95']):>9}{fmt(s['p99']):>9}{fmt(s['max']):>9}")
+    print("-" * 64)
+    print(f"login throughput: {report['loginPerSecond']}/s, statuses: {report['loginStatuses']}")
+    if baseline_errors or storm_errors:
+        print(f"probe errors: {report['probeErrors']}")
+    print("=" * 64)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+MQTT Replay
+Phát lại file capture (MQTT_CAPTURE_DIR, app/core/mqtt_capture.py) để tái hiện
+tải production và làm regression benchmark cho đường ingest.
+
+Hai đích:
+- broker:   publish lại lên broker (mosquitto local) - backend đang chạy xử lý
+            như traffic thật.
+- pipeline: đưa thẳng vào pipeline ingest trong process này (ingest_message
+            của app/core/mqtt.py, ghi vào MongoDB theo .env) - đo được latency
+            xử lý mà không cần broker. Lệnh sinh ra (automation, resync shadow)
+            không được gửi tới device. CHỈ dùng với DB local/staging.
+
+Tốc độ: --speed 1 (như lúc ghi), --speed N (nhanh gấp N), --speed 0 (tối đa).
+Thứ tự message giữ nguyên; khoảng cách thời gian chia cho speed.
+
+Ví dụ:
+    python benchmarks/mqtt_replay.py captures/mqtt-20260101-120000-42.cap --target broker --speed 10
+    python benchmarks/mqtt_replay.py captures/mqtt-20260101-120000-42.cap --target pipeline --speed 0 --json out.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.mqtt_capture import read_capture  # noqa: E402
+
+Message = Tuple[float, str, bytes]
+
+
+def load_messages(path: str, topics: List[str], limit: Optional[int]) -> List[Message]:
+    messages = []
+    for message in read_capture(path):
+        if topics and not any(message[1].startswith(prefix) for prefix in topics):
+            continue
+        messages.append(message)
+        if limit and len(messages) >= limit:
+            break
+    return messages
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))]
+
+
+class Pacer:
+    """Tính thời điểm phát theo speed, ghi lại độ trễ so với lịch"""
+
+    def __init__(self, first_ts: float, speed: float):
+        self.first_ts = first_ts
+        self.speed = speed
+        self.start = time.perf_counter()
+        self.lateness: List[float] = []
+
+    def delay(self, ts: float) -> float:
+        if self.speed <= 0:
+            return 0.0
+        return self.start + (ts - self.first_ts) / self.speed - time.perf_counter()
+
+    def sent(self, ts: float):
+        if self.speed > 0:
+            self.lateness.append(max(0.0, -self.delay(ts)))
+
+
+def replay_broker(messages: Iterable[Message], first_ts: float, args) -> dict:
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"mqtt-replay-{os.getpid()}")
+    client.connect(args.host, args.port, 60)
+    client.loop_start()
+    pacer = Pacer(first_ts, args.speed)
+    count = 0
+    last_info = None
+    for ts, topic, payload in messages:
+        wait = pacer.delay(ts)
+        if wait > 0:
+            time.sleep(wait)
+        last_info = client.publish(topic, payload, qos=args.qos)
+        pacer.sent(ts)
+        count += 1
+    if last_info is not None:
+        last_info.wait_for_publish(timeout=30)
+    elapsed = time.perf_counter() - pacer.start
+    client.loop_stop()
+    client.disconnect()
+    return {"messages": count, "seconds": elapsed, "lateness": pacer.lateness}
+
+
+async def replay_pipeline(messages: Iterable[Message], first_ts: float, args) -> dict:
+    from app.core.database import init_db
+    from app.core import mqtt as ingest
+    from app.core.metrics import MQTT_PROCESSING_LATENCY
+    from app.services.automation import automation_engine
+    from app.services.command_tracker import command_tracker
+    from app.services.device import DeviceService
+
+    await init_db()
+    await automation_engine.load()
+    # Lệnh phát sinh khi replay không được gửi tới device thật
+    command_tracker.configure(publish=lambda mac, payload: None, on_confirmed=DeviceService.on_command_confirmed)
+
+    pacer = Pacer(first_ts, args.speed)
+    tasks = []
+    count = 0
+    for ts, topic, payload in messages:
+        wait = pacer.delay(ts)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        coro = ingest.ingest_message(topic, payload, datetime.now(), time.perf_counter())
+        pacer.sent(ts)
+        if coro is None:
+            continue
+        tasks.append(asyncio.create_task(coro))
+        count += 1
+        if args.speed <= 0 and count % 200 == 0:
+            await asyncio.sleep(0)  # Cho các task đã tạo chạy, tránh dồn toàn bộ vào RAM
+    # Task mở hàng đợi của mỗi device chỉ xong khi hàng đợi đó hết message
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - pacer.start
+
+    processing = {}
+    for topic in ("device/new", "device/data/+"):
+        cumulative, total, samples = MQTT_PROCESSING_LATENCY.labels(topic).snapshot()
+        if samples:
+            processing[topic] = {
+                "count": samples,
+                "mean": total / samples,
+                "p50Bucket": _bucket_percentile(MQTT_PROCESSING_LATENCY.buckets, cumulative, samples, 50),
+                "p99Bucket": _bucket_percentile(MQTT_PROCESSING_LATENCY.buckets, cumulative, samples, 99),
+            }
+    return {"messages": count, "seconds": elapsed, "lateness": pacer.lateness, "processing": processing}
+
+
+def _bucket_percentile(buckets, cumulative, count: int, pct: float) -> Optional[float]:
+    """Cận trên của bucket chứa percentile (None nếu vượt bucket lớn nhất)"""
+    target = count * pct / 100
+    for bound, c in zip(buckets, cumulative):
+        if c >= target:
+            return bound
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured MQTT traffic into a broker or the ingestion pipeline")
+    parser.add_argument("capture", help="File .cap do MQTT_CAPTURE_DIR ghi ra")
+    parser.add_argument("--target", choices=("broker", "pipeline"), default="broker")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = như lúc ghi, N = nhanh gấp N, 0 = tối đa")
+    parser.add_argument("--topics", default="device/new,device/data/", help="Tiền tố topic cần phát lại (rỗng = tất cả)")
+    parser.add_argument("--limit", type=int, help="Chỉ phát N message đầu")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--qos", type=int, default=0, choices=(0, 1, 2))
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    topics = [prefix for prefix in args.topics.split(",") if prefix]
+    messages = load_messages(args.capture, topics, args.limit)
+    if not messages:
+        raise SystemExit("❌ No messages to replay")
+    first_ts, last_ts = messages[0][0], messages[-1][0]
+    total_bytes = sum(len(payload) for _, _, payload in messages)
+    speed = "max" if args.speed <= 0 else f"{args.speed:g}x"
+    print(f"📼 {len(messages)} messages ({total_bytes} payload bytes) spanning {last_ts - first_ts:.1f}s -> {args.target} at {speed}")
+
+    if args.target == "broker":
+        result = replay_broker(messages, first_ts, args)
+    else:
+        result = asyncio.run(replay_pipeline(messages, first_ts, args))
+
+    lateness = result.pop("lateness")
+    report = {
+        "target": args.target,
+        "speed": args.speed,
+        "capturedSeconds": last_ts - first_ts,
+        **result,
+        "throughput": result["messages"] / result["seconds"] if result["seconds"] else None,
+        "latenessP99": percentile(lateness, 99),
+        "latenessMax": max(lateness) if lateness else None,
+    }
+
+    print("\n" + "=" * 60)
+    print(f"replayed: {report['messages']} messages in {report['seconds']:.2f}s ({report['throughput']:.0f} msg/s)")
+    if lateness:
+        print(f"behind schedule: p99 {report['latenessP99'] * 1000:.1f} ms, max {report['latenessMax'] * 1000:.1f} ms")
+    for topic, stats in report.get("processing", {}).items():
+        p99 = f"<= {stats['p99Bucket'] * 1000:.0f} ms" if stats["p99Bucket"] is not None else "> max bucket"
+        print(f"{topic}: {stats['count']} handled, mean {stats['mean'] * 1000:.1f} ms, p99 {p99}")
+    print("=" * 60)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+MQTT Shared Subscription Check
+Kiểm tra với broker thật (mosquitto trong docker compose) rằng N instance
+backend ở chế độ MQTT_INGESTION_MODE=shared nhận các tập message rời nhau và
+đủ: mỗi message đúng một instance xử lý.
+
+Mỗi instance là một process chạy đúng code của backend (app/core/mqtt.py):
+client MQTT v5, topic filter từ ingestion_subscriptions(), on_message ->
+ingest_message -> hàng đợi theo device. Chỉ add_device / update_device_data
+được thay bằng hàm ghi lại (device, seq) theo thứ tự xử lý (không cần MongoDB).
+
+Mỗi device gửi device/new (seq -1) rồi các device/data. Kiểm tra thêm thứ tự:
+trong từng instance, message của một device được xử lý đúng thứ tự publish.
+Broker chia message theo từng message (mosquitto: round-robin) nên một device
+có thể bị chia cho nhiều instance - báo cáo số device như vậy; backend xử lý
+bằng điều kiện lastSeen khi ghi. Với broker chia theo topic (EMQX
+shared_subscription_strategy = hash_topic) dùng --require-affinity để kiểm
+tra mỗi device chỉ về một instance.
+
+Exit code 1 nếu có message bị mất/trùng/sai thứ tự (dùng được trong CI).
+
+Ví dụ:
+    python benchmarks/mqtt_shared_check.py --instances 3 --devices 20 --messages 50
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import paho.mqtt.client as mqtt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run_instance(index: int, host: str, port: int, group: str, ready, stop, counter, results):
+    """Một instance backend (chạy trong process riêng)"""
+    import asyncio
+    from app.core.config import settings
+
+    # Phải đặt trước khi import app.core.mqtt: chế độ shared và protocol được chọn lúc import
+    settings.MQTT_BROKER, settings.MQTT_PORT = host, port
+    settings.MQTT_INGESTION_MODE, settings.MQTT_SHARED_GROUP = "shared", group
+    from app.core import mqtt as ingest
+
+    received: List[Tuple[str, int]] = []
+
+    def record(mac: str, seq: int):
+        received.append((mac, seq))
+        with counter.get_lock():
+            counter.value += 1
+
+    async def add_device(payload: str, received_at=None):
+        record(json.loads(payload)["controllerMAC"], -1)
+
+    async def update_device_data(device_id: str, payload, received_at=None, live: bool = True):
+        record(device_id, json.loads(payload)["seq"])
+
+    ingest.add_device = add_device
+    ingest.update_device_data = update_device_data
+
+    async def main():
+        subacks = 0
+
+        def on_subscribe(*args):
+            nonlocal subacks
+            subacks += 1
+            if subacks > len(ingest.INGESTION_TOPICS):  # ACK_TOPIC + các topic ingest
+                ready.set()
+
+        ingest.client.on_subscribe = on_subscribe
+        ingest.set_ingestion(True)
+        ingest.connect_mqtt()
+        while not stop.is_set():
+            await asyncio.sleep(0.05)
+        while ingest._pending:
+            await asyncio.sleep(0.05)
+        ingest.disconnect_mqtt()
+
+    asyncio.run(main())
+    results.put((index, ingest.ingestion_subscriptions(), received))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify MQTT v5 shared subscriptions split ingestion across instances")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--group", default="smarthome-ingest-check", help="Không trùng MQTT_SHARED_GROUP của backend đang chạy")
+    parser.add_argument("--instances", type=int, default=3)
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=50, help="Số message mỗi device")
+    parser.add_argument("--qos", type=int, default=1, choices=(0, 1, 2))
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--require-affinity", action="store_true", help="Mỗi device chỉ được về một instance")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    run_id = uuid.uuid4().hex[:8]
+    ctx = multiprocessing.get_context("spawn")
+    ready = [ctx.Event() for _ in range(args.instances)]
+    stop = ctx.Event()
+    counter = ctx.Value("i", 0)
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=run_instance, args=(i, args.host, args.port, args.group, ready[i], stop, counter, results))
+        for i in range(args.instances)
+    ]
+    for process in processes:
+        process.start()
+    for i, event in enumerate(ready):
+        if not event.wait(30):
+            stop.set()
+            raise SystemExit(f"❌ Instance {i} could not subscribe to the ingestion topics")
+
+    publisher = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"shared-check-pub-{run_id}", protocol=mqtt.MQTTv5)
+    publisher.connect(args.host, args.port, 60)
+    publisher.loop_start()
+
+    devices = [f"check-{run_id}-{d}" for d in range(args.devices)]
+    total = len(devices) * (args.messages + 1)
+    print(f"📤 Publishing {total} messages ({args.devices} devices x (1 + {args.messages})) to {args.instances} instances")
+    start = time.perf_counter()
+    for name in devices:
+        publisher.publish("device/new", json.dumps({"name": name, "type": "SENSOR", "controllerMAC": name}), qos=args.qos)
+    # Xen kẽ các device như nhiều ESP32 gửi cùng lúc
+    for seq in range(args.messages):
+        for name in devices:
+            publisher.publish(f"device/data/{name}", json.dumps({"name": name, "seq": seq}), qos=args.qos)
+
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        if counter.value >= total:
+            break
+        time.sleep(0.05)
+    time.sleep(0.5)  # Bắt message trùng đến muộn
+    elapsed = time.perf_counter() - start
+    publisher.loop_stop()
+    publisher.disconnect()
+    stop.set()
+
+    received: Dict[int, List[Tuple[str, int]]] = {}
+    topic_filters: List[str] = []
+    for _ in processes:
+        try:
+            index, topic_filters, messages = results.get(timeout=30)
+        except queue.Empty:
+            break
+        received[index] = messages
+    for process in processes:
+        process.join(timeout=10)
+    if len(received) < args.instances:
+        raise SystemExit(f"❌ Only {len(received)}/{args.instances} instances reported results")
+    print(f"📥 Instances subscribed to: {', '.join(topic_filters)}")
+
+    # Kiểm tra rời nhau + đủ, thứ tự theo device trong từng instance
+    owners: Dict[Tuple[str, int], List[int]] = defaultdict(list)
+    out_of_order = 0
+    device_instances: Dict[str, set] = defaultdict(set)
+    for index, messages in received.items():
+        last_seq: Dict[str, int] = {}
+        for name, seq in messages:
+            owners[(name, seq)].append(index)
+            device_instances[name].add(index)
+            if seq <= last_seq.get(name, -2):
+                out_of_order += 1
+            last_seq[name] = seq
+
+    expected = {(name, seq) for name in devices for seq in range(-1, args.messages)}
+    missing = len(expected - owners.keys())
+    duplicated = sum(1 for instances in owners.values() if len(instances) > 1)
+    split_devices = sum(1 for instances in device_instances.values() if len(instances) > 1)
+
+    report = {
+        "instances": args.instances,
+        "published": total,
+        "topicFilters": topic_filters,
+        "perInstance": [len(received[i]) for i in range(args.instances)],
+        "missing": missing,
+        "duplicated": duplicated,
+        "outOfOrder": out_of_order,
+        "devicesSplitAcrossInstances": split_devices,
+        "seconds": round(elapsed, 3),
+    }
+
+    print("\n" + "=" * 60)
+    for index in range(args.instances):
+        print(f"instance {index}: {len(received[index])} messages")
+    print("-" * 60)
+    print(f"missing: {missing}, duplicated: {duplicated}, out of order: {out_of_order}")
+    print(f"devices split across instances: {split_devices}/{len(devices)}")
+    print(f"throughput: {total / elapsed:.0f} msg/s")
+    print("=" * 60)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Results written to {args.json}")
+
+    failures = []
+    if missing:
+        failures.append(f"{missing} messages were not delivered to any instance")
+    if duplicated:
+        failures.append(f"{duplicated} messages were delivered to more than one instance")
+    if out_of_order:
+        failures.append(f"{out_of_order} messages arrived out of order within an instance")
+    if args.instances > 1 and max(report["perInstance"]) == total:
+        failures.append("all messages went to one instance (broker does not support shared subscriptions?)")
+    if args.require_affinity and split_devices:
+        failures.append(f"{split_devices} devices were split across instances")
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        sys.exit(1)
+    print("✅ Instances processed disjoint, complete message sets")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Startup Check
+Đo thời gian import và RSS của API process (import app.main) trong process
+mới, liệt kê các package import chậm nhất (python -X importtime), và kiểm tra
+ngân sách khởi động: quá thời gian/RSS hoặc đã kéo theo thư viện nặng của
+camera (torch, ultralytics, cv2...) thì exit code 1 - dùng được trong CI.
+
+Chạy từ thư mục backend (cần .env như khi chạy server):
+    python benchmarks/startup_check.py
+    python benchmarks/startup_check.py --runs 5 --budget-seconds 1.5 --budget-rss-mb 150
+
+    # So sánh chi phí stack detection (import torch/ultralytics + load model)
+    python benchmarks/startup_check.py --module app.services.detector --preload-detector --no-budget
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ("torch", "ultralytics", "cv2", "numpy", "onnxruntime", "openvino")
+
+_CHILD = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+import_seconds = time.perf_counter() - start
+preload_seconds = None
+if {preload}:
+    from app.services.detector import preload_backend
+    start = time.perf_counter()
+    preload_backend()
+    preload_seconds = time.perf_counter() - start
+rss_mb = None
+try:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss_mb = int(line.split()[1]) / 1024
+except OSError:
+    pass
+print(json.dumps({{
+    "importSeconds": import_seconds,
+    "preloadSeconds": preload_seconds,
+    "rssMb": rss_mb,
+    "maxRssMb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavyModules": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+
+def run_once(module: str, preload: bool):
+    code = _CHILD.format(module=module, preload=preload, heavy=HEAVY_MODULES)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        tail = "\n".join(proc.stderr.strip().splitlines()[-15:])
+        raise SystemExit(f"❌ import {module} failed:\n{tail}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    return result, proc.stderr
+
+
+def top_packages(importtime_output: str, limit: int):
+    """Tổng thời gian import 'self' theo package gốc (ms)"""
+    totals = defaultdict(int)
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, _, name = [part.strip() for part in line[len("import time:"):].split("|")]
+            totals[name.split(".")[0]] += int(self_us)
+        except ValueError:
+            continue
+    ordered = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+    return [(name, us / 1000) for name, us in ordered[:limit]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API import time/RSS and enforce a startup budget")
+    parser.add_argument("--module", default="app.main", help="Module cần đo (mặc định app.main)")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15, help="Số package chậm nhất in ra")
+    parser.add_argument("--preload-detector", action="store_true", help="Đo thêm preload_backend() (stack detection)")
+    parser.add_argument("--budget-seconds", type=float, default=2.0)
+    parser.add_argument("--budget-rss-mb", type=float, default=200)
+    parser.add_argument("--forbid", default="torch,ultralytics,cv2", help="Module không được import khi khởi động API")
+    parser.add_argument("--no-budget", action="store_true", help="Chỉ báo cáo, không kiểm tra ngân sách")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    runs = []
+    importtime_output = ""
+    for i in range(args.runs):
+        result, importtime_output = run_once(args.module, args.preload_detector)
+        runs.append(result)
+        print(f"run {i + 1}: import {result['importSeconds']:.3f}s, RSS {result['rssMb'] or result['maxRssMb']:.0f} MB")
+
+    last = runs[-1]
+    report = {
+        "module": args.module,
+        "runs": args.runs,
+        "importSecondsMedian": statistics.median(r["importSeconds"] for r in runs),
+        "rssMbMedian": statistics.median((r["rssMb"] or r["maxRssMb"]) for r in runs),
+        "preloadSecondsMedian": (
+            statistics.median(r["preloadSeconds"] for r in runs) if args.preload_detector else None
+        ),
+        "heavyModules": last["heavyModules"],
+        "topPackagesMs": top_packages(importtime_output, args.top),
+    }
+
+    print("\n" + "=" * 60)
+    print(f"import {args.module}: {report['importSecondsMedian']:.3f}s (median of {args.runs})")
+    print(f"RSS after import: {report['rssMbMedian']:.0f} MB")
+    if report["preloadSecondsMedian"] is not None:
+        print(f"detector preload: {report['preloadSecondsMedian']:.3f}s")
+    print(f"heavy modules loaded: {', '.join(report['heavyModules']) or '-'}")
+    print("-" * 60)
+    for name, ms in report["topPackagesMs"]:
+        print(f"{name:<40}{ms:>12.1f} ms")
+    print("=" * 60)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Results written to {args.json}")
+
+    if args.no_budget:
+        return
+    failures = []
+    if report["importSecondsMedian"] > args.budget_seconds:
+        failures.append(f"import time {report['importSecondsMedian']:.2f}s > {args.budget_seconds}s")
+    if report["rssMbMedian"] > args.budget_rss_mb:
+        failures.append(f"RSS {report['rssMbMedian']:.0f} MB > {args.budget_rss_mb} MB")
+    forbidden = [m for m in args.forbid.split(",") if m.strip() and m.strip() in report["heavyModules"]]
+    if forbidden:
+        failures.append(f"forbidden modules imported at startup: {', '.join(forbidden)}")
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        sys.exit(1)
+    print("✅ Startup budget OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Telemetry Codec Benchmark
+So sánh payload device/data dạng JSON (hiện tại) với khung nhị phân bin1
+(app/core/telemetry.py) trên các payload điển hình của từng loại device:
+
+- Thời gian giải mã mỗi message (decode_telemetry, như update_device_data gọi)
+- Số byte payload và số byte trên đường truyền (PUBLISH QoS 0 của MQTT 3.1.1:
+  fixed header + topic + payload)
+
+Nếu đã cài msgpack / cbor2 thì đo thêm để tham khảo (backend không dùng).
+
+Ví dụ:
+    python benchmarks/telemetry_codec_bench.py --iterations 200000 --json codec.json
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.telemetry import decode_telemetry, encode_bin1  # noqa: E402
+
+TOPIC = "device/data/SENSOR_A1B2"
+
+SAMPLES = {
+    # ESP32-Sensor (không có name)
+    "sensor": {"temperature": 27.35, "humidity": 64.2},
+    # ESP32-Fan
+    "fan": {"name": "Fan 1", "state": "ON", "speed": 2},
+    # Controller nhiều device, đủ trường
+    "full": {"name": "Living Room Sensor", "temperature": -3.5, "humidity": 88.1, "state": "OFF", "speed": 0},
+}
+
+
+def wire_bytes(payload: bytes) -> int:
+    """PUBLISH QoS 0: 1 byte header + remaining length (varint) + 2 byte độ dài topic + topic + payload"""
+    remaining = 2 + len(TOPIC) + len(payload)
+    varint = 1 if remaining < 128 else 2 if remaining < 16384 else 3
+    return 1 + varint + remaining
+
+
+def optional_codecs():
+    codecs = {}
+    try:
+        import msgpack
+        codecs["msgpack"] = (msgpack.packb, msgpack.unpackb)
+    except ImportError:
+        pass
+    try:
+        import cbor2
+        codecs["cbor"] = (cbor2.dumps, cbor2.loads)
+    except ImportError:
+        pass
+    return codecs
+
+
+def measure(fn, iterations: int) -> float:
+    """ns mỗi lần gọi, lấy lần chạy nhanh nhất trong 3"""
+    return min(timeit.repeat(fn, number=iterations, repeat=3)) / iterations * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare JSON and bin1 telemetry decode cost and size")
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    extra = optional_codecs()
+    results = {}
+    for sample_name, data in SAMPLES.items():
+        payloads = {
+            "json": json.dumps(data).encode(),
+            "bin1": encode_bin1(data),
+        }
+        # Kiểm tra bin1 giải mã ra đúng dữ liệu (sai số x100)
+        decoded, _ = decode_telemetry(payloads["bin1"])
+        for key, value in data.items():
+            expected = round(value, 2) if isinstance(value, float) else value
+            assert decoded[key] == expected, (sample_name, key, decoded[key], expected)
+
+        row = {}
+        for encoding, payload in payloads.items():
+            row[encoding] = {
+                "payloadBytes": len(payload),
+                "wireBytes": wire_bytes(payload),
+                "decodeNs": measure(lambda p=payload: decode_telemetry(p), args.iterations),
+            }
+        for name, (dumps, loads) in extra.items():
+            payload = dumps(data)
+            row[name] = {
+                "payloadBytes": len(payload),
+                "wireBytes": wire_bytes(payload),
+                "decodeNs": measure(lambda p=payload, f=loads: f(p), args.iterations),
+            }
+        results[sample_name] = row
+
+    print("\n" + "=" * 72)
+    print(f"{'sample':<8} {'encoding':<9} {'payload B':>10} {'wire B':>8} {'decode ns':>10} {'vs json':>9}")
+    print("-" * 72)
+    for sample_name, row in results.items():
+        base = row["json"]["decodeNs"]
+        for encoding, stats in row.items():
+            print(
+                f"{sample_name:<8} {encoding:<9} {stats['payloadBytes']:>10} {stats['wireBytes']:>8} "
+                f"{stats['decodeNs']:>10.0f} {base / stats['decodeNs']:>8.1f}x"
+            )
+    print("=" * 72)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"iterations": args.iterations, "results": results}, f, indent=2)
+        print(f"📄 Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()